@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""Streaming compressed tarballs for upload without writing them to disk.
+
+A tar stream is compressed on several cores and cut into fixed-size chunks,
+which are handed to uploader threads through a bounded queue, so memory use
+is limited to a few chunks and compression overlaps with the upload.
+"""
+
+from __future__ import division, print_function
+import collections
+import hashlib
+import os
+import queue
+import tarfile
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class ParallelGzipWriter(object):
+    """Write-only file object that gzips data in blocks on a thread pool.
+
+    Each block is compressed independently as a complete gzip member, so the
+    output is a multi-member gzip file, which `gzip`, `tarfile` and `gunzip`
+    read as one stream. zlib releases the GIL while compressing, so blocks
+    are compressed in parallel. At most `2*nthreads` blocks are in flight.
+    The output only depends on the input, so compressing the same data
+    twice gives identical bytes.
+    """
+    def __init__(self, fileobj, level=6, blocksize=2**20, nthreads=None):
+        self.fileobj = fileobj
+        self.level = level
+        self.blocksize = blocksize
+        self.nthreads = nthreads or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(max_workers=self.nthreads)
+        self.pending = collections.deque()
+        self.buffer = bytearray()
+        self.closed = False
+
+    def _compress(self, block):
+        # wbits = 31 writes a gzip header and trailer
+        c = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return c.compress(block) + c.flush()
+
+    def _submit(self, block):
+        while len(self.pending) >= 2*self.nthreads:
+            self.fileobj.write(self.pending.popleft().result())
+        self.pending.append(self.pool.submit(self._compress, block))
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.blocksize:
+            self._submit(bytes(self.buffer[:self.blocksize]))
+            del self.buffer[:self.blocksize]
+        return len(data)
+
+    def close(self):
+        """Compress remaining data and wait for all blocks to be written.
+        The underlying file object is left open."""
+        if self.closed:
+            return
+        if self.buffer:
+            self._submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        while self.pending:
+            self.fileobj.write(self.pending.popleft().result())
+        self.pool.shutdown()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ChunkedUploadStream(object):
+    """Write-only file object that cuts its input into `chunksize` chunks
+    and passes them to `upload_chunk(index, offset, data)`.
+
+    Chunks are queued for `nthreads` uploader threads in a queue holding at
+    most `maxchunks` chunks, so a writer faster than the upload blocks
+    rather than buffering. Use `nthreads=1` for APIs that need chunks in
+    order. An error in an uploader is raised by the next `write` or by
+    `close`.
+    """
+    def __init__(self, upload_chunk, chunksize=2**23, maxchunks=4,
+                 nthreads=1):
+        self.upload_chunk = upload_chunk
+        self.chunksize = chunksize
+        self.queue = queue.Queue(maxsize=maxchunks)
+        self.buffer = bytearray()
+        self.index = 0
+        self.offset = 0
+        self.error = None
+        self.closed = False
+        self.threads = [threading.Thread(target=self._work)
+                        for n in range(nthreads)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                # Keep draining so the writer does not block
+                continue
+            try:
+                self.upload_chunk(*item)
+            except BaseException as e:
+                self.error = e
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def _put(self, data):
+        self.queue.put((self.index, self.offset, data))
+        self.index += 1
+        self.offset += len(data)
+
+    def write(self, data):
+        self._check()
+        self.buffer += data
+        while len(self.buffer) >= self.chunksize:
+            self._put(bytes(self.buffer[:self.chunksize]))
+            del self.buffer[:self.chunksize]
+        return len(data)
+
+    def close(self, abort=False):
+        """Send the last partial chunk and wait for all uploads. If `abort`
+        is `True`, queued chunks are discarded instead."""
+        if self.closed:
+            return
+        self.closed = True
+        if abort and self.error is None:
+            self.error = RuntimeError("Upload aborted")
+        elif self.buffer:
+            self._put(bytes(self.buffer))
+            self.buffer = bytearray()
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if not abort:
+            self._check()
+
+    @property
+    def size(self):
+        """Number of bytes written so far."""
+        return self.offset + len(self.buffer)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        self.close(abort=exc_type is not None)
+
+
+class HashingSink(object):
+    """Write-only file object that only keeps the size and MD5 of what is
+    written to it."""
+    def __init__(self):
+        self.size = 0
+        self.md5 = hashlib.md5()
+
+    def write(self, data):
+        self.size += len(data)
+        self.md5.update(data)
+        return len(data)
+
+    def hexdigest(self):
+        return self.md5.hexdigest()
+
+
+def open_compressor(fileobj, compression="gz", level=None, nthreads=None):
+    """Return a write-only file object compressing into `fileobj` with
+    `compression` either `"gz"` (parallel block gzip) or `"zst"`, which
+    requires the `zstandard` package."""
+    if compression == "gz":
+        return ParallelGzipWriter(fileobj, level=6 if level is None else level,
+                                  nthreads=nthreads)
+    elif compression == "zst":
+        if zstandard is None:
+            raise ImportError("zstd compression requires `zstandard`")
+        cctx = zstandard.ZstdCompressor(level=3 if level is None else level,
+                                        threads=nthreads or -1)
+        return cctx.stream_writer(fileobj, closefd=False)
+    else:
+        raise ValueError("Unknown compression: {}".format(compression))
+
+
+def stream_archive(directory, fileobj, files="all", compression="gz",
+                   level=None, nthreads=None, verbose=True):
+    """Write a compressed tarball of `directory` (or only `files` in it) to
+    `fileobj`. Members are named as by `tarfile.add` on
+    `os.path.join(directory, f)`, as in the archives written by
+    `compress_dir`. Returns the number of compressed bytes written if
+    `fileobj` has a `size` attribute."""
+    if files == "all":
+        files = sorted(os.listdir(directory))
+    comp = open_compressor(fileobj, compression=compression, level=level,
+                           nthreads=nthreads)
+    with tarfile.open(fileobj=comp, mode="w|") as tf:
+        for f in files:
+            if verbose:
+                print("Adding {} to {}.{}".format(f, directory, compression))
+            tf.add(os.path.join(directory, f))
+    comp.close()
+    return getattr(fileobj, "size", None)
+
+
+def archive_size_md5(directory, **kwargs):
+    """Compress `directory` as by `stream_archive` without keeping the
+    output, and return its size and hex MD5."""
+    sink = HashingSink()
+    stream_archive(directory, sink, **kwargs)
+    return sink.size, sink.hexdigest()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""Time averaging of written fields, replacing OpenFOAM's `fieldAverage`.
+
+Each written time is read in turn, memory mapped with `fields.read_field`,
+and folded into time-weighted running means and second moments (West's
+weighted form of Welford's update), a block of cells at a time. Only the
+final mean fields are written. The accumulators are `.npy` files memory
+mapped and updated in place, so neither they nor the fields need to fit in
+memory. They are flushed after every time before the state file records it,
+so averaging resumes where it stopped when more times are written. The
+state file marks a time as in progress while the accumulators are being
+updated, and averaging starts over if that update was interrupted.
+"""
+
+from __future__ import division, print_function
+import numpy as np
+import json
+import os
+import re
+from . import fields as foamfields
+from .timedirs import TimeIndex
+
+# Fields to average and whether their `Prime2Mean` is wanted, as in
+# `system/controlDict.average`
+default_fields = {"U": True, "p": False, "nut": False, "k": False}
+
+# Components of a symmetric tensor in OpenFOAM order
+symm_index = [(0, 0), (0, 1), (0, 2), (1, 1), (1, 2), (2, 2)]
+
+
+def _list_times(casedir):
+    """Return written time directory names after `0`, in numerical order,
+    from the case's `TimeIndex` or, if not reconstructed, from that of
+    `processor0`."""
+    times = TimeIndex(casedir).times()
+    if not times:
+        procdirs = foamfields.list_processor_dirs(casedir)
+        if procdirs:
+            times = TimeIndex(procdirs[0]).times()
+    return times
+
+
+class FieldAverager(object):
+    """Time-weighted means of fields over written times after
+    `time_start`.
+
+    Each time is weighted by the time since the previous one (or since
+    `time_start`), matching `fieldAverage` with `base time` for a constant
+    write interval. Accumulators are kept in `state_dir`.
+    """
+    def __init__(self, casedir="./", fields=None, time_start=5.0,
+                 state_dir="postProcessing/cache/average", blocksize=2**18):
+        self.casedir = casedir
+        self.fields = default_fields if fields is None else fields
+        self.time_start = time_start
+        self.state_dir = os.path.join(casedir, state_dir)
+        self.blocksize = blocksize
+        self.times = []
+        self.weight = 0.0
+        self.mean = {}
+        self.m2 = {}
+        self.load_state()
+
+    @property
+    def t_last(self):
+        return float(self.times[-1]) if self.times else self.time_start
+
+    def _accumulator(self, fname, shape=None):
+        """Memory map the accumulator file `fname`, creating it filled with
+        zeros if `shape` is given."""
+        fpath = os.path.join(self.state_dir, fname + ".npy")
+        if shape is None:
+            return np.lib.format.open_memmap(fpath, mode="r+")
+        return np.lib.format.open_memmap(fpath, mode="w+", dtype=float,
+                                         shape=shape)
+
+    def load_state(self):
+        """Load saved accumulators if they match the current settings."""
+        fpath = os.path.join(self.state_dir, "state.json")
+        if not os.path.isfile(fpath):
+            return
+        with open(fpath) as f:
+            state = json.load(f)
+        if state["time_start"] != self.time_start \
+                or state["fields"] != self.fields:
+            return
+        if state.get("updating") is not None:
+            print("Averaging of time {} was interrupted; starting over"
+                  .format(state["updating"]))
+            return
+        self.times = state["times"]
+        self.weight = state["weight"]
+        for name, prime2 in self.fields.items():
+            self.mean[name] = self._accumulator(name + "Mean")
+            if prime2:
+                self.m2[name] = self._accumulator(name + "M2")
+
+    def _write_state(self, updating=None):
+        if not os.path.isdir(self.state_dir):
+            os.makedirs(self.state_dir)
+        fpath = os.path.join(self.state_dir, "state.json")
+        with open(fpath + ".tmp", "w") as f:
+            json.dump({"time_start": self.time_start, "fields": self.fields,
+                       "times": self.times, "weight": self.weight,
+                       "updating": updating}, f, indent=4)
+        os.replace(fpath + ".tmp", fpath)
+
+    def save_state(self):
+        """Flush the accumulators, then record the times they include."""
+        for a in list(self.mean.values()) + list(self.m2.values()):
+            a.flush()
+        self._write_state()
+
+    def add_time(self, time):
+        """Fold the fields at `time` into the averages."""
+        w = float(time) - max(self.t_last, self.time_start)
+        if w <= 0:
+            return
+        # Saved state no longer matches the accumulators until `save_state`
+        self._write_state(updating=str(time))
+        weight = self.weight + w
+        for name, prime2 in self.fields.items():
+            x = foamfields.read_field(name, time, casedir=self.casedir)
+            if name not in self.mean:
+                self.mean[name] = self._accumulator(name + "Mean", x.shape)
+                if prime2:
+                    ncomp = 6 if x.ndim == 2 else 1
+                    self.m2[name] = self._accumulator(
+                            name + "M2", x.shape[:1] + (ncomp,))
+            mean = self.mean[name]
+            for i in range(0, len(x), self.blocksize):
+                s = slice(i, i + self.blocksize)
+                xb = np.asarray(x[s], dtype=float)
+                delta = xb - mean[s]
+                mean[s] += delta*(w/weight)
+                if prime2:
+                    # delta_i*(x_j - new mean_j) keeps the co-moment update
+                    # exact and symmetric
+                    delta2 = xb - mean[s]
+                    m2 = self.m2[name]
+                    if xb.ndim == 1:
+                        m2[s, 0] += w*delta*delta2
+                    else:
+                        for k, (a, b) in enumerate(symm_index):
+                            m2[s, k] += w*delta[:, a]*delta2[:, b]
+        self.weight = weight
+        self.times.append(str(time))
+
+    def update(self, save=True, verbose=False):
+        """Add all written times after the last one averaged, saving the
+        state after each unless `save` is `False`, in which case the saved
+        state is only valid after `save_state` is called. Returns the list
+        of times added."""
+        added = []
+        for time in _list_times(self.casedir):
+            if float(time) <= self.t_last:
+                continue
+            if verbose:
+                print("Averaging time {}".format(time))
+            self.add_time(time)
+            added.append(time)
+            if save:
+                self.save_state()
+        return added
+
+    def prime2_mean(self, name):
+        """Return the weighted (population) second moment of `name`
+        about its mean, as `fieldAverage` writes it."""
+        m2 = self.m2[name]/self.weight
+        return m2[:, 0] if m2.shape[1] == 1 else m2
+
+    def write(self, time=None, fmt=None):
+        """Write `<field>Mean` and `<field>Prime2Mean` files into the
+        directory of `time` (default the last time averaged). Boundary
+        entries are copied from the field at that time, or from `0`;
+        `Prime2Mean` patches are `calculated` and zero except for
+        constraint types."""
+        if time is None:
+            time = self.times[-1]
+        outdir = os.path.join(self.casedir, str(time))
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        for name, prime2 in self.fields.items():
+            template = os.path.join(outdir, name)
+            if not os.path.isfile(template):
+                template = os.path.join(self.casedir, "0", name)
+            header = foamfields.read_header(template)
+            fmt_name = header.get("format", "ascii") if fmt is None else fmt
+            dims = foamfields.read_entry(template, "dimensions")
+            boundary = foamfields.read_entry(template, "boundaryField")
+            cls = header["class"]
+            foamfields.write_field(os.path.join(outdir, name + "Mean"),
+                                   self.mean[name], cls, dims, boundary,
+                                   fmt=fmt_name)
+            if prime2:
+                m2 = self.prime2_mean(name)
+                cls2 = "volSymmTensorField" if m2.ndim == 2 \
+                       else "volScalarField"
+                exps = re.search(rb"\[([^\]]*)\]", dims).group(1).split()
+                dims2 = "[" + " ".join("{:g}".format(2*float(e))
+                                       for e in exps) + "]"
+                zero = "(0 0 0 0 0 0)" if m2.ndim == 2 else "0"
+                lines = ["boundaryField", "{"]
+                for patch, typ in foamfields.boundary_patches(template):
+                    lines += ["    {}".format(patch), "    {"]
+                    if typ in foamfields.constraint_types:
+                        lines.append("        type            {};"
+                                     .format(typ))
+                    else:
+                        lines += ["        type            calculated;",
+                                  "        value           uniform {};"
+                                  .format(zero)]
+                    lines += ["    }", ""]
+                lines.append("}")
+                foamfields.write_field(
+                        os.path.join(outdir, name + "Prime2Mean"), m2, cls2,
+                        dims2, "\n".join(lines).encode(), fmt=fmt_name)
+
+
+def average_fields(casedir="./", time_start=5.0, fields=None, write=True,
+                   verbose=True):
+    """Average all written times after `time_start`, resuming from saved
+    accumulators, and write the mean fields to the latest time averaged.
+    Returns the `FieldAverager`."""
+    averager = FieldAverager(casedir, fields=fields, time_start=time_start)
+    added = averager.update(verbose=verbose)
+    if verbose:
+        print("Averaged {} times ({} new) from t = {} to {}".format(
+                len(averager.times), len(added), time_start,
+                averager.t_last))
+    if write and averager.times:
+        averager.write()
+    return averager
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""Batch post-processing of many case directories, e.g., for mesh and time
+step convergence studies."""
+
+from __future__ import division, print_function
+import pandas as pd
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from . import processing
+from .forces import get_forces_files
+
+
+# Files, relative to a case root, that the results for a case depend on
+input_files = ["log.checkMesh",
+               "log.yPlus",
+               "constant/polyMesh/blockMeshDict",
+               "constant/dynamicMeshDict",
+               "constant/thetaTable",
+               "system/snappyHexMeshDict",
+               "system/fvSchemes",
+               "system/controlDict"]
+
+
+def expand_cases(cases):
+    """Expand a glob pattern or list of patterns/paths into a sorted list of
+    case directories."""
+    if isinstance(cases, str):
+        cases = [cases]
+    casedirs = []
+    for pattern in cases:
+        matches = glob.glob(pattern) if glob.has_magic(pattern) else [pattern]
+        casedirs += [os.path.normpath(m) for m in matches if os.path.isdir(m)]
+    return sorted(set(casedirs))
+
+
+def get_fingerprint(casedir):
+    """Return a dict of `[mtime, size]` of every input file of a case, which
+    changes whenever the case needs to be reprocessed."""
+    fpaths = [os.path.join(casedir, f) for f in input_files] \
+           + get_forces_files(casedir)
+    fingerprint = {}
+    for fpath in fpaths:
+        try:
+            st = os.stat(fpath)
+        except OSError:
+            continue
+        fingerprint[os.path.relpath(fpath, casedir)] = [st.st_mtime,
+                                                        st.st_size]
+    return fingerprint
+
+
+def process_case(casedir):
+    """Compute the performance log row for a single case. Errors are caught
+    and returned so one broken case does not stop the batch."""
+    try:
+        return processing.get_perf_log_row(casedir=casedir), None
+    except Exception as e:
+        return None, "{}: {}".format(type(e).__name__, e)
+
+
+def batch_log_perf(cases, results_file="processed/batch_perf.csv",
+                   nprocs=None, force=False, verbose=True):
+    """Log mean performance and case parameters of many case directories to
+    a single CSV table with one row per case.
+
+    `cases` is a glob pattern or list of patterns/paths of case roots. Cases
+    are processed in a pool of `nprocs` processes. The input file
+    fingerprint and results of each case are kept in a JSON file next to
+    `results_file`, and cases whose inputs have not changed since the last
+    batch are skipped unless `force` is `True`. Returns the table as a
+    `DataFrame`.
+    """
+    casedirs = expand_cases(cases)
+    state_file = os.path.splitext(results_file)[0] + ".json"
+    if os.path.isfile(state_file):
+        with open(state_file) as f:
+            state = json.load(f)
+    else:
+        state = {}
+    fingerprints = {c: get_fingerprint(c) for c in casedirs}
+    todo = [c for c in casedirs if force or c not in state
+            or state[c]["fingerprint"] != fingerprints[c]]
+    if verbose:
+        print("Processing {} of {} cases".format(len(todo), len(casedirs)))
+    with ProcessPoolExecutor(max_workers=nprocs) as pool:
+        for casedir, (row, error) in zip(todo, pool.map(process_case, todo)):
+            if error is not None:
+                print("Skipping {} ({})".format(casedir, error))
+                state.pop(casedir, None)
+                continue
+            state[casedir] = {"fingerprint": fingerprints[casedir],
+                              "row": row}
+    results_dir = os.path.dirname(results_file)
+    if results_dir and not os.path.isdir(results_dir):
+        os.makedirs(results_dir)
+    with open(state_file, "w") as f:
+        json.dump(state, f, indent=4, default=float)
+    rows = [dict(case=c, **state[c]["row"]) for c in casedirs if c in state]
+    df = pd.DataFrame(rows, columns=["case"] + processing.perf_log_columns)
+    df.to_csv(results_file, index=False)
+    return df
@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+"""Benchmarks of the post-processing stack on synthetic cases.
+
+`make_case` writes an OpenFOAM-like case tree (`forces` output, the `omega`
+table in `constant/dynamicMeshDict`, time directories, sampled sets and the
+logs read by `log_perf` and `read_funky_log`) at a configurable scale, with
+the dictionaries copied from this case. No OpenFOAM installation is needed.
+
+`run_benchmarks` times each benchmark with `profiling`, and results are
+appended to a JSON file so runs can be compared with `compare_runs`.
+"""
+
+from __future__ import division, print_function
+import numpy as np
+import datetime
+import json
+import os
+import platform
+import shutil
+import tempfile
+import traceback
+from . import profiling
+
+# Scale knobs of the synthetic case
+scales = {
+    "small": {"nsteps": 20000, "ntimes": 20, "nz": 10, "ny": 100,
+              "nlog": 1000},
+    "medium": {"nsteps": 500000, "ntimes": 200, "nz": 26, "ny": 500,
+               "nlog": 100000},
+    "large": {"nsteps": 5000000, "ntimes": 2000, "nz": 60, "ny": 2000,
+              "nlog": 2000000},
+}
+
+# Dictionaries copied from this case into synthetic cases
+case_files = ["system/controlDict", "system/fvSchemes",
+              "system/snappyHexMeshDict", "constant/polyMesh/blockMeshDict"]
+
+_case_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_dynmeshdict_header = """FoamFile
+{
+    version     2.0;
+    format      ascii;
+    class       dictionary;
+    object      dynamicMeshDict;
+}
+
+dynamicFvMesh   solidBodyMotionFvMesh;
+
+solidBodyMotionFvMeshCoeffs
+{
+    cellZone        AMIsurface;
+    solidBodyMotionFunction  rotatingMotion;
+    rotatingMotionCoeffs
+    {
+        CofG            (0 0 0);
+        axis            (0 0 1);
+        omega           table
+        (
+"""
+
+_forces_header = """# Forces
+# CofR                : (0.000000e+00 0.000000e+00 0.000000e+00)
+# Time                forces(pressure viscous porous) \
+moment(pressure viscous porous)
+"""
+
+_forces_fmt = "%.6g\t((%.6g %.6g %.6g) (%.6g %.6g %.6g) (%.6g %.6g %.6g)) " \
+              "((%.6g %.6g %.6g) (%.6g %.6g %.6g) (%.6g %.6g %.6g))"
+
+
+def _write_filler(f, nlines):
+    """Write `nlines` of log-like lines that match no keyword."""
+    line = "    Checking something ... OK.\n"
+    f.write(line*nlines)
+
+
+def make_case(casedir, nsteps=20000, ntimes=20, nz=10, ny=100, nlog=1000,
+              dt=0.002, seed=0):
+    """Write a synthetic case with `nsteps` rows of `forces` output, `ntimes`
+    time directories, `nz` sampled profile heights of `ny` points each, and
+    logs of about `nlog` lines. Returns a dict of the input sizes in bytes
+    of each group of files."""
+    rng = np.random.RandomState(seed)
+    sizes = {}
+    for fname in case_files:
+        dest = os.path.join(casedir, fname)
+        if not os.path.isdir(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest))
+        shutil.copy(os.path.join(_case_root, fname), dest)
+    end_time = nsteps*dt
+    U_infty, R, tsr = 1.0, 0.5, 1.9
+    omega_mean = tsr*U_infty/R
+    # Rotation rate table
+    t = np.linspace(0, end_time, 400)
+    omega = omega_mean + 0.4*np.sin(3*omega_mean*t - np.pi/1.2)
+    fpath = os.path.join(casedir, "constant", "dynamicMeshDict")
+    with open(fpath, "w") as f:
+        f.write(_dynmeshdict_header)
+        np.savetxt(f, np.column_stack([t, omega]),
+                   fmt="            (%.6f %.6f)")
+        f.write("        );\n    }\n}\n")
+    # Forces, split in two segments as after a restart
+    time = dt*np.arange(1, nsteps + 1)
+    data = np.zeros((nsteps, 19))
+    data[:, 0] = time
+    theta = omega_mean*time
+    data[:, 1] = 300 + 50*np.sin(3*theta) + rng.normal(0, 5, nsteps)
+    data[:, 4] = 5 + rng.normal(0, 0.5, nsteps)
+    data[:, 12] = 60 + 40*np.sin(3*theta) + rng.normal(0, 2, nsteps)
+    data[:, 15] = -2 + rng.normal(0, 0.2, nsteps)
+    split = nsteps//2
+    sizes["forces"] = 0
+    for start, rows in [(0, data[:split]), (time[split - 1], data[split:])]:
+        d = os.path.join(casedir, "postProcessing", "forces",
+                         "{:g}".format(start))
+        os.makedirs(d)
+        fpath = os.path.join(d, "forces.dat")
+        with open(fpath, "w") as f:
+            f.write(_forces_header)
+            np.savetxt(f, rows, fmt=_forces_fmt)
+        sizes["forces"] += os.path.getsize(fpath)
+    # Time directories with small field files
+    for i in range(1, ntimes + 1):
+        name = "{:g}".format(end_time*i/ntimes)
+        d = os.path.join(casedir, name, "uniform")
+        os.makedirs(d)
+        with open(os.path.join(d, "time"), "w") as f:
+            f.write("value {};\nindex {};\ndeltaT {};\ndeltaT0 {};\n".format(
+                    name, int(round(float(name)/dt)), dt, dt))
+        for field in ["U", "p", "k", "nut"]:
+            with open(os.path.join(casedir, name, field), "w") as f:
+                f.write("FoamFile\n{\n    object      " + field + ";\n}\n")
+    # Sampled sets at the last time
+    set_dir = os.path.join(casedir, "postProcessing", "sets",
+                           "{:g}".format(end_time))
+    os.makedirs(set_dir)
+    y = np.linspace(-1.5, 1.5, ny)
+    sizes["sets"] = 0
+    # Heights every 0.125 z/H about the midplane, which is sampled
+    for z_H in 0.125*(np.arange(nz) - nz//2):
+        arrays = {"UMean": rng.normal(0, 0.1, (3, ny)) + [[1], [0], [0]],
+                  "UPrime2Mean": np.abs(rng.normal(0, 0.01, (6, ny))),
+                  "kMean": np.abs(rng.normal(0, 0.02, (1, ny)))}
+        for field, values in arrays.items():
+            fpath = os.path.join(set_dir, "profile_{}_{}.xy".format(
+                    float(z_H), field))
+            np.savetxt(fpath, np.vstack([y, values]).T, fmt="%.8g",
+                       delimiter="\t")
+            sizes["sets"] += os.path.getsize(fpath)
+    # Logs read by `metadata`
+    with open(os.path.join(casedir, "log.checkMesh"), "w") as f:
+        _write_filler(f, nlog//2)
+        f.write("    cells:            {}\n".format(1234567))
+        _write_filler(f, nlog//2)
+    with open(os.path.join(casedir, "log.yPlus"), "w") as f:
+        _write_filler(f, nlog)
+        f.write("Patch 5 named blades\n\n\n"
+                "    y+ : min: 0.52 max: 12.3 average: 3.41\n")
+    for i, names in enumerate([["planeAverageAdvectionY", "weightedAverage"],
+                               ["weightedAverage", "planeAverageViscTrans"],
+                               ["weightedAverage"]]):
+        fpath = os.path.join(casedir, "log.funkyDoCalc.{}".format(i))
+        with open(fpath, "w") as f:
+            for j in range(max(nlog//(2*len(names)), 1)):
+                for name in names:
+                    f.write("{} = {:.6g}\n".format(name, rng.normal()))
+                f.write("\n")
+    sizes["logs"] = sum(os.path.getsize(os.path.join(casedir, f))
+                        for f in os.listdir(casedir) if f.startswith("log."))
+    return sizes
+
+
+def _benchmarks():
+    """Return a list of `(name, function, input size group, setup)`, where
+    `setup` (or `None`) is called untimed before each run."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from . import processing, plotting, sets, metadata
+    from .timedirs import TimeIndex
+
+    def clear_perf_state():
+        for fname in ["perf_state.json", "perf.csv"]:
+            fpath = os.path.join("processed", fname)
+            if os.path.isfile(fpath):
+                os.remove(fpath)
+
+    def close_figures():
+        plt.close("all")
+
+    def clear_index():
+        if os.path.isfile("postProcessing/cache/times.json"):
+            os.remove("postProcessing/cache/times.json")
+
+    return [
+        ("calc_perf", lambda: processing.calc_perf(verbose=False),
+         "forces", None),
+        ("calc_perf_incremental_cold",
+         lambda: processing.calc_perf(verbose=False, incremental=True),
+         "forces", clear_perf_state),
+        ("calc_perf_incremental_warm",
+         lambda: processing.calc_perf(verbose=False, incremental=True),
+         "forces", None),
+        ("calc_perf_stats", processing.calc_perf_stats, "forces", None),
+        ("log_perf", lambda: processing.log_perf(verbose=False), "forces",
+         None),
+        ("read_case_metadata", metadata.read_case_metadata, "logs", None),
+        ("read_funky_log", processing.read_funky_log, "logs", None),
+        ("load_sets_cold", sets.load_time_dir, "sets", sets.clear_cache),
+        ("load_sets_cached", sets.load_time_dir, "sets", sets.clear_memo),
+        ("load_wake_fields", processing.load_wake_fields, "sets", None),
+        ("load_vel_map", processing.load_vel_map, "sets", None),
+        ("load_k_map", processing.load_k_map, "sets", None),
+        ("load_u_profile", processing.load_u_profile, "sets", None),
+        ("load_k_profile", processing.load_k_profile, "sets", None),
+        ("time_index_cold", TimeIndex, None, clear_index),
+        ("time_index_warm", TimeIndex, None, None),
+        ("plot_meancontquiv", plotting.plot_meancontquiv, "sets",
+         close_figures),
+        ("plot_kcont", plotting.plot_kcont, "sets", close_figures),
+        ("plot_u_profile", plotting.plot_u_profile, "sets", close_figures),
+        ("plot_k_profile", plotting.plot_k_profile, "sets", close_figures),
+    ]
+
+
+def run_benchmarks(scale="small", repeat=3, casedir=None, names=None,
+                   verbose=True, **kwargs):
+    """Generate a synthetic case (in a temporary directory unless `casedir`
+    is given) and run each benchmark `repeat` times, or only those in
+    `names`. Scale knobs in `kwargs` override those of `scale`. Returns a
+    dict describing the run, with the best wall time of each benchmark and
+    its peak memory, measured in a separate run with `tracemalloc`."""
+    params = dict(scales[scale], **kwargs)
+    tmpdir = None
+    if casedir is None:
+        casedir = tmpdir = tempfile.mkdtemp(prefix="pyurof3dsst-bench-")
+    cwd = os.getcwd()
+    was_enabled = profiling.is_enabled()
+    try:
+        if verbose:
+            print("Generating {} case in {}".format(scale, casedir))
+        sizes = make_case(casedir, **params)
+        os.chdir(casedir)
+        results = {}
+        for name, func, group, setup in _benchmarks():
+            if names is not None and name not in names:
+                continue
+            walls = []
+            peak = 0
+            error = None
+            # Timed runs are not traced, since tracemalloc slows allocation
+            # many times over; one more, traced run measures peak memory
+            for i in range(repeat + 1):
+                traced = i == repeat
+                if setup is not None:
+                    setup()
+                profiling.reset()
+                profiling.enable(trace_memory=traced)
+                try:
+                    profiling.profiled(func)()
+                except Exception:
+                    error = traceback.format_exc().splitlines()[-1]
+                    break
+                finally:
+                    profiling.disable()
+                record = profiling.trace()[-1]
+                if traced:
+                    peak = record["peak_memory"] or 0
+                else:
+                    walls.append(record["wall"])
+            result = {"error": error}
+            if walls:
+                wall = min(walls)
+                nbytes = sizes.get(group)
+                result.update(wall=wall, peak_memory=peak,
+                              throughput=nbytes/wall if nbytes and wall
+                              else None)
+            results[name] = result
+            if verbose:
+                if walls:
+                    print("{:28s} {:10.4f} s {:10.2f} MB".format(
+                          name, result["wall"], result["peak_memory"]/1e6))
+                else:
+                    print("{:28s} failed: {}".format(name, error))
+    finally:
+        os.chdir(cwd)
+        profiling.reset()
+        if was_enabled:
+            profiling.enable()
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    return {"date": datetime.datetime.now().isoformat(),
+            "scale": scale, "params": params, "sizes": sizes,
+            "repeat": repeat, "python": platform.python_version(),
+            "numpy": np.__version__, "results": results}
+
+
+def load_results(fpath="processed/benchmarks.json"):
+    """Return the list of saved runs, oldest first."""
+    if not os.path.isfile(fpath):
+        return []
+    with open(fpath) as f:
+        return json.load(f)
+
+
+def save_results(run, fpath="processed/benchmarks.json"):
+    """Append a run to the results file."""
+    runs = load_results(fpath) + [run]
+    dirname = os.path.dirname(fpath)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(fpath + ".tmp", "w") as f:
+        json.dump(runs, f, indent=4)
+    os.replace(fpath + ".tmp", fpath)
+
+
+def compare_runs(new, old, threshold=1.2, verbose=True):
+    """Compare the wall times of two runs. Returns a list of
+    `(name, old wall, new wall)` for benchmarks more than `threshold` times
+    slower, or that fail in `new` but not in `old`."""
+    regressions = []
+    for name, r in sorted(new["results"].items()):
+        o = old["results"].get(name)
+        if o is None or o.get("wall") is None:
+            continue
+        if r.get("wall") is None:
+            regressions.append((name, o["wall"], None))
+            if verbose:
+                print("{:28s} now fails: {}".format(name, r["error"]))
+            continue
+        ratio = r["wall"]/o["wall"]
+        if ratio > threshold:
+            regressions.append((name, o["wall"], r["wall"]))
+        if verbose:
+            print("{:28s} {:10.4f} s -> {:10.4f} s ({:.2f}x){}".format(
+                  name, o["wall"], r["wall"], ratio,
+                  "  REGRESSION" if ratio > threshold else ""))
+    return regressions
+
+
+def last_run(runs, scale):
+    """Return the most recent run at `scale` in `runs`, or `None`."""
+    for run in reversed(runs):
+        if run["scale"] == scale:
+            return run
+    return None
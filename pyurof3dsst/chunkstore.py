@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+"""Deduplicating, content-addressed archive of time directories.
+
+Files are split with content-defined chunking, so data that is identical
+between time directories (e.g. `polyMesh/faces` of a moving mesh) produces
+identical chunks even if it moves within a file. Each unique chunk is stored
+once, zlib compressed. A store is a directory holding
+
+    packs/<name>.pack       chunks first stored when `<name>` was added
+    packs/<name>.idx.json   {chunk hash: [offset, length]} for that pack
+    manifests/<name>.json   files of `<name>` and the chunks they are made of
+
+Adding a time directory only writes one new pack and one manifest, so
+stores can be synced incrementally, and any single file of any time can be
+read without unpacking anything else. Files are read and chunked a block at
+a time, so memory use does not depend on file size. A directory added again
+is stored under a temporary name first, and the previous version is only
+removed once the new manifest has been written.
+"""
+
+from __future__ import division, print_function
+import numpy as np
+import hashlib
+import json
+import os
+import shutil
+import zlib
+
+# Gear hash table; the output of `RandomState` for a given seed is stable
+_gear = np.random.RandomState(0x5eed).randint(0, 2**32, size=256,
+                                              dtype=np.uint64) \
+        .astype(np.uint32)
+
+
+# Bytes before a position that its gear hash depends on
+_window = 31
+
+
+def _candidates(data, avg_bits, context=b""):
+    """Return the offsets in `data` after which a chunk may end, given the
+    `context` bytes preceding it."""
+    # h[i] = sum(gear[data[i - j]] << j for j < 32), built by doubling the
+    # window: h_2w[i] = h_w[i] + (h_w[i - w] << w). uint32 arithmetic wraps.
+    n = len(context) + len(data)
+    h = _gear[np.frombuffer(context + data, dtype=np.uint8)]
+    w = 1
+    while w < 32:
+        h[w:] += h[:-w] << np.uint32(w) if w < n else 0
+        w *= 2
+    mask = np.uint32(((1 << avg_bits) - 1) << (32 - avg_bits))
+    return np.flatnonzero((h[len(context):] & mask) == 0) + 1
+
+
+def _cut(candidates, last, n, min_size, max_size, final=True):
+    """Return the end of the chunk starting at `last` in `n` bytes, or
+    `None` if more than `n` bytes are needed to decide it and `final` is
+    `False`."""
+    k = np.searchsorted(candidates, last + min_size)
+    if k < len(candidates) and candidates[k] - last <= max_size:
+        return int(candidates[k])
+    if final or last + max_size <= n:
+        return min(last + max_size, n)
+    return None
+
+
+def chunk_boundaries(data, avg_bits=16, min_size=2**13, max_size=2**18):
+    """Return the end offsets of content-defined chunks of `data`.
+
+    A gear hash of the 32 bytes ending at each position is computed with
+    numpy, and chunks end where its top `avg_bits` bits are zero, giving an
+    average chunk size of about `2**avg_bits` bytes, subject to `min_size`
+    and `max_size`.
+    """
+    n = len(data)
+    if n == 0:
+        return []
+    candidates = _candidates(data, avg_bits)
+    cuts = []
+    last = 0
+    while last < n:
+        last = _cut(candidates, last, n, min_size, max_size)
+        cuts.append(last)
+    return cuts
+
+
+def iter_chunks(f, blocksize=2**22, avg_bits=16, min_size=2**13,
+                max_size=2**18):
+    """Generate the chunks `chunk_boundaries` would cut the contents of the
+    open binary file `f` into, reading `blocksize` bytes at a time. Data
+    after the last cut is carried over to the next block, with the bytes
+    before it that its hashes depend on."""
+    buf = b""
+    context = b""
+    final = False
+    while not final:
+        block = f.read(blocksize)
+        final = not block
+        buf += block
+        n = len(buf)
+        if n == 0:
+            break
+        candidates = _candidates(buf, avg_bits, context)
+        last = 0
+        while last < n:
+            end = _cut(candidates, last, n, min_size, max_size, final)
+            if end is None:
+                break
+            yield buf[last:end]
+            last = end
+        context = (context + buf[:last])[-_window:]
+        buf = buf[last:]
+
+
+def chunk_hash(chunk):
+    return hashlib.blake2b(chunk, digest_size=16).hexdigest()
+
+
+def _write_json(fpath, obj):
+    with open(fpath + ".tmp", "w") as f:
+        json.dump(obj, f, indent=1)
+    os.replace(fpath + ".tmp", fpath)
+
+
+class ChunkStore(object):
+    """A deduplicating archive in directory `path`, created if necessary."""
+    def __init__(self, path):
+        self.path = path
+        for d in ["packs", "manifests"]:
+            if not os.path.isdir(os.path.join(path, d)):
+                os.makedirs(os.path.join(path, d))
+        # Chunk hash -> (pack name, offset, length)
+        self.index = {}
+        for fname in sorted(os.listdir(os.path.join(path, "packs"))):
+            if fname.endswith(".idx.json"):
+                pack = fname[:-len(".idx.json")]
+                with open(os.path.join(path, "packs", fname)) as f:
+                    for h, (offset, length) in json.load(f).items():
+                        self.index.setdefault(h, (pack, offset, length))
+
+    def names(self):
+        """Return the names of stored directories, sorted numerically where
+        possible."""
+        names = [f[:-5] for f in os.listdir(os.path.join(self.path,
+                                                         "manifests"))
+                 if f.endswith(".json")]
+
+        def key(name):
+            try:
+                return (0, float(name), name)
+            except ValueError:
+                return (1, 0.0, name)
+        return sorted(names, key=key)
+
+    def manifest(self, name):
+        """Return the manifest of `name`, a dict of relative file path to
+        `{"size", "mode", "mtime", "chunks"}`."""
+        with open(os.path.join(self.path, "manifests", name + ".json")) as f:
+            return json.load(f)
+
+    def add_dir(self, directory, name=None, files="all", level=6,
+                verbose=False):
+        """Add a directory, or only `files` in it, under `name` (default its
+        base name), replacing any previous version. Returns a dict with
+        `size`, the total size of the files, and `new_bytes` and
+        `new_chunks` actually stored."""
+        if name is None:
+            name = os.path.basename(os.path.normpath(directory))
+        # A new version is stored under a temporary name, so the previous one
+        # survives an interrupted add
+        tmp_name = name + ".new"
+        self.remove(tmp_name)
+        if files == "all":
+            files = sorted(os.listdir(directory))
+        paths = []
+        for f in files:
+            fpath = os.path.join(directory, f)
+            if os.path.isdir(fpath):
+                for root, dirs, fnames in os.walk(fpath):
+                    dirs.sort()
+                    paths += [os.path.join(root, fn) for fn in sorted(fnames)]
+            else:
+                paths.append(fpath)
+        pack_path = os.path.join(self.path, "packs", tmp_name + ".pack")
+        pack_index = {}
+        manifest = {}
+        stats = {"size": 0, "new_bytes": 0, "new_chunks": 0}
+        with open(pack_path + ".tmp", "wb") as pack:
+            for fpath in paths:
+                st = os.stat(fpath)
+                hashes = []
+                size = 0
+                with open(fpath, "rb") as f:
+                    for chunk in iter_chunks(f):
+                        size += len(chunk)
+                        h = chunk_hash(chunk)
+                        hashes.append(h)
+                        # Chunks only in the previous version are stored
+                        # again, since its pack is removed
+                        if h in pack_index or (h in self.index
+                                               and self.index[h][0] != name):
+                            continue
+                        comp = zlib.compress(chunk, level)
+                        pack_index[h] = (pack.tell(), len(comp))
+                        pack.write(comp)
+                        stats["new_bytes"] += len(comp)
+                        stats["new_chunks"] += 1
+                relpath = os.path.relpath(fpath, directory)
+                manifest[relpath.replace(os.sep, "/")] = {
+                        "size": size, "mode": st.st_mode & 0o777,
+                        "mtime": st.st_mtime, "chunks": hashes}
+                stats["size"] += size
+                if verbose:
+                    print("Added {}/{}".format(name, relpath))
+        os.replace(pack_path + ".tmp", pack_path)
+        _write_json(os.path.join(self.path, "packs", tmp_name + ".idx.json"),
+                    pack_index)
+        for h, (offset, length) in pack_index.items():
+            self.index[h] = (tmp_name, offset, length)
+        # The manifest is written last, so a name only appears once complete
+        _write_json(os.path.join(self.path, "manifests", tmp_name + ".json"),
+                    manifest)
+        self.remove(name)
+        self._rename(tmp_name, name)
+        return stats
+
+    def _rename(self, old, new):
+        """Rename the pack and manifest of `old` to `new`."""
+        for ext in [".pack", ".idx.json"]:
+            os.replace(os.path.join(self.path, "packs", old + ext),
+                       os.path.join(self.path, "packs", new + ext))
+        self.index = {h: (new if pack == old else pack, offset, length)
+                      for h, (pack, offset, length) in self.index.items()}
+        os.replace(os.path.join(self.path, "manifests", old + ".json"),
+                   os.path.join(self.path, "manifests", new + ".json"))
+
+    def read_chunk(self, h, _files=None):
+        pack, offset, length = self.index[h]
+        if _files is not None and pack in _files:
+            f = _files[pack]
+        else:
+            f = open(os.path.join(self.path, "packs", pack + ".pack"), "rb")
+            if _files is not None:
+                _files[pack] = f
+        try:
+            f.seek(offset)
+            chunk = zlib.decompress(f.read(length))
+        finally:
+            if _files is None:
+                f.close()
+        if chunk_hash(chunk) != h:
+            raise IOError("Corrupt chunk {} in pack {}".format(h, pack))
+        return chunk
+
+    def _iter_file(self, entry, _files):
+        for h in entry["chunks"]:
+            yield self.read_chunk(h, _files)
+
+    def read_file(self, name, relpath):
+        """Return the contents of one file of `name` as bytes, reading only
+        its chunks."""
+        entry = self.manifest(name)[relpath]
+        files = {}
+        try:
+            return b"".join(self._iter_file(entry, files))
+        finally:
+            for f in files.values():
+                f.close()
+
+    def extract(self, name, dest="./", files=None, verbose=False):
+        """Restore `name` into `dest/name`, or only the paths in `files`,
+        which may also be subdirectories such as `"polyMesh"`."""
+        manifest = self.manifest(name)
+        outdir = os.path.join(dest, name)
+        packs = {}
+        try:
+            for relpath, entry in sorted(manifest.items()):
+                if files is not None and not any(
+                        relpath == f or relpath.startswith(f.rstrip("/")
+                                                           + "/")
+                        for f in files):
+                    continue
+                fpath = os.path.join(outdir, *relpath.split("/"))
+                if not os.path.isdir(os.path.dirname(fpath)):
+                    os.makedirs(os.path.dirname(fpath))
+                with open(fpath, "wb") as f:
+                    for chunk in self._iter_file(entry, packs):
+                        f.write(chunk)
+                os.chmod(fpath, entry["mode"])
+                os.utime(fpath, (entry["mtime"], entry["mtime"]))
+                if verbose:
+                    print("Extracted {}".format(fpath))
+        finally:
+            for f in packs.values():
+                f.close()
+
+    def remove(self, name):
+        """Remove `name`, moving chunks other names still use into a pack
+        of their own. Parts of `name` left by an interrupted add are
+        removed too, and a name that is not stored is ignored."""
+        parts = [os.path.join(self.path, "manifests", name + ".json")] \
+              + [os.path.join(self.path, "packs", name + ext)
+                 for ext in [".pack", ".idx.json", ".pack.tmp"]]
+        if not any(os.path.isfile(fpath) for fpath in parts):
+            return
+        used = set()
+        for other in self.names():
+            if other != name:
+                for entry in self.manifest(other).values():
+                    used.update(entry["chunks"])
+        if os.path.isfile(parts[0]):
+            os.remove(parts[0])
+        keep = [h for h, (pack, _, _) in self.index.items()
+                if pack == name and h in used]
+        if keep:
+            n = 0
+            while os.path.isfile(os.path.join(self.path, "packs", "{}.kept{}"
+                                              ".pack".format(name, n))):
+                n += 1
+            rescue = "{}.kept{}".format(name, n)
+            pack_path = os.path.join(self.path, "packs", rescue + ".pack")
+            pack_index = {}
+            with open(pack_path, "wb") as pack:
+                for h in keep:
+                    comp = zlib.compress(self.read_chunk(h))
+                    pack_index[h] = (pack.tell(), len(comp))
+                    pack.write(comp)
+            _write_json(os.path.join(self.path, "packs",
+                                     rescue + ".idx.json"), pack_index)
+            for h, (offset, length) in pack_index.items():
+                self.index[h] = (rescue, offset, length)
+        for fpath in parts[1:]:
+            if os.path.isfile(fpath):
+                os.remove(fpath)
+        self.index = {h: v for h, v in self.index.items() if v[0] != name}
+
+    def stats(self):
+        """Return total file size over all names and stored pack size."""
+        size = sum(e["size"] for name in self.names()
+                   for e in self.manifest(name).values())
+        stored = sum(os.path.getsize(os.path.join(self.path, "packs", f))
+                     for f in os.listdir(os.path.join(self.path, "packs"))
+                     if f.endswith(".pack"))
+        return {"size": size, "stored": stored,
+                "ratio": size/stored if stored else np.nan}
+
+
+def test_round_trip():
+    """Store two similar time directories and check they are restored
+    byte for byte, and that shared data is only stored once."""
+    import io
+    import tempfile
+    tmp = tempfile.mkdtemp()
+    try:
+        rng = np.random.RandomState(1)
+        faces = rng.bytes(2**20)
+        for t, shift in [("0.02", 0), ("0.04", 1)]:
+            os.makedirs(os.path.join(tmp, "case", t, "polyMesh"))
+            with open(os.path.join(tmp, "case", t, "polyMesh", "faces"),
+                      "wb") as f:
+                # Insert bytes so identical data moves within the file
+                f.write(b"x"*shift*100 + faces)
+            with open(os.path.join(tmp, "case", t, "U"), "wb") as f:
+                f.write(rng.bytes(100000))
+            with open(os.path.join(tmp, "case", t, "empty"), "wb") as f:
+                pass
+        store = ChunkStore(os.path.join(tmp, "store"))
+        s1 = store.add_dir(os.path.join(tmp, "case", "0.02"))
+        s2 = store.add_dir(os.path.join(tmp, "case", "0.04"))
+        assert s2["new_bytes"] < s1["new_bytes"]/4
+        store = ChunkStore(os.path.join(tmp, "store"))
+        assert store.names() == ["0.02", "0.04"]
+        for t in ["0.02", "0.04"]:
+            store.extract(t, os.path.join(tmp, "out"))
+            for f in ["polyMesh/faces", "U", "empty"]:
+                with open(os.path.join(tmp, "case", t, f), "rb") as fo:
+                    original = fo.read()
+                with open(os.path.join(tmp, "out", t, f), "rb") as fo:
+                    assert fo.read() == original
+                assert store.read_file(t, f) == original
+        store.remove("0.02")
+        assert store.read_file("0.04", "polyMesh/faces") == b"x"*100 + faces
+        store.add_dir(os.path.join(tmp, "case", "0.02"))
+        store.add_dir(os.path.join(tmp, "case", "0.02"), files=["U"])
+        assert list(store.manifest("0.02")) == ["U"]
+        assert store.names() == ["0.02", "0.04"]
+        store = ChunkStore(os.path.join(tmp, "store"))
+        assert store.read_file("0.04", "polyMesh/faces") == b"x"*100 + faces
+        # Chunks cut a block at a time match those of the whole file
+        data = faces + rng.bytes(100000) + faces
+        cuts = chunk_boundaries(data)
+        for blocksize in [10000, 2**18, 2**22]:
+            chunks = list(iter_chunks(io.BytesIO(data), blocksize=blocksize))
+            assert b"".join(chunks) == data
+            assert np.cumsum([len(c) for c in chunks]).tolist() == cuts
+    finally:
+        shutil.rmtree(tmp)
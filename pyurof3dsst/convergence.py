@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""Statistical convergence detection for per-revolution performance, and a
+stop signal for runs that have converged."""
+
+from __future__ import division, print_function
+import numpy as np
+import os
+import re
+from .phase import phase_average_perf
+from .forces import get_last_time
+from .metadata import read_case_metadata
+
+
+def t_critical(dof, confidence=0.95):
+    """Two-sided Student's t critical value for `dof` degrees of freedom,
+    which may be fractional."""
+    from scipy.stats import t
+    return float(t.ppf(0.5 + confidence/2, dof))
+
+
+def integrated_autocorr_time(x, c=5.0):
+    """Integrated autocorrelation time of `x` with Sokal's automatic window,
+    the smallest lag `M` with `M >= c*tau(M)`. Returns 1 for uncorrelated
+    data."""
+    x = np.asarray(x, dtype=float)
+    n = len(x)
+    if n < 2 or np.var(x) == 0:
+        return 1.0
+    # Autocorrelation via FFT, zero padded to avoid wrap-around
+    f = np.fft.rfft(x - x.mean(), n=2*n)
+    acf = np.fft.irfft(f*np.conj(f))[:n]
+    acf /= acf[0]
+    taus = 2*np.cumsum(acf) - 1
+    window = np.arange(n) >= c*taus
+    m = np.argmax(window) if window.any() else n - 1
+    return max(1.0, taus[m])
+
+
+def mean_ci(x, confidence=0.95):
+    """Mean of a correlated series and the half-width of its confidence
+    interval.
+
+    The standard error is the larger of the batch means estimate, with
+    batches about twice the integrated autocorrelation time long, and the
+    estimate `std*sqrt(tau/n)` from the autocorrelation time itself.
+    Returns a dict with `mean`, `half_width`, `tau`, `n_eff` and `n`.
+    """
+    x = np.asarray(x, dtype=float)
+    n = len(x)
+    res = {"mean": x.mean() if n else np.nan, "half_width": np.nan,
+           "tau": np.nan, "n_eff": np.nan, "n": n}
+    if n < 3:
+        return res
+    tau = integrated_autocorr_time(x)
+    se_acf = x.std(ddof=1)*np.sqrt(tau/n)
+    batch_size = max(1, int(np.ceil(2*tau)))
+    nbatches = n//batch_size
+    if nbatches >= 3:
+        # Drop leading samples so batches end at the latest value
+        batches = x[n - nbatches*batch_size:].reshape((nbatches, batch_size))
+        se_bm = batches.mean(axis=1).std(ddof=1)/np.sqrt(nbatches)
+        dof = nbatches - 1
+    else:
+        se_bm = 0.0
+        dof = max(1, n/tau - 1)
+    res["tau"] = tau
+    res["n_eff"] = n/tau
+    res["half_width"] = t_critical(dof, confidence)*max(se_bm, se_acf)
+    return res
+
+
+def mser_truncation(x, max_fraction=0.5):
+    """Number of leading values of `x` to discard as the initial transient,
+    by the marginal standard error rule (MSER): the truncation minimizing
+    the squared standard error of the remaining mean, searched over at most
+    `max_fraction` of the series."""
+    x = np.asarray(x, dtype=float)
+    n = len(x)
+    if n < 4:
+        return 0
+    # Sums over x[d:] for every truncation d, from reversed cumulative sums
+    s1 = np.cumsum(x[::-1])[::-1]
+    s2 = np.cumsum(x[::-1]**2)[::-1]
+    m = n - np.arange(n)
+    var = s2/m - (s1/m)**2
+    dmax = int(max_fraction*n)
+    return int(np.argmin(var[:dmax + 1]/m[:dmax + 1]))
+
+
+def detect_convergence(perf=None, tol=0.01, relative=True, theta_0=360,
+                       quantities=("cp", "cd"), confidence=0.95, min_revs=4,
+                       nbins=72):
+    """Check whether per-revolution means of `quantities` have converged.
+
+    `perf` is a `DataFrame` or path as accepted by `phase_average_perf`.
+    Complete revolutions after `theta_0` degrees are used. If `theta_0` is
+    `"auto"`, leading revolutions are instead dropped by `mser_truncation`
+    of the first quantity. A quantity has converged when its confidence
+    interval half-width is at most `tol`, relative to the magnitude of its
+    mean if `relative` is `True`. Returns a dict with `converged`,
+    `revs_used` and per-quantity `mean_ci` results.
+    """
+    auto = theta_0 == "auto"
+    pa = phase_average_perf(perf, nbins=nbins, theta_0=0 if auto else theta_0,
+                            quantities=quantities)
+    series = {q: pa.rev_means[q][pa.complete] for q in quantities}
+    ntrunc = mser_truncation(series[quantities[0]]) if auto else 0
+    result = {"converged": True, "revs_used": 0, "revs_discarded": ntrunc}
+    for q in quantities:
+        x = series[q][ntrunc:]
+        ci = mean_ci(x, confidence=confidence)
+        bound = tol*abs(ci["mean"]) if relative else tol
+        ci["converged"] = len(x) >= min_revs and ci["half_width"] <= bound
+        result[q] = ci
+        result["converged"] = result["converged"] and ci["converged"]
+        result["revs_used"] = len(x)
+    return result
+
+
+def write_stop_signal(casedir="./", end_time=None):
+    """Stop a running simulation by editing `endTime` in
+    `system/controlDict`, which the solver rereads when `runTimeModifiable`
+    is enabled.
+
+    If `end_time` is `None`, the next write time after the last time step in
+    the `forces` output is used, so the final fields are still written.
+    Returns the new end time.
+    """
+    fpath = os.path.join(casedir, "system", "controlDict")
+    if end_time is None:
+        md = read_case_metadata(casedir, files=["system/controlDict"])
+        t = get_last_time(casedir) or 0.0
+        dt = md.write_interval
+        end_time = (np.floor(t/dt + 1e-9) + 1)*dt if dt else t
+        end_time = float("{:.10g}".format(end_time))
+    with open(fpath) as f:
+        text = f.read()
+    text, n = re.subn(r"(?m)^(endTime\s+)[^;]*;",
+                      r"\g<1>{};".format(end_time), text, count=1)
+    if n == 0:
+        raise ValueError("No endTime entry in {}".format(fpath))
+    tmp_path = fpath + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, fpath)
+    return end_time
+
+
+def stop_if_converged(casedir="./", tol=0.01, stop=True, verbose=True,
+                      **kwargs):
+    """Run `detect_convergence` on the case's `processed/perf.csv` and, if
+    `stop` is `True`, write the stop signal if converged. Returns the
+    convergence result."""
+    perf = os.path.join(casedir, "processed", "perf.csv")
+    result = detect_convergence(perf, tol=tol, **kwargs)
+    if verbose:
+        for q in kwargs.get("quantities", ("cp", "cd")):
+            r = result[q]
+            print("{}: {:.4f} +/- {:.4f} ({} revs, tau = {:.2f})".format(
+                    q, r["mean"], r["half_width"], r["n"], r["tau"]))
+    if result["converged"] and stop:
+        end_time = write_stop_signal(casedir)
+        if verbose:
+            print("Converged; endTime set to {}".format(end_time))
+    elif verbose:
+        print("Converged" if result["converged"] else "Not converged")
+    return result
@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+"""Reading OpenFOAM field files directly, without an OpenFOAM job.
+
+Both `writeFormat ascii` and `binary` files are supported. The values of a
+binary list are returned as a read-only `np.memmap` of the file, so nothing
+is read until it is used. Cases may be reconstructed or left decomposed in
+`processor*` directories.
+"""
+
+from __future__ import division, print_function
+import numpy as np
+import mmap
+import os
+import re
+
+ncomponents = {"scalar": 1, "vector": 3, "symmTensor": 6, "tensor": 9,
+               "sphericalTensor": 1, "label": 1}
+
+field_types = {"volScalarField": "scalar", "volVectorField": "vector",
+               "volSymmTensorField": "symmTensor",
+               "volTensorField": "tensor", "vectorField": "vector"}
+
+_header_re = re.compile(rb"FoamFile\s*\{(.*?)\}", re.S)
+_entry_re = re.compile(rb'(\w+)\s+("[^"]*"|[^;]*);')
+# Parentheses become spaces, so `4(0 1 2 3)` in a `faceList` splits
+_parens = bytes.maketrans(b"()", b"  ")
+
+
+def read_header(fpath):
+    """Return the `FoamFile` header of a file as a dict of strings."""
+    with open(fpath, "rb") as f:
+        text = f.read(4096)
+    match = _header_re.search(text)
+    if match is None:
+        raise ValueError("No FoamFile header in {}".format(fpath))
+    return {k.decode(): v.decode().strip('"')
+            for k, v in _entry_re.findall(match.group(1))}
+
+
+def _arch_dtypes(header):
+    """Return scalar and label dtypes from the header's `arch` entry, e.g.
+    `"LSB;label=32;scalar=64"`, which is the default."""
+    arch = header.get("arch", "LSB;label=32;scalar=64")
+    order = ">" if "MSB" in arch else "<"
+    label = re.search(r"label=(\d+)", arch)
+    scalar = re.search(r"scalar=(\d+)", arch)
+    label_bytes = int(label.group(1))//8 if label else 4
+    scalar_bytes = int(scalar.group(1))//8 if scalar else 8
+    return (np.dtype(order + "f" + str(scalar_bytes)),
+            np.dtype(order + "i" + str(label_bytes)))
+
+
+def _shape(n, ncomp):
+    return (n,) if ncomp == 1 else (n, ncomp)
+
+
+def _find_list(mm, fpath, header, keyword=None, start=None):
+    """Locate the list following `keyword` (or the header, or offset
+    `start`) in a mapped file. Returns `(kind, typ, n, start, end)`, where
+    `kind` is `"uniform"` for a `uniform` entry, `"compact"` for an
+    `n{value}` list or `"list"`, `mm[start:end]` holds the values and the
+    entry ends at or after `end`.
+    """
+    scalar_dtype, label_dtype = _arch_dtypes(header)
+    cls = header.get("class", "")
+    if cls in ["faceList", "faceCompactList", "cellList"]:
+        typ = "label"
+    elif cls.endswith("List"):
+        typ = cls[:-len("List")]
+    else:
+        typ = field_types.get(cls, "scalar")
+    if start is None:
+        start = _header_re.search(mm).end()
+    if keyword is not None:
+        match = re.compile(rb"\b" + keyword.encode() + rb"\s+").search(
+                mm, start)
+        if match is None:
+            raise ValueError("No {} in {}".format(keyword, fpath))
+        start = match.end()
+        uniform = re.compile(rb"uniform\s+([^;]*);").match(mm, start)
+        if uniform is not None:
+            return ("uniform", typ, 1, uniform.start(1), uniform.end(1))
+        match = re.compile(rb"nonuniform\s+List<(\w+)>\s*").match(mm, start)
+        if match is None:
+            raise ValueError("Unrecognized {} in {}".format(keyword, fpath))
+        typ = match.group(1).decode()
+        start = match.end()
+    match = re.compile(rb"(?:\s|//[^\n]*\n)*(\d+)\s*([({])").match(mm,
+                                                                  start)
+    if match is None:
+        raise ValueError("No list found in {}".format(fpath))
+    n = int(match.group(1))
+    start = match.end()
+    if match.group(2) == b"{":
+        return ("compact", typ, n, start, mm.find(b"}", start))
+    if header.get("format") == "binary":
+        dtype = label_dtype if typ == "label" else scalar_dtype
+        end = start + n*ncomponents.get(typ, 1)*dtype.itemsize
+    else:
+        end = mm.find(b"\n)", start) if n else start
+    return ("list", typ, n, start, end)
+
+
+def read_list(fpath, keyword=None, mmap_mode=True, skip=0):
+    """Read the list following `keyword` in an OpenFOAM file, or the first
+    list after the header if `keyword` is `None` (e.g. `labelList` files).
+    `skip` lists are skipped first, e.g. `skip=1` reads the point labels of
+    a `faceCompactList` rather than its offsets. An ASCII list of lists
+    (e.g. a `faceList`) is returned flattened, each sublist preceded by its
+    size.
+
+    Returns a tuple `(values, header)`. `values` has shape `(n,)` for scalar
+    and label lists and `(n, ncomponents)` otherwise. A binary list is a
+    read-only `np.memmap` if `mmap_mode` is `True`. For a uniform entry,
+    `values` is the single value as an array and `header["uniform"]` is set.
+    """
+    header = read_header(fpath)
+    scalar_dtype, label_dtype = _arch_dtypes(header)
+    with open(fpath, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        kind, typ, n, start, end = _find_list(mm, fpath, header, keyword)
+        for i in range(skip):
+            # Skip past the closing parenthesis of the previous list
+            kind, typ, n, start, end = _find_list(
+                    mm, fpath, header, start=mm.find(b")", end) + 1)
+        ncomp = ncomponents.get(typ, 1)
+        dtype = label_dtype if typ == "label" else scalar_dtype
+        binary = header.get("format") == "binary"
+        # Binary lists are mapped rather than copied
+        text = None if kind == "list" and binary and mmap_mode \
+               else mm[start:end]
+    finally:
+        mm.close()
+    if kind == "uniform":
+        header["uniform"] = True
+        return np.array(text.translate(None, b"()").split(),
+                        dtype=float), header
+    if kind == "compact":
+        value = np.array(text.translate(None, b"()").split(), dtype=dtype)
+        return np.tile(value, (n, 1)).reshape(_shape(n, ncomp)), header
+    if binary:
+        if mmap_mode:
+            values = np.memmap(fpath, dtype=dtype, mode="r", offset=start,
+                               shape=_shape(n, ncomp))
+        else:
+            values = np.frombuffer(text, dtype=dtype).reshape(
+                    _shape(n, ncomp))
+        return values, header
+    values = np.fromstring(text.translate(_parens), dtype=dtype,
+                           sep=" ")
+    if header.get("class") in ["faceList", "cellList"]:
+        return values, header
+    if len(values) != n*ncomp:
+        raise ValueError("Expected {} values in {}, found {}".format(
+                n*ncomp, fpath, len(values)))
+    return values.reshape(_shape(n, ncomp)), header
+
+
+def get_ncells(meshdir):
+    """Return the number of cells of the mesh in `meshdir` (a `polyMesh`
+    directory) from the note in the header of its `owner` file."""
+    note = read_header(os.path.join(meshdir, "owner")).get("note", "")
+    match = re.search(r"nCells:\s*(\d+)", note)
+    if match is None:
+        return len(np.unique(read_list(os.path.join(meshdir, "owner"))[0]))
+    return int(match.group(1))
+
+
+def list_processor_dirs(casedir="./"):
+    """Return the `processor*` directories of a case, in numerical order."""
+    dirs = [d for d in os.listdir(casedir) if re.match(r"^processor\d+$", d)]
+    return [os.path.join(casedir, d)
+            for d in sorted(dirs, key=lambda d: int(d[len("processor"):]))]
+
+
+def find_mesh_dir(casedir, time, fname):
+    """Mesh files are written to a time directory when the topology
+    changes, and are otherwise in `constant`."""
+    for d in [os.path.join(casedir, str(time), "polyMesh"),
+              os.path.join(casedir, "constant", "polyMesh")]:
+        if os.path.isfile(os.path.join(d, fname)):
+            return d
+    raise IOError("No {} in {}".format(fname, casedir))
+
+
+def _read_internal(casedir, name, time, mmap_mode):
+    fpath = os.path.join(casedir, str(time), name)
+    values, header = read_list(fpath, "internalField", mmap_mode=mmap_mode)
+    if header.get("uniform"):
+        ncells = get_ncells(find_mesh_dir(casedir, time, "owner"))
+        ncomp = ncomponents[field_types.get(header.get("class"), "scalar")]
+        values = np.broadcast_to(values.reshape(_shape(1, ncomp))[0],
+                                 _shape(ncells, ncomp))
+    return values
+
+
+def read_field(name, time, casedir="./", mmap_mode=True, reconstruct=True):
+    """Read the internal field `name` (e.g. `"U"` or `"UPrime2Mean"`) at
+    `time`.
+
+    If the case has not been reconstructed, the field is read from each
+    `processor*` directory. With `reconstruct=True` the parts are put in
+    global cell order using `cellProcAddressing` (which makes a copy);
+    otherwise the list of per-processor arrays is returned.
+    """
+    fpath = os.path.join(casedir, str(time), name)
+    if os.path.isfile(fpath):
+        return _read_internal(casedir, name, time, mmap_mode)
+    procdirs = list_processor_dirs(casedir)
+    if not procdirs:
+        raise IOError("{} not found".format(fpath))
+    parts = [_read_internal(d, name, time, mmap_mode) for d in procdirs]
+    if not reconstruct:
+        return parts
+    addressing = [read_list(os.path.join(
+                  find_mesh_dir(d, time, "cellProcAddressing"),
+                  "cellProcAddressing"))[0] for d in procdirs]
+    ncells = sum(len(a) for a in addressing)
+    values = np.empty((ncells,) + parts[0].shape[1:], dtype=parts[0].dtype)
+    for part, addr in zip(parts, addressing):
+        values[addr] = part
+    return values
+
+
+def field_stats(name, time, casedir="./"):
+    """Return a dict of per-component cell `min`, `max`, `mean` and `std`
+    of a field, and the number of cells `n`."""
+    values = read_field(name, time, casedir=casedir)
+    if isinstance(values, np.memmap):
+        values = np.asarray(values)
+    return {"n": len(values), "min": values.min(axis=0),
+            "max": values.max(axis=0), "mean": values.mean(axis=0),
+            "std": values.std(axis=0)}
+
+
+_banner = b"""\
+/*--------------------------------*- C++ -*----------------------------------*\\
+| =========                 |                                                 |
+| \\\\      /  F ield         | OpenFOAM: The Open Source CFD Toolbox           |
+|  \\\\    /   O peration     | Version:  2.3.x                                 |
+|   \\\\  /    A nd           | Web:      www.OpenFOAM.org                      |
+|    \\\\/     M anipulation  |                                                 |
+\\*---------------------------------------------------------------------------*/
+"""
+
+_separator = b"// * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * " \
+             b"* * * * //\n\n"
+
+_block_token_re = re.compile(rb"[{}]|List<(\w+)>\s*(\d+)\s*\(")
+
+# Patch types whose fields carry no values of their own
+constraint_types = ["empty", "cyclic", "cyclicAMI", "symmetryPlane",
+                    "symmetry", "wedge"]
+
+
+def _block_end(mm, start, header):
+    """Return the offset just past the `}` closing the first `{` at or after
+    `start`, skipping over the payloads of binary lists."""
+    scalar_dtype, label_dtype = _arch_dtypes(header)
+    binary = header.get("format") == "binary"
+    depth = 0
+    pos = start
+    while True:
+        match = _block_token_re.search(mm, pos)
+        if match is None:
+            raise ValueError("Unterminated block")
+        token = match.group(0)
+        pos = match.end()
+        if token == b"{":
+            depth += 1
+        elif token == b"}":
+            depth -= 1
+            if depth == 0:
+                return pos
+        else:
+            n = int(match.group(2))
+            typ = match.group(1).decode()
+            dtype = label_dtype if typ == "label" else scalar_dtype
+            if binary:
+                pos += n*ncomponents.get(typ, 1)*dtype.itemsize + 1
+            elif n:
+                pos = mm.find(b"\n)", pos) + 2
+            else:
+                pos += 1
+
+
+def read_entry(fpath, keyword):
+    """Return the raw bytes of a non-list entry, e.g. `dimensions` or the
+    whole `boundaryField` block including its keyword, which is searched
+    for after the `internalField` data."""
+    header = read_header(fpath)
+    with open(fpath, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        start = _header_re.search(mm).end()
+        if keyword == "boundaryField":
+            start = _find_list(mm, fpath, header, "internalField")[-1]
+        match = re.compile(rb"\b" + keyword.encode() + rb"\s+").search(
+                mm, start)
+        if match is None:
+            raise ValueError("No {} in {}".format(keyword, fpath))
+        if mm[match.end():match.end() + 1] == b"{":
+            end = _block_end(mm, match.end(), header)
+        else:
+            end = mm.find(b";", match.end()) + 1
+        return mm[match.start():end]
+    finally:
+        mm.close()
+
+
+def boundary_patches(fpath):
+    """Return a list of `(name, type)` of the patches in the `boundaryField`
+    of a field file."""
+    header = read_header(fpath)
+    text = read_entry(fpath, "boundaryField")
+    patches = []
+    pos = text.index(b"{") + 1
+    name_re = re.compile(rb"\s*([^\s{}]+)\s*\{")
+    while True:
+        match = name_re.match(text, pos)
+        if match is None:
+            break
+        end = _block_end(text, match.end() - 1, header)
+        typ = re.search(rb"\btype\s+(\w+)\s*;", text[match.end():end])
+        patches.append((match.group(1).decode(),
+                        typ.group(1).decode() if typ else None))
+        pos = end
+    return patches
+
+
+def _format_values(values, typ):
+    if typ == "scalar":
+        return b"\n".join(b"%.10g" % v for v in values)
+    return b"\n".join(b"(" + b" ".join(b"%.10g" % c for c in v) + b")"
+                      for v in values)
+
+
+def write_field(fpath, values, cls, dimensions, boundary_field,
+                fmt="binary", location=None):
+    """Write a field file with internal field `values`.
+
+    `dimensions` is the entry text, e.g. `b"[0 1 -1 0 0 0 0]"`, and
+    `boundary_field` the raw `boundaryField` block, as returned by
+    `read_entry`, in the same format `fmt`. The file is written under a
+    temporary name and renamed, so readers never see a partial file.
+    """
+    typ = field_types[cls]
+    values = np.ascontiguousarray(values, dtype="<f8")
+    if location is None:
+        location = os.path.basename(os.path.dirname(os.path.abspath(fpath)))
+    header = ["FoamFile", "{", "    version     2.0;",
+              "    format      {};".format(fmt),
+              "    class       {};".format(cls)]
+    if fmt == "binary":
+        header.append('    arch        "LSB;label=32;scalar=64";')
+    header += ['    location    "{}";'.format(location),
+               "    object      {};".format(os.path.basename(fpath)), "}"]
+    if isinstance(dimensions, str):
+        dimensions = dimensions.encode()
+    if not dimensions.startswith(b"dimensions"):
+        dimensions = b"dimensions      " + dimensions + b";"
+    with open(fpath + ".tmp", "wb") as f:
+        f.write(_banner)
+        f.write("\n".join(header).encode() + b"\n")
+        f.write(_separator)
+        f.write(dimensions + b"\n\n")
+        f.write("internalField   nonuniform List<{}> \n{}\n(".format(
+                typ, len(values)).encode())
+        if fmt == "binary":
+            f.write(values.tobytes())
+        else:
+            f.write(b"\n" + _format_values(values, typ) + b"\n")
+        f.write(b")\n;\n\n")
+        f.write(boundary_field)
+        f.write(b"\n\n\n// ***************************************************"
+                b"********************** //\n")
+    os.replace(fpath + ".tmp", fpath)
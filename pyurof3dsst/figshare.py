@@ -0,0 +1,580 @@
+#!/usr/bin/env python
+"""Parallel, resumable transfers with the Figshare v2 API.
+
+Parts are uploaded concurrently over one pooled HTTP session, each with a
+`Content-MD5` header so corrupted parts are rejected, and the whole-file
+MD5 is checked against the one Figshare computes once the upload is
+complete. Progress is recorded in a local journal so an upload that was
+killed continues from the parts it had not finished. Data can also be
+streamed, e.g. a tarball compressed on the fly, without a local copy.
+
+Downloads use a cached file manifest, run concurrently with HTTP range
+resume and are verified by size and MD5 before archives are extracted.
+"""
+
+from __future__ import division, print_function
+import requests
+import base64
+import hashlib
+import json
+import os
+import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .archive import ChunkedUploadStream, HashingSink
+
+
+BASE_URL = "https://api.figshare.com/v2/{endpoint}"
+
+
+def load_token():
+    with open(os.path.join(os.path.expanduser("~"), ".figsharerc")) as f:
+        return json.load(f)["personal_token"]
+
+
+def md5_file(fpath, blocksize=2**22):
+    """Return the hex MD5 of a file, read in blocks."""
+    md5 = hashlib.md5()
+    with open(fpath, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+class UploadError(Exception):
+    pass
+
+
+class DownloadError(Exception):
+    pass
+
+
+class FigshareClient(object):
+    """Client for one Figshare article.
+
+    The token is read once and all requests share a session whose
+    connection pool is sized for `nthreads` concurrent part uploads.
+    `base_url` can point at a local stand-in server for testing.
+    """
+    def __init__(self, article, token=None, base_url=BASE_URL, nthreads=8,
+                 retries=5, journal_dir=".upload-journal", verbose=True):
+        self.article = str(article)
+        self.token = load_token() if token is None else token
+        self.base_url = base_url
+        self.nthreads = nthreads
+        self.retries = retries
+        self.journal_dir = journal_dir
+        self.verbose = verbose
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4,
+                                                pool_maxsize=nthreads + 4)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.headers = {"Authorization": "token " + self.token}
+        self._lock = threading.Lock()
+
+    def url(self, endpoint):
+        return self.base_url.format(endpoint=endpoint)
+
+    def request(self, method, url, api=True, **kwargs):
+        """Make a request, retrying with backoff on connection errors and
+        5xx responses. API requests carry the authorization header."""
+        if api:
+            kwargs["headers"] = dict(self.headers, **kwargs.get("headers", {}))
+        for attempt in range(self.retries):
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except requests.ConnectionError:
+                if attempt == self.retries - 1:
+                    raise
+            else:
+                if resp.status_code < 500 or attempt == self.retries - 1:
+                    resp.raise_for_status()
+                    return resp
+            time.sleep(2**attempt)
+
+    def get_article_details(self):
+        endpoint = "account/articles/{}".format(self.article)
+        return self.request("GET", self.url(endpoint)).json()
+
+    def get_uploaded_files(self):
+        """Return a list of dictionaries describing each file."""
+        return self.get_article_details()["files"]
+
+    def get_file_details(self, file_id):
+        endpoint = "account/articles/{}/files/{}".format(self.article,
+                                                         file_id)
+        return self.request("GET", self.url(endpoint)).json()
+
+    def make_article_public(self):
+        endpoint = "account/articles/{}/publish".format(self.article)
+        self.request("POST", self.url(endpoint))
+
+    def _journal_path(self, name):
+        return os.path.join(self.journal_dir,
+                            name.replace(os.sep, "_") + ".json")
+
+    def _load_journal(self, name, **match):
+        """Return the journal for an unfinished upload of `name`, or `None`
+        if there is none or any of the `match` values differ from it, e.g.
+        because the file has changed since."""
+        jpath = self._journal_path(name)
+        if not os.path.isfile(jpath):
+            return None
+        with open(jpath) as f:
+            journal = json.load(f)
+        if any(journal.get(k) != v for k, v in match.items()):
+            return None
+        return journal
+
+    def _save_journal(self, name, journal):
+        if not os.path.isdir(self.journal_dir):
+            os.makedirs(self.journal_dir)
+        jpath = self._journal_path(name)
+        with self._lock:
+            tmp_path = jpath + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(journal, f, indent=4)
+            os.replace(tmp_path, jpath)
+
+    def initiate_upload(self, name, size, md5):
+        """Create a file on the article and return its ID and upload URL."""
+        endpoint = "account/articles/{}/files".format(self.article)
+        resp = self.request("POST", self.url(endpoint),
+                            data=json.dumps({"name": name, "size": size,
+                                             "md5": md5}))
+        file_id = resp.json()["location"].rsplit("/", 1)[1]
+        upload_url = self.get_file_details(file_id)["upload_url"]
+        return file_id, upload_url
+
+    def put_part(self, upload_url, part_no, data):
+        """Upload the data of one part, verified by its `Content-MD5`.
+        Returns the hex MD5."""
+        digest = hashlib.md5(data)
+        headers = {"Content-MD5": base64.b64encode(digest.digest()).decode()}
+        self.request("PUT", "{}/{}".format(upload_url, part_no), api=False,
+                     data=data, headers=headers)
+        return digest.hexdigest()
+
+    def upload_part(self, fpath, upload_url, part):
+        """Upload one part of a file. Returns the part number and hex MD5."""
+        start = part["startOffset"]
+        size = part["endOffset"] - start + 1
+        with open(fpath, "rb") as f:
+            f.seek(start)
+            data = f.read(size)
+        if len(data) != size:
+            raise UploadError("Short read of part {} of {}".format(
+                    part["partNo"], fpath))
+        return part["partNo"], self.put_part(upload_url, part["partNo"], data)
+
+    def _start(self, name, size, md5, **match):
+        """Load the journal of an interrupted upload or initiate a new one.
+        Returns the journal and the parts list from the upload service."""
+        journal = self._load_journal(name, size=size, md5=md5, **match)
+        if journal is None:
+            file_id, upload_url = self.initiate_upload(name, size, md5)
+            journal = {"name": name, "size": size, "md5": md5,
+                       "file_id": file_id, "upload_url": upload_url,
+                       "parts": {}}
+            journal.update(match)
+            self._save_journal(name, journal)
+        elif self.verbose:
+            print("Resuming upload of {} ({} parts done)".format(
+                    name, len(journal["parts"])))
+        parts = self.request("GET", journal["upload_url"],
+                             api=False).json()["parts"]
+        return journal, parts
+
+    def _todo(self, journal, part):
+        return str(part["partNo"]) not in journal["parts"] \
+               and part.get("status") != "COMPLETE"
+
+    def _record_part(self, name, journal, part_no, md5):
+        with self._lock:
+            journal["parts"][str(part_no)] = md5
+        self._save_journal(name, journal)
+
+    def _complete(self, name, journal):
+        """Mark the upload as completed, check Figshare's checksum and
+        remove the journal."""
+        endpoint = "account/articles/{}/files/{}".format(self.article,
+                                                         journal["file_id"])
+        self.request("POST", self.url(endpoint))
+        details = self.get_file_details(journal["file_id"])
+        computed_md5 = details.get("computed_md5")
+        if computed_md5 and computed_md5 != journal["md5"]:
+            raise UploadError("Checksum mismatch for {}: {} != {}".format(
+                    name, computed_md5, journal["md5"]))
+        os.remove(self._journal_path(name))
+        return journal["file_id"]
+
+    def upload_file(self, fpath, name=None):
+        """Upload a file, resuming from the journal if a previous upload of
+        the same file was interrupted. Returns the Figshare file ID."""
+        if name is None:
+            name = fpath
+        st = os.stat(fpath)
+        journal = self._load_journal(name, size=st.st_size,
+                                     mtime=st.st_mtime)
+        md5 = journal["md5"] if journal else md5_file(fpath)
+        journal, parts = self._start(name, st.st_size, md5,
+                                     mtime=st.st_mtime)
+        upload_url = journal["upload_url"]
+        todo = [p for p in parts if self._todo(journal, p)]
+        with ThreadPoolExecutor(max_workers=self.nthreads) as pool:
+            futures = [pool.submit(self.upload_part, fpath, upload_url, p)
+                       for p in todo]
+            for future in futures:
+                part_no, md5 = future.result()
+                self._record_part(name, journal, part_no, md5)
+        return self._complete(name, journal)
+
+    def upload_stream(self, write_to, name, size=None, md5=None,
+                      maxparts=None):
+        """Upload data written by `write_to(fileobj)` without storing it.
+
+        Figshare needs the size and MD5 of a file before it is uploaded, so
+        unless they are given, `write_to` is first called with a sink that
+        only hashes the data, then again to upload it. Both calls must write
+        identical bytes, as `stream_archive` does. Parts are uploaded by
+        `nthreads` threads with at most `maxparts` parts held in memory
+        (default `2*nthreads`). Interrupted uploads resume as for
+        `upload_file`. Returns the Figshare file ID.
+        """
+        if size is None or md5 is None:
+            sink = HashingSink()
+            write_to(sink)
+            size, md5 = sink.size, sink.hexdigest()
+        journal, parts = self._start(name, size, md5)
+        parts = sorted(parts, key=lambda p: p["partNo"])
+        upload_url = journal["upload_url"]
+        chunksize = parts[0]["endOffset"] - parts[0]["startOffset"] + 1
+
+        def upload_chunk(index, offset, data):
+            part = parts[index]
+            if part["startOffset"] != offset \
+                    or part["endOffset"] - offset + 1 != len(data):
+                raise UploadError("Part {} of {} does not match the stream"
+                                  .format(part["partNo"], name))
+            if self._todo(journal, part):
+                md5 = self.put_part(upload_url, part["partNo"], data)
+                self._record_part(name, journal, part["partNo"], md5)
+
+        stream = ChunkedUploadStream(upload_chunk, chunksize=chunksize,
+                                     maxchunks=maxparts or 2*self.nthreads,
+                                     nthreads=self.nthreads)
+        with stream:
+            write_to(stream)
+        if stream.size != size:
+            raise UploadError("{} changed between passes: {} != {} bytes"
+                              .format(name, stream.size, size))
+        return self._complete(name, journal)
+
+
+def get_public_files(article, base_url=BASE_URL):
+    """Return the list of file dictionaries of a public article."""
+    endpoint = "articles/{}".format(article)
+    resp = requests.get(base_url.format(endpoint=endpoint))
+    resp.raise_for_status()
+    return resp.json()["files"]
+
+
+def load_manifest(article, casedir="./", refresh=False, base_url=BASE_URL):
+    """Return a dict of `{name: {"url": ..., "size": ..., "md5": ...}}` for
+    the files of an article, fetched with one API request and cached in
+    `constant/files.json`. `constant/urls.json` is written alongside in the
+    `{name: url}` form written by `upload-figshare.py`. If only that file
+    exists, it is used and sizes and checksums are not verified.
+    """
+    fpath = os.path.join(casedir, "constant", "files.json")
+    urls_path = os.path.join(casedir, "constant", "urls.json")
+    if not refresh and os.path.isfile(fpath):
+        with open(fpath) as f:
+            return json.load(f)
+    if not refresh and os.path.isfile(urls_path):
+        with open(urls_path) as f:
+            return {name: {"url": url, "size": None, "md5": None}
+                    for name, url in json.load(f).items()}
+    base = "https://ndownloader.figshare.com/files/{id}"
+    manifest = {}
+    for f in get_public_files(article, base_url=base_url):
+        manifest[f["name"]] = {"url": f.get("download_url")
+                               or base.format(id=f["id"]),
+                               "size": f.get("size"),
+                               "md5": f.get("computed_md5") or None}
+    if not os.path.isdir(os.path.dirname(fpath)):
+        os.makedirs(os.path.dirname(fpath))
+    for path, contents in [(fpath, manifest),
+                           (urls_path, {name: m["url"] for name, m
+                                        in manifest.items()})]:
+        with open(path + ".tmp", "w") as f:
+            json.dump(contents, f, indent=4)
+        os.replace(path + ".tmp", path)
+    return manifest
+
+
+def download_file(url, fpath, size=None, md5=None, session=None, retries=5,
+                  blocksize=2**20):
+    """Download `url` to `fpath`, verifying `size` and `md5` if given.
+
+    Data is written to `fpath + ".part"`, and an existing partial file is
+    continued with an HTTP range request, so interrupted downloads resume.
+    The file is only renamed to `fpath` once it has been verified.
+    """
+    if session is None:
+        session = requests.Session()
+    part_path = fpath + ".part"
+    for attempt in range(retries):
+        digest = hashlib.md5()
+        offset = 0
+        if os.path.isfile(part_path):
+            offset = os.path.getsize(part_path)
+            if size is not None and offset > size:
+                offset = 0
+            else:
+                with open(part_path, "rb") as f:
+                    for block in iter(lambda: f.read(blocksize), b""):
+                        digest.update(block)
+        headers = {"Range": "bytes={}-".format(offset)} if offset else {}
+        try:
+            if size is None or offset < size:
+                with session.get(url, headers=headers, stream=True,
+                                 timeout=60) as resp:
+                    if resp.status_code == 416:
+                        # Nothing left to download
+                        pass
+                    else:
+                        resp.raise_for_status()
+                        if offset and resp.status_code != 206:
+                            # Range not honored, so start over
+                            offset = 0
+                            digest = hashlib.md5()
+                        with open(part_path, "r+b" if offset else "wb") as f:
+                            f.seek(offset)
+                            f.truncate()
+                            for block in resp.iter_content(blocksize):
+                                f.write(block)
+                                digest.update(block)
+        except (requests.ConnectionError, requests.Timeout,
+                requests.exceptions.ChunkedEncodingError):
+            time.sleep(2**attempt)
+            continue
+        except requests.HTTPError as e:
+            if e.response.status_code < 500 or attempt == retries - 1:
+                raise
+            time.sleep(2**attempt)
+            continue
+        actual_size = os.path.getsize(part_path)
+        if size is not None and actual_size < size:
+            # Connection dropped; resume from where it stopped
+            continue
+        if (size is not None and actual_size != size) \
+                or (md5 is not None and digest.hexdigest() != md5):
+            os.remove(part_path)
+            raise DownloadError("Verification of {} failed".format(fpath))
+        os.replace(part_path, fpath)
+        return fpath
+    raise DownloadError("Download of {} did not complete after {} attempts"
+                      .format(fpath, retries))
+
+
+def extract_archive(fpath, casedir="./", remove=True):
+    """Extract a tarball into `casedir`, then delete it if `remove`."""
+    with tarfile.open(fpath, "r:*") as tf:
+        tf.extractall(casedir)
+    if remove:
+        os.remove(fpath)
+
+
+def download_all(article, names=None, casedir="./", nthreads=4,
+                 nextract=2, extract=True, refresh=False, verbose=True):
+    """Download files of an article into `casedir` concurrently.
+
+    Files in `names` (default all in the manifest) are skipped if they, or
+    the directory a `.gz` extracts to, already exist. Each archive is
+    extracted by one of `nextract` threads as soon as its download
+    finishes, while other downloads continue. Returns the list of
+    downloaded names.
+    """
+    manifest = load_manifest(article, casedir=casedir, refresh=refresh)
+    if names is None:
+        names = sorted(manifest)
+    todo = []
+    for name in names:
+        local = os.path.join(casedir, name)
+        if os.path.exists(local) or (name.endswith(".gz")
+                                     and os.path.exists(local[:-3])):
+            if verbose:
+                print("{} already exists".format(name))
+        else:
+            todo.append(name)
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=nthreads)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    def download(name):
+        m = manifest[name]
+        if verbose:
+            print("Downloading {}".format(name))
+        return download_file(m["url"], os.path.join(casedir, name),
+                             size=m["size"], md5=m["md5"], session=session)
+
+    def _extract_one(fpath):
+        if verbose:
+            print("Extracting {}".format(os.path.basename(fpath)))
+        extract_archive(fpath, casedir=casedir)
+
+    extractions = []
+    with ThreadPoolExecutor(max_workers=nextract) as extractor:
+        with ThreadPoolExecutor(max_workers=nthreads) as pool:
+            futures = [pool.submit(download, name) for name in todo]
+            for future in as_completed(futures):
+                fpath = future.result()
+                if extract and fpath.endswith(".gz"):
+                    extractions.append(extractor.submit(_extract_one,
+                                                         fpath))
+        for future in extractions:
+            future.result()
+    return todo
+
+
+class _StandInHandler(object):
+    """Request handling of a minimal stand-in for the Figshare API and
+    upload service, mixed into `http.server.BaseHTTPRequestHandler` by
+    `test_upload_resume`. Parts with a wrong `Content-MD5` are rejected,
+    like Figshare does."""
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, code, body=None, location=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(code)
+        if location is not None:
+            self.send_header("Location", location)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_GET(self):
+        s = self.server
+        path = self.path.strip("/").split("/")
+        if path[0] == "upload":
+            f = s.files[path[1]]
+            parts = []
+            for n, start in enumerate(range(0, f["size"], s.part_size)):
+                parts.append({"partNo": n + 1, "startOffset": start,
+                              "endOffset": min(start + s.part_size,
+                                               f["size"]) - 1,
+                              "status": "COMPLETE" if n + 1 in f["parts"]
+                                        else "PENDING"})
+            self._reply(200, {"parts": parts})
+        else:
+            f = s.files[path[-1]]
+            self._reply(200, {"id": int(path[-1]), "name": f["name"],
+                              "size": f["size"],
+                              "upload_url": "{}/upload/{}".format(s.url,
+                                                                  path[-1]),
+                              "computed_md5": f["computed_md5"]})
+
+    def do_PUT(self):
+        s = self.server
+        path = self.path.strip("/").split("/")
+        part_no = int(path[2])
+        data = self._body()
+        header = self.headers.get("Content-MD5")
+        if header != base64.b64encode(hashlib.md5(data).digest()).decode():
+            self._reply(400, {"message": "Content-MD5 mismatch"})
+            return
+        if part_no in s.fail_parts:
+            s.fail_parts.remove(part_no)
+            self._reply(400, {"message": "Injected failure"})
+            return
+        if s.corrupt:
+            data = data[::-1]
+        s.files[path[1]]["parts"][part_no] = data
+        s.puts.append(part_no)
+        self._reply(200)
+
+    def do_POST(self):
+        s = self.server
+        path = self.path.strip("/").split("/")
+        if path[-1] == "files":
+            body = json.loads(self._body().decode())
+            file_id = str(len(s.files) + 1)
+            s.files[file_id] = {"name": body["name"], "size": body["size"],
+                                "parts": {}, "computed_md5": ""}
+            location = "{}/account/articles/{}/files/{}".format(
+                    s.url, path[2], file_id)
+            self._reply(201, {"location": location}, location=location)
+        else:
+            self._body()
+            f = s.files[path[-1]]
+            data = b"".join(f["parts"][n] for n in sorted(f["parts"]))
+            f["computed_md5"] = hashlib.md5(data).hexdigest()
+            self._reply(202)
+
+
+def test_upload_resume():
+    """Upload a file in parts to a local stand-in for the Figshare upload
+    service. A part that fails leaves a journal, and the next upload only
+    sends the parts that are missing. A file that arrives corrupted is
+    caught by its checksum."""
+    import shutil
+    import tempfile
+    try:
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    except ImportError:
+        return
+    handler = type("Handler", (_StandInHandler, BaseHTTPRequestHandler), {})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.url = "http://127.0.0.1:{}".format(server.server_address[1])
+    server.part_size = 2**16
+    server.files = {}
+    server.puts = []
+    server.fail_parts = set([3])
+    server.corrupt = False
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    tmp = tempfile.mkdtemp()
+    try:
+        fpath = os.path.join(tmp, "0.02.gz")
+        with open(fpath, "wb") as f:
+            f.write(os.urandom(5*server.part_size + 1000))
+        client = FigshareClient("1", token="test", nthreads=4,
+                                base_url=server.url + "/{endpoint}",
+                                journal_dir=os.path.join(tmp, "journal"),
+                                verbose=False)
+        try:
+            client.upload_file(fpath, name="0.02.gz")
+        except requests.HTTPError:
+            pass
+        else:
+            raise AssertionError("Injected failure was not raised")
+        assert os.path.isfile(client._journal_path("0.02.gz"))
+        assert 3 not in server.puts
+        file_id = client.upload_file(fpath, name="0.02.gz")
+        # Every part was sent once, over both attempts
+        assert sorted(server.puts) == list(range(1, 7))
+        assert len(server.files) == 1
+        assert not os.path.isfile(client._journal_path("0.02.gz"))
+        assert client.get_file_details(file_id)["computed_md5"] \
+                == md5_file(fpath)
+        server.corrupt = True
+        try:
+            client.upload_file(fpath, name="0.04.gz")
+        except UploadError:
+            pass
+        else:
+            raise AssertionError("Checksum mismatch was not detected")
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(tmp)
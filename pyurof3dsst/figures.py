@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+"""Rendering all figures of one or more cases in parallel.
+
+The wake data of each case are loaded once, in the parent process, and the
+profile plots are taken from the same `WakeFields` instead of reading the
+sets again. Figures are rendered in a pool of processes with the Agg
+backend. A hash of each figure's input data and plotting parameters is kept
+in a JSON file, and figures whose hash has not changed and whose file
+exists are skipped.
+"""
+
+from __future__ import division, print_function
+import numpy as np
+import pandas as pd
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from .batch import expand_cases
+from .processing import load_wake_fields
+
+# Figures made by default, as `(name, keyword arguments)`
+default_figures = [("meancontquiv", {}),
+                   ("kcont", {}),
+                   ("u_profile", {"z_H": 0.0}),
+                   ("k_profile", {"z_H": 0.0, "amount": "total"})]
+
+# `WakeFields` fields shown by figures that plot whole wake maps
+wake_fields = {"meancontquiv": ["u", "v", "w"], "kcont": ["k_total"]}
+
+
+def figure_fname(name, kwargs, savetype=".pdf"):
+    """Return the file name the plotting function of figure `name` saves
+    to."""
+    if name == "u_profile":
+        return "u_profile_{}_SA{}".format(kwargs.get("z_H", 0.0), savetype)
+    if name == "k_profile":
+        return "k_{}_profile_{}_SA{}".format(kwargs.get("amount", "total"),
+                                             kwargs.get("z_H", 0.0),
+                                             savetype)
+    return name + savetype
+
+
+def profile_frame(wake, z_H, fields):
+    """Return a profile at `z_H` from a `WakeFields` object as a `DataFrame`
+    with `y_R` and `fields` as columns, like `load_u_profile`."""
+    df = pd.DataFrame()
+    df["y_R"] = np.asarray(wake.y_R)
+    i = list(wake.z_H).index(float(z_H))
+    for name, field in fields.items():
+        df[name] = wake.data[wake.fields.index(field), i]
+    return df
+
+
+def figure_data(name, kwargs, wake):
+    """Return the data keyword argument of the plotting function of
+    figure `name`."""
+    if name == "u_profile":
+        return {"df": profile_frame(wake, kwargs.get("z_H", 0.0),
+                                    {"u": "u"})}
+    if name == "k_profile":
+        return {"df": profile_frame(wake, kwargs.get("z_H", 0.0),
+                                    {"k_resolved": "k_resolved",
+                                     "k_modeled": "k_modeled",
+                                     "k_total": "k_total"})}
+    return {"wake": wake}
+
+
+def data_hash(data, fields=None):
+    """Return a hex digest of the arrays in a figure's data, including only
+    `fields` of a `WakeFields` object if given."""
+    digest = hashlib.blake2b(digest_size=16)
+    for key in sorted(data):
+        value = data[key]
+        digest.update(key.encode())
+        if isinstance(value, pd.DataFrame):
+            digest.update(",".join(value.columns).encode())
+            arrays = [value.values]
+        else:
+            fields = value.fields if fields is None else fields
+            digest.update(",".join(fields).encode())
+            arrays = [value.data[[value.fields.index(f) for f in fields]],
+                      value.z_H, value.y_R]
+        for array in arrays:
+            digest.update(np.ascontiguousarray(array, dtype=float).tobytes())
+    return digest.hexdigest()
+
+
+def figure_key(name, kwargs, savetype, data):
+    return hashlib.blake2b(
+            json.dumps([name, kwargs, savetype], sort_keys=True).encode()
+            + data_hash(data, wake_fields.get(name)).encode(),
+            digest_size=16).hexdigest()
+
+
+def _init_worker():
+    import matplotlib.pyplot as plt
+    plt.switch_backend("Agg")
+
+
+def render_figure(job):
+    """Render and save one figure, given `(name, kwargs, data, savedir,
+    savetype)`. Errors are caught and returned so one broken figure does
+    not stop the others."""
+    import matplotlib.pyplot as plt
+    from . import plotting
+    name, kwargs, data, savedir, savetype = job
+    try:
+        kwargs = dict(kwargs, **data)
+        getattr(plotting, "plot_" + name)(save=True, savedir=savedir,
+                                          savetype=savetype, **kwargs)
+        return None
+    except Exception as e:
+        return "{}: {}".format(type(e).__name__, e)
+    finally:
+        plt.close("all")
+
+
+def make_all_figures(cases="./", figures=default_figures, time=None,
+                     savetype=".pdf", state_file="processed/figures.json",
+                     nprocs=None, force=False, verbose=True):
+    """Render `figures`, a list of `(name, kwargs)` of `plotting.plot_<name>`
+    functions, for every case in `cases` (a glob pattern or list of
+    patterns/paths of case roots) into `<case>/figures`.
+
+    Figures are rendered in a pool of `nprocs` processes. Figures whose data
+    and parameters have the same hash as recorded in `state_file` are
+    skipped, unless `force` is `True`. Returns a dict of the error of each
+    figure that failed, keyed by its path.
+    """
+    if os.path.isfile(state_file):
+        with open(state_file) as f:
+            state = json.load(f)
+    else:
+        state = {}
+    jobs = []
+    keys = []
+    errors = {}
+    for casedir in expand_cases(cases):
+        savedir = os.path.join(casedir, "figures")
+        try:
+            wake = load_wake_fields(time, casedir=casedir)
+        except Exception as e:
+            errors[savedir] = "{}: {}".format(type(e).__name__, e)
+            continue
+        for name, kwargs in figures:
+            fpath = os.path.join(savedir, figure_fname(name, kwargs,
+                                                       savetype))
+            data = figure_data(name, kwargs, wake)
+            key = figure_key(name, kwargs, savetype, data)
+            if not force and state.get(fpath) == key \
+                    and os.path.isfile(fpath):
+                continue
+            jobs.append((name, kwargs, data, savedir, savetype))
+            keys.append((fpath, key))
+    if verbose:
+        print("Rendering {} figures".format(len(jobs)))
+    if jobs:
+        with ProcessPoolExecutor(max_workers=nprocs,
+                                 initializer=_init_worker) as pool:
+            for (fpath, key), error in zip(keys, pool.map(render_figure,
+                                                          jobs)):
+                if error is not None:
+                    errors[fpath] = error
+                    state.pop(fpath, None)
+                else:
+                    state[fpath] = key
+    for fpath, error in errors.items():
+        print("Failed to make {} ({})".format(fpath, error))
+    state_dir = os.path.dirname(state_file)
+    if state_dir and not os.path.isdir(state_dir):
+        os.makedirs(state_dir)
+    with open(state_file + ".tmp", "w") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(state_file + ".tmp", state_file)
+    return errors
@@ -0,0 +1,420 @@
+#!/usr/bin/env python
+"""Reading of OpenFOAM `forces` function object output."""
+
+from __future__ import division, print_function
+import numpy as np
+import json
+import os
+import warnings
+import foampy
+from .motion import read_omega_table, read_theta_table
+from .profiling import stage
+
+
+# Column indices in a `forces.dat` row once parentheses are stripped:
+# time, forces(pressure viscous porous), moment(pressure viscous porous)
+ncols = 19
+cols = {"fx_p": 1, "fx_v": 4, "mz_p": 12, "mz_v": 15}
+
+# Quantities reduced by `PerfReducer`
+quantities = ("tsr", "cp", "cd")
+
+_strip_parens = bytes.maketrans(b"()\t", b"   ")
+
+
+def get_forces_segments(casedir="./", object_name="forces"):
+    """Return a list of `(start_time, path)` tuples for each `forces.dat`
+    segment, sorted numerically by start time, which is the order the
+    segments of a restarted run were written in."""
+    forces_dir = os.path.join(casedir, "postProcessing", object_name)
+    if not os.path.isdir(forces_dir):
+        return []
+    segments = []
+    for d in os.listdir(forces_dir):
+        fpath = os.path.join(forces_dir, d, "forces.dat")
+        try:
+            start_time = float(d)
+        except ValueError:
+            continue
+        if os.path.isfile(fpath):
+            segments.append((start_time, fpath))
+    return sorted(segments)
+
+
+def get_forces_files(casedir="./", object_name="forces"):
+    """Return a list of `forces.dat` paths sorted by start time."""
+    return [f for _, f in get_forces_segments(casedir, object_name)]
+
+
+def get_last_time(casedir="./", nbytes=4096):
+    """Return the last time step written to the `forces` output, reading only
+    the end of the last segment, or `None` if there is none."""
+    fpaths = get_forces_files(casedir)
+    if not fpaths:
+        return None
+    with open(fpaths[-1], "rb") as f:
+        f.seek(0, 2)
+        f.seek(max(0, f.tell() - nbytes))
+        lines = f.read().splitlines()
+    for line in reversed(lines):
+        ls = line.split()
+        if ls and not line.startswith(b"#") \
+                and line.count(b"(") == line.count(b")") > 0:
+            return float(ls[0])
+    return None
+
+
+def parse_forces_text(text):
+    """Parse the text of a `forces.dat` file (or any whole number of its
+    lines) into an array with one row per time step."""
+    if not isinstance(text, bytes):
+        text = text.encode()
+    if b"#" in text:
+        text = b"\n".join(l for l in text.splitlines()
+                          if not l.startswith(b"#"))
+    text = text.translate(_strip_parens)
+    data = np.fromstring(text.decode(), sep=" ")
+    return data.reshape((-1, ncols))
+
+
+def calc_torque_drag(data):
+    """Compute time, torque about z and drag in x from parsed forces rows."""
+    t = data[:, 0]
+    torque = data[:, cols["mz_p"]] + data[:, cols["mz_v"]]
+    drag = data[:, cols["fx_p"]] + data[:, cols["fx_v"]]
+    return t, torque, drag
+
+
+def iter_forces_chunks(casedir="./", chunksize=2**22, offsets=None):
+    """Generate `(fpath, offset, rows)` for chunks of about `chunksize` bytes
+    of the `forces` output, with `offset` the byte offset to resume `fpath`
+    from after `rows`.
+
+    Segments are read in start time order. Rows a segment wrote past the
+    start time of the next segment are dropped, since the restarted run
+    supersedes them, and rows of a restarted segment up to its own start
+    time are dropped, so the row at the restart time is kept once. Reading
+    starts from `offsets[fpath]` if present, and a
+    partially written last line is left for the next read.
+    """
+    if offsets is None:
+        offsets = {}
+    segments = get_forces_segments(casedir)
+    t_starts = [-np.inf] + [t for t, _ in segments[1:]]
+    t_ends = t_starts[1:] + [np.inf]
+    for (_, fpath), t_start, t_end in zip(segments, t_starts, t_ends):
+        offset = offsets.get(fpath, 0)
+        remainder = b""
+        with open(fpath, "rb") as f:
+            f.seek(offset)
+            while True:
+                raw = f.read(chunksize)
+                if not raw:
+                    break
+                raw = remainder + raw
+                end = raw.rfind(b"\n") + 1
+                remainder = raw[end:]
+                offset += end
+                data = parse_forces_text(raw[:end])
+                t = data[:, 0]
+                yield fpath, offset, data[(t > t_start) & (t <= t_end)]
+
+
+class ThetaOmega(object):
+    """Rotor angle and angular velocity interpolated from the `omega` table
+    in `constant/dynamicMeshDict`. The angle is read from
+    `constant/thetaTable` if it was written with the table, i.e., has the
+    same times, and otherwise integrated by `foampy.load_theta_omega`."""
+    def __init__(self, casedir="./"):
+        theta_table = read_theta_table(casedir)
+        if theta_table is not None:
+            t_omega, omega = read_omega_table(casedir)
+            if np.array_equal(theta_table[0], t_omega):
+                self.t, self.theta = theta_table
+                self.omega = omega
+            else:
+                warnings.warn("constant/thetaTable does not match the omega "
+                              "table in constant/dynamicMeshDict; "
+                              "integrating omega instead")
+                theta_table = None
+        if theta_table is None:
+            self.t, self.theta, self.omega = foampy.load_theta_omega(
+                    casedir=casedir)
+        self._slopes = None
+
+    def __call__(self, t):
+        """Return theta in degrees and omega in rad/s at times `t`."""
+        return (np.interp(t, self.t, self.theta),
+                np.interp(t, self.t, self.omega))
+
+    def domega_dt(self, t):
+        """Return the rate of change in rad/s**2 of the interpolated omega at
+        times `t`, i.e., the slope of the table segment containing each time.
+        This is what differencing omega interpolated at the time steps with
+        `fdiff.second_order_diff` gave, except within one time step of a
+        table point, and does not depend on how rows are chunked."""
+        if self._slopes is None:
+            self._slopes = np.diff(self.omega)/np.diff(self.t)
+        i = np.searchsorted(self.t, t, side="right") - 1
+        return self._slopes[np.clip(i, 0, len(self._slopes) - 1)]
+
+
+def calc_perf_rows(data, theta_omega, R, U_infty, rho, area, inertial=False,
+                   inertia=3):
+    """Compute theta, TSR, C_P and C_D for parsed forces rows."""
+    t, torque, drag = calc_torque_drag(data)
+    theta, omega = theta_omega(t)
+    if inertial:
+        torque = torque - inertia*theta_omega.domega_dt(t)
+    tsr = omega*R/U_infty
+    cp = torque*omega/(0.5*rho*area*U_infty**3)
+    cd = drag/(0.5*rho*area*U_infty**2)
+    return theta, tsr, cp, cd
+
+
+def write_perf_csv(f, theta, tsr, cp, cd):
+    """Write rows of performance data to an open CSV file."""
+    np.savetxt(f, np.column_stack([theta, tsr, cp, cd]), delimiter=",",
+               fmt="%.17g")
+
+
+class RunningStats(object):
+    """Count, mean, sum of squared deviations, min and max of each row of a
+    2-D array, merged chunk by chunk with Chan et al.'s parallel update."""
+    def __init__(self, nvars):
+        self.n = 0
+        self.mean = np.zeros(nvars)
+        self.m2 = np.zeros(nvars)
+        self.min = np.full(nvars, np.inf)
+        self.max = np.full(nvars, -np.inf)
+
+    def update(self, x):
+        nb = x.shape[1]
+        if nb == 0:
+            return
+        mean_b = x.mean(axis=1)
+        m2_b = ((x - mean_b[:, None])**2).sum(axis=1)
+        n = self.n + nb
+        delta = mean_b - self.mean
+        self.mean = self.mean + delta*nb/n
+        self.m2 = self.m2 + m2_b + delta**2*self.n*nb/n
+        self.n = n
+        self.min = np.minimum(self.min, x.min(axis=1))
+        self.max = np.maximum(self.max, x.max(axis=1))
+
+    @property
+    def var(self):
+        if self.n < 2:
+            return np.full(len(self.mean), np.nan)
+        return self.m2/(self.n - 1)
+
+    def to_dict(self):
+        return {"n": self.n, "mean": self.mean.tolist(),
+                "m2": self.m2.tolist(), "min": self.min.tolist(),
+                "max": self.max.tolist()}
+
+    @classmethod
+    def from_dict(cls, d):
+        stats = cls(len(d["mean"]))
+        stats.n = d["n"]
+        for key in ("mean", "m2", "min", "max"):
+            setattr(stats, key, np.array(d[key], dtype=float))
+        return stats
+
+
+class PerfReducer(object):
+    """Single-pass reduction of TSR, C_P and C_D after `theta_0` degrees.
+
+    Statistics after 1 degree are kept alongside as the fallback used when a
+    run has not yet reached `theta_0`.
+    """
+    def __init__(self, theta_0=360):
+        self.theta_0 = theta_0
+        self.theta_max = -np.inf
+        self.stats = {"theta_0": RunningStats(len(quantities)),
+                      "theta_1": RunningStats(len(quantities))}
+
+    def update(self, theta, tsr, cp, cd):
+        if len(theta) == 0:
+            return
+        x = np.vstack((tsr, cp, cd))
+        self.stats["theta_0"].update(x[:, theta >= self.theta_0])
+        self.stats["theta_1"].update(x[:, theta >= 1])
+        self.theta_max = max(self.theta_max, float(theta.max()))
+
+    @property
+    def reached_theta_0(self):
+        return self.theta_max >= self.theta_0
+
+    @property
+    def theta_start(self):
+        """The angle statistics are computed from."""
+        return self.theta_0 if self.reached_theta_0 else 1
+
+    def results(self):
+        """Return a dict of mean, standard deviation, min and max of each
+        quantity, e.g., `results["cp"]["mean"]`."""
+        stats = self.stats["theta_0" if self.reached_theta_0 else "theta_1"]
+        std = np.sqrt(stats.var)
+        res = {}
+        for i, q in enumerate(quantities):
+            if stats.n == 0:
+                res[q] = {"mean": np.nan, "std": np.nan, "min": np.nan,
+                          "max": np.nan}
+            else:
+                res[q] = {"mean": stats.mean[i], "std": std[i],
+                          "min": stats.min[i], "max": stats.max[i]}
+        return res
+
+    def means(self):
+        """Return mean TSR, C_P and C_D with the keys used by `calc_perf`."""
+        res = self.results()
+        return {"TSR": res["tsr"]["mean"], "C_P": res["cp"]["mean"],
+                "C_D": res["cd"]["mean"]}
+
+    def to_dict(self):
+        return {"theta_0": self.theta_0, "theta_max": self.theta_max,
+                "stats": {k: v.to_dict() for k, v in self.stats.items()}}
+
+    @classmethod
+    def from_dict(cls, d):
+        reducer = cls(d["theta_0"])
+        reducer.theta_max = d["theta_max"]
+        reducer.stats = {k: RunningStats.from_dict(v)
+                         for k, v in d["stats"].items()}
+        return reducer
+
+
+def reduce_perf(R, U_infty, rho, area, casedir="./", theta_0=360,
+                inertial=False, chunksize=2**22, csv_file=None, keep=False):
+    """Compute performance statistics in one pass over the `forces` output
+    with memory bounded by `chunksize`.
+
+    Rows are also written to `csv_file` if given. Returns the `PerfReducer`
+    and, if `keep` is `True`, a tuple of the full theta, TSR, C_P and C_D
+    arrays (e.g., for plotting), otherwise `None`.
+    """
+    theta_omega = ThetaOmega(casedir)
+    reducer = PerfReducer(theta_0)
+    kept = []
+    f = open(csv_file, "w") if csv_file is not None else None
+    try:
+        if f is not None:
+            f.write("theta_deg,tsr,cp,cd\n")
+        chunks = iter_forces_chunks(casedir, chunksize=chunksize)
+        while True:
+            with stage("parse"):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            with stage("numerics"):
+                rows = calc_perf_rows(chunk[2], theta_omega, R, U_infty, rho,
+                                      area, inertial=inertial)
+                reducer.update(*rows)
+            if f is not None:
+                with stage("write"):
+                    write_perf_csv(f, *rows)
+            if keep:
+                kept.append(rows)
+    finally:
+        if f is not None:
+            f.close()
+    if keep:
+        kept = tuple(np.concatenate(x) for x in zip(*kept)) if kept \
+               else tuple(np.zeros(0) for q in range(4))
+        return reducer, kept
+    return reducer, None
+
+
+class IncrementalPerf(object):
+    """Running performance statistics persisted between calls of
+    `calc_perf`.
+
+    The state records the byte offset reached in each `forces.dat` segment,
+    the last time step read, and the `PerfReducer` state, so only rows
+    appended since the previous call need to be parsed.
+    """
+    def __init__(self, casedir="./", theta_0=360, inertial=False,
+                 state_file="processed/perf_state.json",
+                 csv_file="processed/perf.csv"):
+        self.casedir = casedir
+        self.theta_0 = theta_0
+        self.inertial = inertial
+        self.state_path = os.path.join(casedir, state_file)
+        self.csv_path = os.path.join(casedir, csv_file)
+        self.load()
+
+    def reset(self):
+        """Start the running statistics from scratch."""
+        self.offsets = {}
+        self.t_last = -np.inf
+        self.nrows = 0
+        self.reducer = PerfReducer(self.theta_0)
+
+    @property
+    def theta_max(self):
+        return self.reducer.theta_max
+
+    def load(self):
+        """Load saved state, resetting if it does not match this setup."""
+        self.reset()
+        if not os.path.isfile(self.state_path) \
+                or not os.path.isfile(self.csv_path):
+            return
+        with open(self.state_path) as f:
+            state = json.load(f)
+        if state.get("theta_0") != self.theta_0 \
+                or state.get("inertial") != self.inertial \
+                or "reducer" not in state:
+            return
+        for fpath, offset in state["offsets"].items():
+            if not os.path.isfile(fpath) or os.path.getsize(fpath) < offset:
+                # Output has been truncated or rewritten
+                return
+        for start_time, fpath in get_forces_segments(self.casedir):
+            if fpath not in state["offsets"] \
+                    and start_time <= state["t_last"]:
+                # A restart has superseded rows already accumulated
+                return
+        self.offsets = state["offsets"]
+        self.t_last = state["t_last"]
+        self.nrows = state["nrows"]
+        self.reducer = PerfReducer.from_dict(state["reducer"])
+
+    def save(self):
+        state = {"theta_0": self.theta_0, "inertial": self.inertial,
+                 "offsets": self.offsets, "t_last": self.t_last,
+                 "nrows": self.nrows, "reducer": self.reducer.to_dict()}
+        with open(self.state_path, "w") as f:
+            json.dump(state, f, indent=4)
+
+    def update(self, R, U_infty, rho, area):
+        """Update the running statistics and `perf.csv` with new time steps.
+        Returns the number of new rows."""
+        theta_omega = ThetaOmega(self.casedir)
+        mode = "a" if self.nrows > 0 else "w"
+        nrows = 0
+        with open(self.csv_path, mode) as f:
+            if mode == "w":
+                f.write("theta_deg,tsr,cp,cd\n")
+            for fpath, offset, data in iter_forces_chunks(
+                    self.casedir, offsets=self.offsets):
+                self.offsets[fpath] = offset
+                data = data[data[:, 0] > self.t_last]
+                if len(data) == 0:
+                    continue
+                rows = calc_perf_rows(data, theta_omega, R, U_infty, rho,
+                                      area, inertial=self.inertial)
+                self.reducer.update(*rows)
+                write_perf_csv(f, *rows)
+                self.t_last = float(data[-1, 0])
+                nrows += len(data)
+        self.nrows += nrows
+        self.save()
+        return nrows
+
+    def means(self):
+        """Return mean TSR, C_P and C_D, whether `theta_0` has been reached,
+        and the starting angle the means are computed from."""
+        return (self.reducer.means(), self.reducer.reached_theta_0,
+                self.reducer.theta_start)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""Reading `polyMesh` directories and computing cell centres.
+
+Face and cell centres are computed as OpenFOAM does in `primitiveMesh`:
+faces are split into triangles about the mean of their points, and cells
+into pyramids about the mean of their face centres. All operations are
+vectorized over faces and cells.
+"""
+
+from __future__ import division, print_function
+import numpy as np
+import os
+from . import fields as foamfields
+
+
+def read_faces(fpath):
+    """Return the faces of a `faces` file as `(offsets, labels)`, where the
+    points of face `i` are `labels[offsets[i]:offsets[i + 1]]`."""
+    header = foamfields.read_header(fpath)
+    if header.get("class") == "faceCompactList":
+        offsets = np.asarray(foamfields.read_list(fpath)[0])
+        labels = np.asarray(foamfields.read_list(fpath, skip=1)[0])
+        return offsets, labels
+    # An ASCII `faceList` is a list of `n(a b c ...)`, which `read_list`
+    # flattens to the sizes followed by the labels of each face
+    tokens = np.asarray(foamfields.read_list(fpath, mmap_mode=False)[0])
+    sizes = []
+    pos = 0
+    while pos < len(tokens):
+        sizes.append(tokens[pos])
+        pos += tokens[pos] + 1
+    sizes = np.array(sizes, dtype=int)
+    offsets = np.zeros(len(sizes) + 1, dtype=int)
+    offsets[1:] = np.cumsum(sizes)
+    # Drop the size preceding each face's labels
+    keep = np.ones(len(tokens), dtype=bool)
+    keep[offsets[:-1] + np.arange(len(sizes))] = False
+    return offsets, tokens[keep]
+
+
+def read_mesh(meshdir, points_dir=None):
+    """Return a dict of `points`, face `offsets` and `labels`, `owner` and
+    `neighbour` from a `polyMesh` directory. Points are read from
+    `points_dir` if given, e.g. for a moving mesh."""
+    if points_dir is None:
+        points_dir = meshdir
+    mesh = {"points": np.asarray(foamfields.read_list(
+            os.path.join(points_dir, "points"))[0], dtype=float)}
+    mesh["offsets"], mesh["labels"] = read_faces(os.path.join(meshdir,
+                                                              "faces"))
+    for name in ["owner", "neighbour"]:
+        mesh[name] = np.asarray(foamfields.read_list(
+                os.path.join(meshdir, name))[0])
+    return mesh
+
+
+def face_centres_areas(points, offsets, labels):
+    """Return face centres and area vectors, with triangles about each
+    face's point average weighted by area."""
+    sizes = np.diff(offsets)
+    face = np.repeat(np.arange(len(sizes)), sizes)
+    p = points[labels]
+    estimate = np.add.reduceat(p, offsets[:-1], axis=0)/sizes[:, None]
+    # The next point of each face, wrapping around
+    nxt = np.arange(len(labels)) + 1
+    nxt[offsets[1:] - 1] = offsets[:-1]
+    pn = points[labels[nxt]]
+    c = p + pn + estimate[face]
+    n = np.cross(pn - p, estimate[face] - p)
+    a = np.sqrt((n**2).sum(axis=1))
+    sum_n = np.add.reduceat(n, offsets[:-1], axis=0)
+    sum_a = np.add.reduceat(a, offsets[:-1])
+    sum_ac = np.add.reduceat(a[:, None]*c, offsets[:-1], axis=0)
+    centres = np.where(sum_a[:, None] > 1e-300,
+                       sum_ac/(3*np.maximum(sum_a, 1e-300)[:, None]),
+                       estimate)
+    return centres, 0.5*sum_n
+
+
+def _bincount3(index, weights, n):
+    return np.column_stack([np.bincount(index, weights[:, i], minlength=n)
+                            for i in range(weights.shape[1])])
+
+
+def cell_centres_volumes(mesh, ncells=None):
+    """Return cell centres and volumes of a mesh from `read_mesh`."""
+    owner = mesh["owner"]
+    neighbour = mesh["neighbour"]
+    nint = len(neighbour)
+    if ncells is None:
+        ncells = int(max(owner.max(), neighbour.max() if nint else 0)) + 1
+    fc, fa = face_centres_areas(mesh["points"], mesh["offsets"],
+                                mesh["labels"])
+    nfaces = np.bincount(owner, minlength=ncells) \
+           + np.bincount(neighbour, minlength=ncells)
+    estimate = (_bincount3(owner, fc, ncells)
+                + _bincount3(neighbour, fc[:nint], ncells))/nfaces[:, None]
+    # Pyramid volumes (times 3) and centroids about the estimated centre
+    vol_own = np.maximum((fa*(fc - estimate[owner])).sum(axis=1), 1e-300)
+    vol_nei = np.maximum((fa[:nint]*(estimate[neighbour]
+                                     - fc[:nint])).sum(axis=1), 1e-300)
+    pc_own = 0.75*fc + 0.25*estimate[owner]
+    pc_nei = 0.75*fc[:nint] + 0.25*estimate[neighbour]
+    vol = np.bincount(owner, vol_own, minlength=ncells) \
+        + np.bincount(neighbour, vol_nei, minlength=ncells)
+    centres = (_bincount3(owner, vol_own[:, None]*pc_own, ncells)
+               + _bincount3(neighbour, vol_nei[:, None]*pc_nei, ncells)) \
+            / vol[:, None]
+    return centres, vol/3
+
+
+def _case_cell_centres(casedir, time):
+    meshdir = os.path.join(casedir, "constant", "polyMesh")
+    points_dir = meshdir
+    if time is not None:
+        meshdir = foamfields.find_mesh_dir(casedir, time, "faces")
+        points_dir = foamfields.find_mesh_dir(casedir, time, "points")
+    ncells = foamfields.get_ncells(meshdir)
+    return cell_centres_volumes(read_mesh(meshdir, points_dir), ncells)[0]
+
+
+def cell_centres(casedir="./", time=None):
+    """Return the cell centres of a case's mesh, with the points of `time`
+    for a moving mesh. Decomposed cases are put in global cell order with
+    `cellProcAddressing`."""
+    if os.path.isfile(os.path.join(casedir, "constant", "polyMesh",
+                                   "owner")):
+        return _case_cell_centres(casedir, time)
+    procdirs = foamfields.list_processor_dirs(casedir)
+    if not procdirs:
+        raise IOError("No mesh found in {}".format(casedir))
+    parts = [_case_cell_centres(d, time) for d in procdirs]
+    addressing = [foamfields.read_list(os.path.join(
+                  foamfields.find_mesh_dir(d, time or "constant",
+                                           "cellProcAddressing"),
+                  "cellProcAddressing"))[0] for d in procdirs]
+    centres = np.empty((sum(len(a) for a in addressing), 3))
+    for part, addr in zip(parts, addressing):
+        centres[addr] = part
+    return centres
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+"""Persistent spatial index over the cells of a mesh.
+
+The index is built once from a `polyMesh` directory and saved in
+`processed/cellIndex/<mesh dir>`, such as `constant_polyMesh`, outside the time
+and mesh directories that are archived for upload:
+
+    centres.npy     cell centres, in cell order
+    bbox.npy        cell bounding boxes as float32 `(ncells, 2, 3)` arrays of
+                    minima and maxima, rounded outwards
+    order.npy       cells sorted by the bin of a uniform grid holding their
+                    centres
+    starts.npy      offsets of each bin's cells in `order`
+    index.json      grid geometry and the size, mtime and hash of the
+                    `points` and `owner` files the index was built from
+
+Loading only memory maps the arrays, so it takes milliseconds even for the
+10+ M-cell meshes. The index is rebuilt when `points` or `owner` change;
+files whose mtime changed but whose hash is the same are accepted. Nearest
+cell queries build a KD-tree over only the bins around the query points,
+widening the search until the result is exact.
+
+Usage::
+
+    index = CellIndex(time="9.98")
+    dist, cells = index.query(points, k=8)
+    cells = index.find_cells(points)   # -1 outside the mesh
+"""
+
+from __future__ import division, print_function
+import numpy as np
+import hashlib
+import json
+import os
+from . import fields as foamfields
+from .mesh import read_mesh, cell_centres_volumes
+
+# Average number of cells per bin
+cells_per_bin = 32
+_arrays = ["centres", "bbox", "order", "starts"]
+
+
+def file_hash(fpath, blocksize=2**22):
+    """Return the hex BLAKE2b digest of a file, read in blocks."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(fpath, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cell_bounds(mesh, ncells):
+    """Return the minima and maxima of the points of each cell of a mesh
+    from `read_mesh`, each of shape `(ncells, 3)`."""
+    offsets = mesh["offsets"]
+    p = mesh["points"][mesh["labels"]]
+    fmin = np.minimum.reduceat(p, offsets[:-1], axis=0)
+    fmax = np.maximum.reduceat(p, offsets[:-1], axis=0)
+    del p
+    nint = len(mesh["neighbour"])
+    cells = np.concatenate([mesh["owner"], mesh["neighbour"]])
+    faces = np.concatenate([np.arange(len(mesh["owner"])), np.arange(nint)])
+    order = np.argsort(cells, kind="stable")
+    faces = faces[order]
+    starts = np.searchsorted(cells[order], np.arange(ncells))
+    return (np.minimum.reduceat(fmin[faces], starts, axis=0),
+            np.maximum.reduceat(fmax[faces], starts, axis=0))
+
+
+def _save_npy(fpath, array):
+    with open(fpath + ".tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(fpath + ".tmp", fpath)
+
+
+class CellIndex(object):
+    """Spatial index over the cells of the mesh of `casedir` at `time`.
+
+    The mesh in `constant/polyMesh` is used unless `time` has its own
+    `polyMesh/points`, as for a moving mesh. The saved index is loaded if it
+    is up to date and rebuilt otherwise, or always if `rebuild` is set.
+    """
+    def __init__(self, casedir="./", time=None, rebuild=False):
+        self.casedir = casedir
+        if time is None:
+            self.points_dir = os.path.join(casedir, "constant", "polyMesh")
+            self.mesh_dir = self.points_dir
+        else:
+            self.points_dir = foamfields.find_mesh_dir(casedir, time,
+                                                       "points")
+            self.mesh_dir = foamfields.find_mesh_dir(casedir, time, "owner")
+        name = os.path.relpath(self.points_dir, casedir).replace(os.sep, "_")
+        self.path = os.path.join(casedir, "processed", "cellIndex", name)
+        self.sources = {"points": os.path.join(self.points_dir, "points"),
+                        "owner": os.path.join(self.mesh_dir, "owner")}
+        for fpath in self.sources.values():
+            if not os.path.isfile(fpath):
+                raise IOError("No mesh file {}".format(fpath))
+        if rebuild or not self.load():
+            self.build()
+            self.load()
+
+    def _check_sources(self, meta):
+        """Return whether the source files match those recorded in `meta`,
+        updating recorded mtimes of files with unchanged contents."""
+        touched = False
+        for name, fpath in self.sources.items():
+            size, mtime, digest = meta["sources"][name]
+            st = os.stat(fpath)
+            if st.st_size != size:
+                return False
+            if st.st_mtime != mtime:
+                if file_hash(fpath) != digest:
+                    return False
+                meta["sources"][name] = [size, st.st_mtime, digest]
+                touched = True
+        if touched:
+            self._write_meta(meta)
+        return True
+
+    def load(self):
+        """Memory map the saved index. Returns `False` if there is none or it
+        is out of date."""
+        meta_path = os.path.join(self.path, "index.json")
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (IOError, OSError, ValueError):
+            return False
+        if set(meta.get("sources", {})) != set(self.sources) \
+                or not self._check_sources(meta):
+            return False
+        for name in _arrays:
+            setattr(self, name, np.load(os.path.join(self.path,
+                                                     name + ".npy"),
+                                        mmap_mode="r"))
+        self.origin = np.array(meta["origin"])
+        self.spacing = np.array(meta["spacing"])
+        self.shape = np.array(meta["shape"])
+        self.ncells = meta["ncells"]
+        return True
+
+    def _write_meta(self, meta):
+        fpath = os.path.join(self.path, "index.json")
+        with open(fpath + ".tmp", "w") as f:
+            json.dump(meta, f, indent=1)
+        os.replace(fpath + ".tmp", fpath)
+
+    def build(self):
+        """Compute and save the index from the mesh files."""
+        meta = {"sources": {}}
+        for name, fpath in self.sources.items():
+            st = os.stat(fpath)
+            meta["sources"][name] = [st.st_size, st.st_mtime,
+                                     file_hash(fpath)]
+        ncells = foamfields.get_ncells(self.mesh_dir)
+        mesh = read_mesh(self.mesh_dir, self.points_dir)
+        centres = cell_centres_volumes(mesh, ncells)[0]
+        lower, upper = cell_bounds(mesh, ncells)
+        del mesh
+        bbox = np.empty((ncells, 2, 3), dtype=np.float32)
+        bbox[:, 0] = np.nextafter(lower.astype(np.float32), -np.inf)
+        bbox[:, 1] = np.nextafter(upper.astype(np.float32), np.inf)
+        del lower, upper
+        # Bins are close to cubes, with `cells_per_bin` cells on average
+        origin = centres.min(axis=0)
+        extent = np.maximum(centres.max(axis=0) - origin, 1e-12)
+        size = (extent.prod()*cells_per_bin/ncells)**(1/3)
+        shape = np.maximum(np.ceil(extent/size), 1).astype(int)
+        spacing = extent/shape
+        ijk = np.minimum(((centres - origin)/spacing).astype(int), shape - 1)
+        flat = np.ravel_multi_index(ijk.T, shape)
+        del ijk
+        order = np.argsort(flat, kind="stable")
+        starts = np.searchsorted(flat[order], np.arange(shape.prod() + 1))
+        label = np.int32 if ncells < 2**31 else np.int64
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        # Remove the metadata first so an interrupted build is never loaded
+        if os.path.isfile(os.path.join(self.path, "index.json")):
+            os.remove(os.path.join(self.path, "index.json"))
+        for name, array in [("centres", centres), ("bbox", bbox),
+                            ("order", order.astype(label)),
+                            ("starts", starts.astype(np.int64))]:
+            _save_npy(os.path.join(self.path, name + ".npy"), array)
+        meta.update(origin=origin.tolist(), spacing=spacing.tolist(),
+                    shape=shape.tolist(), ncells=ncells)
+        self._write_meta(meta)
+
+    def cells_in_box(self, lower, upper):
+        """Return the cells in the bins overlapping the box from `lower` to
+        `upper`, a superset of the cells with centres in the box."""
+        lo = np.floor((np.asarray(lower) - self.origin)/self.spacing)
+        hi = np.floor((np.asarray(upper) - self.origin)/self.spacing)
+        lo = np.clip(lo, 0, self.shape - 1).astype(int)
+        hi = np.clip(hi, 0, self.shape - 1).astype(int)
+        # Bins with consecutive k are contiguous, so take one slice per (i, j)
+        i = np.arange(lo[0], hi[0] + 1)
+        j = np.arange(lo[1], hi[1] + 1)
+        ij = (i[:, None]*self.shape[1] + j[None, :]).ravel()*self.shape[2]
+        first = self.starts[ij + lo[2]]
+        n = self.starts[ij + hi[2] + 1] - first
+        offsets = np.cumsum(n) - n
+        positions = np.arange(n.sum()) + np.repeat(first - offsets, n)
+        return np.asarray(self.order[positions], dtype=int)
+
+    def query(self, points, k=1):
+        """Return the distances to and indices of the `k` nearest cell
+        centres of each of `points`, as arrays of shape `(npoints, k)`, with
+        `k` at most the number of cells."""
+        from scipy.spatial import cKDTree
+        k = min(k, self.ncells)
+        points = np.asarray(points, dtype=float).reshape((-1, 3))
+        dist = np.empty((len(points), k))
+        index = np.empty((len(points), k), dtype=int)
+        lower = self.origin
+        upper = self.origin + self.shape*self.spacing
+        todo = np.arange(len(points))
+        margin = self.spacing.max()
+        while len(todo):
+            p = points[todo]
+            lo = p.min(axis=0) - margin
+            hi = p.max(axis=0) + margin
+            whole = np.all(lo <= lower) and np.all(hi >= upper)
+            cells = self.cells_in_box(lo, hi)
+            if len(cells) >= k:
+                d, i = cKDTree(self.centres[cells]).query(p, k=k)
+                d, i = d.reshape((-1, k)), i.reshape((-1, k))
+                # Every centre within `margin` of a point is in `cells`
+                done = (d[:, -1] <= margin) | whole
+                dist[todo[done]] = d[done]
+                index[todo[done]] = cells[i[done]]
+                todo = todo[~done]
+            margin *= 2
+        return dist, index
+
+    def find_cells(self, points, k=8):
+        """Return the cell containing each of `points`, taken as the nearest
+        of the `k` nearest cells whose bounding box contains it, or -1 if
+        there is none."""
+        points = np.asarray(points, dtype=float).reshape((-1, 3))
+        index = self.query(points, k=min(k, self.ncells))[1]
+        bbox = self.bbox[index.ravel()].reshape(index.shape + (2, 3))
+        p = points[:, None].astype(np.float32)
+        inside = np.all((bbox[:, :, 0] <= p) & (p <= bbox[:, :, 1]), axis=2)
+        cells = index[np.arange(len(points)), inside.argmax(axis=1)]
+        cells[~inside.any(axis=1)] = -1
+        return cells
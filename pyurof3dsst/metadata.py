@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+"""Single-pass extraction of case metadata from logs and dictionaries.
+
+Every file is streamed line by line exactly once, so memory use does not
+depend on log size. The values to pull out of each file are described by a
+keyword table rather than by separate getter functions.
+"""
+
+from __future__ import division, print_function
+from collections import namedtuple
+import os
+
+
+def _first(keyword):
+    """Match lines whose first token is `keyword`."""
+    return lambda ls: ls[0] == keyword
+
+
+def _last(keyword):
+    """Match lines whose last token is `keyword`."""
+    return lambda ls: ls[-1] == keyword
+
+
+def _value(valtype=float):
+    """Parse the second token of a `keyword value;` line."""
+    return lambda ls: valtype(ls[1].replace(";", ""))
+
+
+def _last_value(ls):
+    return float(ls[-1])
+
+
+# For each file: (field, matcher, line offset from the matching line to the
+# line to parse, parser, whether the last rather than first match is kept).
+# The offsets follow the layout the original per-file getters relied on.
+keyword_table = {
+    "log.checkMesh": [
+        ("ncells", _first("cells:"), 0, lambda ls: int(ls[1]), False)],
+    "log.yPlus": [
+        ("yplus_min", _last("blades"), 3, lambda ls: float(ls[3]), False),
+        ("yplus_max", _last("blades"), 3, lambda ls: float(ls[5]), False),
+        ("yplus_mean", _last("blades"), 3, lambda ls: float(ls[7]), False)],
+    "constant/polyMesh/blockMeshDict": [
+        ("nx", _first("blocks"), 3,
+         lambda ls: int(ls[0].replace("(", "")), False),
+        ("nz", _first("blocks"), 3,
+         lambda ls: int(ls[2].replace(")", "")), False)],
+    "system/snappyHexMeshDict": [
+        ("nlayers", _first("nSurfaceLayers"), 0, _value(int), False),
+        ("expratio", _first("expansionRatio"), 0, _value(float), False)],
+    "system/fvSchemes": [
+        ("ddt_scheme", _first("ddtSchemes"), 2, _value(str), False)],
+    "system/controlDict": [
+        ("adjust_time_step", _first("adjustTimeStep"), 0, _value(str), False),
+        ("delta_t", _first("deltaT"), 0, _value(float), False),
+        ("max_co", _first("maxCo"), 0, _value(float), False),
+        ("end_time", _first("endTime"), 0, _value(float), False),
+        ("write_interval", _first("writeInterval"), 0, _value(float),
+         False)],
+    "log.funkyDoCalc.0": [
+        ("y_adv", _first("planeAverageAdvectionY"), 0, _last_value, True),
+        ("z_adv", _first("weightedAverage"), 0, _last_value, True)],
+    "log.funkyDoCalc.1": [
+        ("turb_trans", _first("weightedAverage"), 0, _last_value, True),
+        ("visc_trans", _first("planeAverageViscTrans"), 0, _last_value,
+         True)],
+    "log.funkyDoCalc.2": [
+        ("pressure_trans", _first("weightedAverage"), 0, _last_value, True)],
+}
+
+# Files where `=` separates keywords and values
+_equals_files = ["log.funkyDoCalc.0", "log.funkyDoCalc.1",
+                 "log.funkyDoCalc.2"]
+
+metadata_fields = [field for fname in sorted(keyword_table)
+                   for field, _, _, _, _ in keyword_table[fname]]
+
+
+class CaseMetadata(namedtuple("CaseMetadata", metadata_fields)):
+    """Values extracted from a case's logs and dictionaries. Fields whose
+    file or keyword was not found are `None`."""
+    __slots__ = ()
+
+    @property
+    def dt(self):
+        """Time step, or `"nan"` if it is adjusted during the run."""
+        return self.delta_t if self.adjust_time_step == "no" else "nan"
+
+    @property
+    def maxco(self):
+        """Max Courant number, or `"nan"` if the time step is fixed."""
+        return self.max_co if self.adjust_time_step == "yes" else "nan"
+
+    @property
+    def yplus(self):
+        return {"min": self.yplus_min, "max": self.yplus_max,
+                "mean": self.yplus_mean}
+
+    @property
+    def funky(self):
+        """Recovery term averages in the form returned by `read_funky_log`."""
+        return {"y_adv": self.y_adv, "z_adv": self.z_adv,
+                "turb_trans": self.turb_trans, "visc_trans": self.visc_trans,
+                "pressure_trans": self.pressure_trans}
+
+
+def scan_file(fpath, rules, equals=False):
+    """Stream `fpath` once and return a dict of values for `rules`, a list of
+    keyword table entries. Stops reading as soon as no rule can change its
+    value."""
+    values = {}
+    pending = []  # [lines remaining, field, parser]
+    remaining = set(field for field, _, _, _, keep_last in rules
+                    if not keep_last)
+    keep_going = any(keep_last for _, _, _, _, keep_last in rules)
+    with open(fpath) as f:
+        for line in f:
+            if equals:
+                line = line.replace("=", " ")
+            ls = line.split()
+            still_pending = []
+            for item in pending:
+                item[0] -= 1
+                if item[0] > 0:
+                    still_pending.append(item)
+                    continue
+                try:
+                    values[item[1]] = item[2](ls)
+                except (IndexError, ValueError):
+                    pass
+                remaining.discard(item[1])
+            pending = still_pending
+            if ls:
+                for field, match, offset, parse, keep_last in rules:
+                    if not keep_last and (field in values
+                                          or field not in remaining):
+                        continue
+                    if match(ls):
+                        if offset == 0:
+                            try:
+                                values[field] = parse(ls)
+                            except (IndexError, ValueError):
+                                continue
+                            remaining.discard(field)
+                        else:
+                            pending.append([offset, field, parse])
+                            remaining.discard(field)
+            if not remaining and not pending and not keep_going:
+                break
+    return values
+
+
+def read_case_metadata(casedir="./", files=None):
+    """Read all metadata of a case, scanning each file in `keyword_table`
+    (or only those in `files`) exactly once. Returns a `CaseMetadata`."""
+    values = dict.fromkeys(metadata_fields)
+    for fname, rules in keyword_table.items():
+        if files is not None and fname not in files:
+            continue
+        fpath = os.path.join(casedir, fname)
+        if os.path.isfile(fpath):
+            values.update(scan_file(fpath, rules,
+                                    equals=fname in _equals_files))
+    return CaseMetadata(**values)
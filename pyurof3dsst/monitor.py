@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""Live monitoring of a running simulation.
+
+The `forces` output and solver log are tailed by remembering the byte
+offset reached in each file, so every poll only reads what the solver has
+appended since the last one. Nothing is written to the case except a small
+status file.
+"""
+
+from __future__ import division, print_function
+import numpy as np
+import collections
+import json
+import os
+import time
+from .forces import ThetaOmega, iter_forces_chunks, calc_perf_rows
+from .solverlog import iter_log_steps
+from .processing import R, U_infty, rho, area
+
+
+def _finite(x):
+    """Return `x` as a float, or `None` if it is NaN or infinite."""
+    return float(x) if np.isfinite(x) else None
+
+
+class Monitor(object):
+    """Rolling per-revolution performance and solver speed of a running case.
+
+    Per-revolution sums of TSR, C_P and C_D are accumulated with
+    `np.bincount` on each new chunk of forces rows, and the wall-clock cost
+    of the run is estimated from the last `nsteps_speed` time steps in the
+    solver log.
+    """
+    def __init__(self, casedir="./", logname="log.pimpleDyMFoam",
+                 nsteps_speed=50):
+        self.casedir = casedir
+        self.log_path = os.path.join(casedir, logname)
+        self.theta_omega = ThetaOmega(casedir)
+        self.forces_offsets = {}
+        self.log_offset = 0
+        self.t_last = -np.inf
+        self.theta = np.nan
+        # Per revolution: count, sum of TSR, C_P and C_D
+        self.rev_sums = np.zeros((0, 4))
+        self.steps = collections.deque(maxlen=nsteps_speed)
+
+    def poll_forces(self):
+        """Read new forces rows and add them to the per-revolution sums."""
+        for fpath, offset, data in iter_forces_chunks(
+                self.casedir, offsets=self.forces_offsets):
+            self.forces_offsets[fpath] = offset
+            data = data[data[:, 0] > self.t_last]
+            if len(data) == 0:
+                continue
+            theta, tsr, cp, cd = calc_perf_rows(data, self.theta_omega, R,
+                                                U_infty, rho, area)
+            rev = (theta // 360).astype(int)
+            nrev = max(rev.max() + 1, len(self.rev_sums))
+            sums = np.zeros((nrev, 4))
+            sums[:len(self.rev_sums)] = self.rev_sums
+            for i, x in enumerate((np.ones_like(tsr), tsr, cp, cd)):
+                sums[:, i] += np.bincount(rev, weights=x, minlength=nrev)
+            self.rev_sums = sums
+            self.t_last = float(data[-1, 0])
+            self.theta = float(theta[-1])
+
+    def poll_log(self):
+        """Read complete time steps appended to the solver log. Steps go
+        straight into the rolling window, so only the last `nsteps_speed`
+        are kept however long the log is. A log that was truncated or
+        replaced, e.g. by a restart, is read again from the start."""
+        if not os.path.isfile(self.log_path):
+            return
+        size = os.path.getsize(self.log_path)
+        if size < self.log_offset:
+            print("{} was truncated or replaced, reading it again".format(
+                    self.log_path))
+            self.log_offset = 0
+            self.steps.clear()
+        if size == self.log_offset:
+            return
+        with open(self.log_path, "rb") as f:
+            f.seek(self.log_offset)
+            for step, offset in iter_log_steps(f, self.log_offset):
+                self.steps.append((step["time"], step["clock_time"]))
+                self.log_offset = offset
+
+    def poll(self):
+        self.poll_forces()
+        self.poll_log()
+
+    @property
+    def clock_per_sim_time(self):
+        """Wall-clock seconds per simulated second over recent steps."""
+        if len(self.steps) < 2:
+            return np.nan
+        (t0, c0), (t1, c1) = self.steps[0], self.steps[-1]
+        if t1 <= t0:
+            return np.nan
+        return (c1 - c0)/(t1 - t0)
+
+    def rev_means(self):
+        """Return an array of mean TSR, C_P and C_D for each revolution, with
+        rows of NaN for revolutions without data."""
+        n = self.rev_sums[:, :1]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.rev_sums[:, 1:]/n
+
+    def status(self):
+        """Return the current status as a dict. Values that are not known
+        yet are `None`, so the status is valid JSON."""
+        means = self.rev_means()
+        status = {"time": _finite(self.t_last),
+                  "theta_deg": _finite(self.theta),
+                  "revolution": len(means) - 1,
+                  "rev_fraction": _finite((self.theta % 360)/360),
+                  "clock_per_sim_time": _finite(self.clock_per_sim_time),
+                  "revs": {}}
+        for i, (tsr, cp, cd) in enumerate(means):
+            status["revs"][i] = {"tsr": _finite(tsr), "cp": _finite(cp),
+                                 "cd": _finite(cd)}
+        return status
+
+    def format_status(self, nrevs=5):
+        """Return a short text summary of the last `nrevs` revolutions."""
+        s = self.status()
+        num = lambda x: np.nan if x is None else x
+        lines = ["t = {:.4f} s, theta = {:.1f} deg ({:.0f}% through rev {})"
+                 .format(num(s["time"]), num(s["theta_deg"]),
+                         100*num(s["rev_fraction"]), s["revolution"]),
+                 "Wall clock per simulated second: {}".format(
+                         "n/a" if s["clock_per_sim_time"] is None
+                         else "{:.1f} s".format(s["clock_per_sim_time"])),
+                 "{:>5} {:>7} {:>7} {:>7}".format("rev", "TSR", "C_P",
+                                                  "C_D")]
+        for i in sorted(s["revs"])[-nrevs:]:
+            r = s["revs"][i]
+            partial = "*" if i == s["revolution"] else ""
+            lines.append("{:>5} {:7.3f} {:7.3f} {:7.3f}".format(
+                    str(i) + partial, num(r["tsr"]), num(r["cp"]),
+                    num(r["cd"])))
+        return "\n".join(lines)
+
+    def write_status(self, fpath):
+        """Write the status as JSON, replacing the file atomically."""
+        tmp_path = fpath + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.status(), f, indent=4)
+        os.replace(tmp_path, fpath)
+
+
+def monitor(casedir="./", interval=30.0, status_file="processed/monitor.json",
+            verbose=True, niceness=10, max_polls=None):
+    """Poll a running case every `interval` seconds, printing the status to
+    the terminal and writing it to `status_file`. The process lowers its
+    own priority by `niceness` to stay out of the solver's way. Stop with
+    Ctrl+C."""
+    if niceness and hasattr(os, "nice"):
+        os.nice(niceness)
+    status_path = os.path.join(casedir, status_file)
+    status_dir = os.path.dirname(status_path)
+    if status_dir and not os.path.isdir(status_dir):
+        os.makedirs(status_dir)
+    mon = Monitor(casedir)
+    npolls = 0
+    try:
+        while max_polls is None or npolls < max_polls:
+            mon.poll()
+            mon.write_status(status_path)
+            if verbose:
+                print(mon.format_status() + "\n")
+            npolls += 1
+            if max_polls is None or npolls < max_polls:
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    return mon
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+"""Rotor motion tables for `constant/dynamicMeshDict`.
+
+The rotation rate is described by its spectrum: a mean plus harmonics of the
+mean rotation frequency,
+
+    omega(t) = omega_mean + sum_n a_n cos(n omega_mean t) + b_n sin(n omega_mean t)
+
+which can be given directly, built from a mean TSR and the amplitude and
+phase of each harmonic, or fitted to a measured TSR time series. `omega` and
+the rotor angle `theta` are then known analytically.
+
+OpenFOAM interpolates the `omega` table linearly, so the table spacing is
+chosen from the bound `max|omega''| h**2/8` on the interpolation error, with
+`max|omega''|` bounded by the sum of `n**2 omega_mean**2` times the amplitude
+of each harmonic. Nine tenths of the tolerance go to interpolation and the
+rest to rounding `omega`, which is written with only as many decimals as
+that needs; times are rounded before `omega` is evaluated. The angle the
+mesh actually turns through, the exact integral of the interpolated table,
+is written to `constant/thetaTable`, which `forces.ThetaOmega` reads when it
+exists and matches the table.
+"""
+
+from __future__ import division, print_function
+import numpy as np
+import os
+import re
+from . import metadata
+
+_dynmeshdict_top = r"""/*--------------------------------*- C++ -*----------------------------------*\
+| =========                 |                                                 |
+| \\      /  F ield         | OpenFOAM: The Open Source CFD Toolbox           |
+|  \\    /   O peration     | Version:  2.3.x                                 |
+|   \\  /    A nd           | Web:      www.OpenFOAM.org                      |
+|    \\/     M anipulation  |                                                 |
+\*---------------------------------------------------------------------------*/
+FoamFile
+{
+    version     2.0;
+    format      ascii;
+    class       dictionary;
+    object      dynamicMeshDict;
+}
+
+
+dynamicFvMesh   solidBodyMotionFvMesh;
+
+motionSolverLibs ("libfvMotionSolvers.so");
+
+solidBodyMotionFvMeshCoeffs
+{
+    cellZone        CELLZONE;
+    solidBodyMotionFunction  rotatingMotion;
+    rotatingMotionCoeffs
+    {
+        origin\t\t(0 0 0);
+        axis\t\tAXIS;
+        omega\t\ttable
+        (
+""".replace("\\t", "\t")
+
+_dynmeshdict_bottom = """        );
+    }
+}
+"""
+
+_theta_table_top = """FoamFile
+{
+    version     2.0;
+    format      ascii;
+    class       dictionary;
+    object      thetaTable;
+}
+
+// Rotor angle in degrees, the integral of the omega table in dynamicMeshDict
+(
+"""
+
+# Lines of the omega table, as matched by `foampy.load_theta_omega`
+_table_line_re = re.compile(r"^\s*\(\s*(\d+\.\d+)\s+(\d+\.\d+)\s*\)\s*$",
+                            re.M)
+
+
+class OmegaSpectrum(object):
+    """Rotation rate in rad/s as a mean and Fourier coefficients `a` and `b`
+    of harmonics 1, 2, ... of the mean rotation frequency."""
+    def __init__(self, omega_mean, a=(), b=()):
+        self.omega_mean = float(omega_mean)
+        n = max(len(a), len(b))
+        self.a = np.zeros(n)
+        self.b = np.zeros(n)
+        self.a[:len(a)] = a
+        self.b[:len(b)] = b
+
+    @classmethod
+    def from_tsr(cls, tsr, U_infty=1.0, R=0.5, harmonics={}):
+        """Build a spectrum from a mean TSR and a dict of
+        `{n: (amplitude, phase)}` giving `amplitude*sin(n omega_mean t +
+        phase)` fluctuations of omega in rad/s."""
+        n = max(harmonics) if harmonics else 0
+        a = np.zeros(n)
+        b = np.zeros(n)
+        for i, (amplitude, phase) in harmonics.items():
+            a[i - 1] = amplitude*np.sin(phase)
+            b[i - 1] = amplitude*np.cos(phase)
+        return cls(tsr*U_infty/R, a, b)
+
+    @classmethod
+    def fit(cls, t, tsr, U_infty=1.0, R=0.5, nharmonics=6):
+        """Fit a spectrum with `nharmonics` harmonics to a TSR time series
+        by least squares, with `t` shifted to start at zero. The mean, which
+        is also the fundamental, is found by minimizing the residual near the
+        mean of the series, since that is biased when the series is not a
+        whole number of periods long. The coefficients are linear and solved
+        for directly at each trial mean."""
+        from scipy.optimize import minimize_scalar
+        t = np.asarray(t, dtype=float) - t[0]
+        omega = np.asarray(tsr, dtype=float)*U_infty/R
+
+        def solve(omega_mean):
+            phase = np.outer(omega_mean*t, np.arange(1, nharmonics + 1))
+            design = np.column_stack([np.cos(phase), np.sin(phase)])
+            return np.linalg.lstsq(design, omega - omega_mean, rcond=None)
+
+        def residual(omega_mean):
+            coeffs = solve(omega_mean)[0]
+            phase = np.outer(omega_mean*t, np.arange(1, nharmonics + 1))
+            fitted = omega_mean + np.cos(phase).dot(coeffs[:nharmonics]) \
+                   + np.sin(phase).dot(coeffs[nharmonics:])
+            return ((omega - fitted)**2).sum()
+
+        # Residual minima of neighbouring frequencies are about
+        # 2 pi/(nharmonics t[-1]) apart
+        mean = omega.mean()
+        span = np.pi/(nharmonics*t[-1])
+        omega_mean = minimize_scalar(residual, bounds=(mean - span,
+                                                       mean + span),
+                                     method="bounded",
+                                     options={"xatol": 1e-10*mean}).x
+        coeffs = solve(omega_mean)[0]
+        return cls(omega_mean, coeffs[:nharmonics], coeffs[nharmonics:])
+
+    def _phases(self, t):
+        n = np.arange(1, len(self.a) + 1)
+        return np.multiply.outer(np.asarray(t, dtype=float),
+                                 n*self.omega_mean), n
+
+    def omega(self, t):
+        """Rotation rate in rad/s at times `t`."""
+        phase, n = self._phases(t)
+        return self.omega_mean + np.cos(phase).dot(self.a) \
+             + np.sin(phase).dot(self.b)
+
+    def theta(self, t):
+        """Rotor angle in radians at times `t`, with zero at `t = 0`."""
+        phase, n = self._phases(t)
+        w = n*self.omega_mean
+        return self.omega_mean*np.asarray(t, dtype=float) \
+             + np.sin(phase).dot(self.a/w) \
+             + (1 - np.cos(phase)).dot(self.b/w)
+
+    def curvature_bound(self):
+        """Upper bound of `|omega''(t)|`."""
+        n = np.arange(1, len(self.a) + 1)
+        return float(((n*self.omega_mean)**2*np.hypot(self.a, self.b)).sum())
+
+    def table(self, end_time, tol=1e-3):
+        """Return `t`, `omega` and `theta` (in degrees, integrated from the
+        linearly interpolated table as OpenFOAM does) of a table from 0 to
+        `end_time` with linear interpolation error below `tol` rad/s. Times
+        are rounded to `_time_decimals` decimals."""
+        m = self.curvature_bound()
+        if m > 0:
+            npoints = int(np.ceil(end_time/np.sqrt(8*0.9*tol/m))) + 1
+        else:
+            npoints = 2
+        t = np.linspace(0, end_time, max(npoints, 2))
+        t = np.round(t, _time_decimals(t))
+        omega = self.omega(t)
+        theta = np.zeros(len(t))
+        theta[1:] = np.cumsum(0.5*(omega[1:] + omega[:-1])*np.diff(t))
+        return t, omega, np.degrees(theta)
+
+
+def _decimals(x):
+    """Number of decimals needed to resolve `x`."""
+    return max(int(np.ceil(-np.log10(x))), 1)
+
+
+def _time_decimals(t):
+    """Decimals resolving a hundredth of the mean spacing of times `t`."""
+    return _decimals((t[-1] - t[0])/(len(t) - 1)/100)
+
+
+def write_motion(spectrum, end_time=None, tol=1e-3, casedir="./",
+                 cellzone="AMIsurface", axis="(0 0 1)"):
+    """Write the `omega` table of `spectrum` to `constant/dynamicMeshDict`
+    and the matching `constant/thetaTable`, up to `end_time` (by default
+    `endTime` in `system/controlDict`) with interpolation error below `tol`
+    rad/s. Returns the number of table points."""
+    if end_time is None:
+        end_time = metadata.read_case_metadata(
+                casedir, files=["system/controlDict"]).end_time
+    t, omega, theta = spectrum.table(end_time, tol=tol)
+    # Rounding errors of omega are at most a twentieth of `tol`
+    dec_t = _time_decimals(t)
+    dec_omega = _decimals(tol/10)
+    fmt = "            (%.{}f %.{}f)".format(dec_t, dec_omega)
+    top = _dynmeshdict_top.replace("CELLZONE", cellzone) \
+                          .replace("AXIS", axis)
+    fpath = os.path.join(casedir, "constant", "dynamicMeshDict")
+    with open(fpath + ".tmp", "w") as f:
+        f.write(top)
+        np.savetxt(f, np.column_stack([t, omega]), fmt=fmt)
+        f.write(_dynmeshdict_bottom)
+    os.replace(fpath + ".tmp", fpath)
+    fpath = os.path.join(casedir, "constant", "thetaTable")
+    with open(fpath + ".tmp", "w") as f:
+        f.write(_theta_table_top)
+        np.savetxt(f, np.column_stack([t, theta]),
+                   fmt="    (%.{}f %.{}f)".format(dec_t, dec_omega))
+        f.write(")\n")
+    os.replace(fpath + ".tmp", fpath)
+    return len(t)
+
+
+def read_omega_table(casedir="./"):
+    """Return `t` and `omega` from the table in `constant/dynamicMeshDict`."""
+    with open(os.path.join(casedir, "constant", "dynamicMeshDict")) as f:
+        rows = _table_line_re.findall(f.read())
+    table = np.array(rows, dtype=float).reshape((-1, 2))
+    return table[:, 0], table[:, 1]
+
+
+def read_theta_table(casedir="./"):
+    """Return `t` and `theta` in degrees from `constant/thetaTable`, or
+    `None` if there is none."""
+    fpath = os.path.join(casedir, "constant", "thetaTable")
+    if not os.path.isfile(fpath):
+        return None
+    with open(fpath) as f:
+        text = f.read()
+    body = text[text.index("(", text.index("}")):]
+    table = np.array(body.replace("(", " ").replace(")", " ").split(),
+                     dtype=float).reshape((-1, 2))
+    return table[:, 0], table[:, 1]
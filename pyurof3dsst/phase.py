@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""Phase-averaged performance binned by azimuthal angle."""
+
+from __future__ import division, print_function
+import numpy as np
+import pandas as pd
+import os
+
+
+class PhaseAverage(object):
+    """Quantities binned by azimuth for each revolution and averaged across
+    revolutions.
+
+    Attributes
+    ----------
+    bin_centers : azimuth of each bin center in degrees, shape `(nbins,)`
+    revs : revolution number of each row of the binned arrays
+    counts : number of samples in each revolution and bin
+    binned : dict of `(nrevs, nbins)` arrays of per-revolution bin means
+    rev_means : dict of `(nrevs,)` arrays of per-revolution means
+    complete : boolean mask of revolutions with samples in every bin
+    mean, std : dicts of `(nbins,)` arrays of bin means and standard
+        deviations across complete revolutions
+    """
+    def __init__(self, bin_centers, revs, counts, binned, rev_means):
+        self.bin_centers = bin_centers
+        self.revs = revs
+        self.counts = counts
+        self.binned = binned
+        self.rev_means = rev_means
+        self.complete = (counts > 0).all(axis=1)
+        self.mean = {}
+        self.std = {}
+        for q, b in binned.items():
+            bc = b[self.complete]
+            if len(bc):
+                self.mean[q] = bc.mean(axis=0)
+                self.std[q] = bc.std(axis=0, ddof=1) if len(bc) > 1 \
+                              else np.full(bc.shape[1], np.nan)
+            else:
+                self.mean[q] = np.full(b.shape[1], np.nan)
+                self.std[q] = np.full(b.shape[1], np.nan)
+
+    @property
+    def quantities(self):
+        return list(self.binned)
+
+    def convergence(self):
+        """Return a `DataFrame` indexed by complete revolution with, for each
+        quantity, the RMS change of the binned curve from the previous
+        complete revolution (`<q>_rms_change`), the change in the
+        revolution mean (`<q>_mean_change`) and the change in the running
+        mean over all complete revolutions so far (`<q>_cum_mean_change`).
+        """
+        revs = self.revs[self.complete]
+        df = pd.DataFrame(index=pd.Index(revs, name="rev"))
+        for q in self.quantities:
+            b = self.binned[q][self.complete]
+            m = self.rev_means[q][self.complete]
+            cum_mean = np.cumsum(m)/np.arange(1, len(m) + 1)
+            df[q + "_rms_change"] = np.concatenate(
+                    ([np.nan], np.sqrt(np.mean(np.diff(b, axis=0)**2,
+                                               axis=1))))
+            df[q + "_mean_change"] = np.concatenate(([np.nan], np.diff(m)))
+            df[q + "_cum_mean_change"] = np.concatenate(
+                    ([np.nan], np.diff(cum_mean)))
+        return df
+
+    def to_dataframe(self):
+        """Return the across-revolution bin means and standard deviations as
+        a `DataFrame` indexed by azimuth."""
+        df = pd.DataFrame(index=pd.Index(self.bin_centers, name="theta_deg"))
+        for q in self.quantities:
+            df[q] = self.mean[q]
+            df[q + "_std"] = self.std[q]
+        return df
+
+
+def phase_average(theta, quantities, nbins=72, theta_0=0.0):
+    """Bin quantities by azimuth and revolution.
+
+    `theta` is the cumulative rotor angle in degrees and `quantities` a dict
+    of arrays of the same length. Revolutions are counted from `theta_0`,
+    and samples before it are ignored. All binning is done with a single
+    `np.bincount` per quantity over the flattened `(revolution, bin)`
+    index.
+    """
+    theta = np.asarray(theta, dtype=float)
+    keep = theta >= theta_0
+    phi = theta[keep] - theta_0
+    rev = (phi // 360).astype(int)
+    ibin = np.minimum((phi % 360)*nbins/360, nbins - 1).astype(int)
+    nrevs = rev.max() + 1 if len(rev) else 0
+    index = rev*nbins + ibin
+    size = nrevs*nbins
+    counts_flat = np.bincount(index, minlength=size)
+    counts = counts_flat.reshape((nrevs, nbins))
+    rev_counts = counts.sum(axis=1)
+    binned = {}
+    rev_means = {}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for q, x in quantities.items():
+            x = np.asarray(x, dtype=float)[keep]
+            sums = np.bincount(index, weights=x, minlength=size)
+            binned[q] = (sums/counts_flat).reshape((nrevs, nbins))
+            rev_means[q] = sums.reshape((nrevs, nbins)).sum(axis=1) \
+                         / rev_counts
+    bin_centers = (np.arange(nbins) + 0.5)*360/nbins
+    return PhaseAverage(bin_centers, np.arange(nrevs), counts, binned,
+                        rev_means)
+
+
+def phase_average_perf(perf=None, nbins=72, theta_0=0.0,
+                       quantities=("tsr", "cp", "cd")):
+    """Phase average performance from a `DataFrame` with a `theta_deg` column,
+    such as `processed/perf.csv`, which is loaded if `perf` is `None` or a
+    path."""
+    if perf is None:
+        perf = os.path.join("processed", "perf.csv")
+    if isinstance(perf, str):
+        perf = pd.read_csv(perf, usecols=["theta_deg"] + list(quantities))
+    return phase_average(perf["theta_deg"].values,
+                         {q: perf[q].values for q in quantities},
+                         nbins=nbins, theta_0=theta_0)
@@ -10,6 +10,8 @@ import sys
 import foampy
 import pandas as pd
 from .processing import *
+from .phase import phase_average_perf
+from .profiling import profiled, stage
 
 ylabels = {"meanu" : r"$U/U_\infty$",
            "stdu" : r"$\sigma_u/U_\infty$",
@@ -18,14 +20,36 @@ ylabels = {"meanu" : r"$U/U_\infty$",
            "meanuv" : r"$\overline{u'v'}/U_\infty^2$"}
 
 
+@profiled
 def plot_perf():
     calc_perf(plot=True)
 
 
+@profiled
+def plot_phase_average(quantity="cp", nbins=72, theta_0=360, newfig=True):
+    """Plot a quantity from `processed/perf.csv` phase averaged across
+    revolutions after `theta_0`, with each revolution shown in gray."""
+    pa = phase_average_perf(nbins=nbins, theta_0=theta_0)
+    labels = {"cp": r"$C_P$", "cd": r"$C_D$", "tsr": r"$\lambda$"}
+    if newfig:
+        plt.figure()
+    for binned in pa.binned[quantity][pa.complete]:
+        plt.plot(pa.bin_centers, binned, color="gray", alpha=0.5)
+    plt.plot(pa.bin_centers, pa.mean[quantity], "k")
+    plt.xlabel(r"$\theta$ (degrees)")
+    plt.ylabel(labels.get(quantity, quantity))
+    plt.xlim((0, 360))
+    plt.grid(True)
+    plt.tight_layout()
+
+
+@profiled
 def plot_u_profile(z_H=0.0, newfig=True, save=False, savedir="figures",
-                   savetype=".pdf"):
-    """Plot mean streamwise velocity profile."""
-    df = load_u_profile(z_H)
+                   savetype=".pdf", df=None):
+    """Plot mean streamwise velocity profile, from `df` if given (as returned
+    by `load_u_profile`)."""
+    if df is None:
+        df = load_u_profile(z_H)
     if newfig:
         plt.figure()
     plt.plot(df.y_R, df.u/U_infty, "k", label="SA (3-D)")
@@ -40,9 +64,13 @@ def plot_u_profile(z_H=0.0, newfig=True, save=False, savedir="figures",
                     "u_profile_{}_SA".format(z_H) + savetype))
 
 
-def plot_k_profile(z_H=0.0, amount="total", newfig=True, save=False):
-    """Plot turbulence kinetic energy profile."""
-    df = load_k_profile(z_H)
+@profiled
+def plot_k_profile(z_H=0.0, amount="total", newfig=True, save=False,
+                   savedir="figures", savetype=".pdf", df=None):
+    """Plot turbulence kinetic energy profile, from `df` if given (as
+    returned by `load_k_profile`)."""
+    if df is None:
+        df = load_k_profile(z_H)
     if newfig:
         plt.figure()
     k = df["k_{}".format(amount)]
@@ -58,6 +86,7 @@ def plot_k_profile(z_H=0.0, amount="total", newfig=True, save=False):
                 amount, z_H, savetype)))
 
 
+@profiled
 def plot_turb_lines(color="gray"):
     plt.hlines(0.5, -1, 1, linestyles="solid", colors=color, linewidth=2)
     plt.hlines(-0.5, -1, 1, linestyles="solid", colors=color, linewidth=2)
@@ -65,6 +94,7 @@ def plot_turb_lines(color="gray"):
     plt.vlines(1, -0.5, 0.5, linestyles="solid", colors=color, linewidth=2)
 
 
+@profiled
 def plot_exp_lines():
     color = "gray"
     linewidth = 2
@@ -79,78 +109,95 @@ def plot_exp_lines():
                linewidth=linewidth)
 
 
+@profiled
 def plot_meancontquiv(save=False, show=False, savetype=".pdf",
-                      cb_orientation="vertical"):
-    """Plot mean contours/quivers of velocity."""
-    mean_u = load_vel_map("u")
-    mean_v = load_vel_map("v")
-    mean_w = load_vel_map("w")
+                      cb_orientation="vertical", savedir="figures",
+                      wake=None):
+    """Plot mean contours/quivers of velocity, from `wake` if given (as
+    returned by `load_wake_fields`)."""
+    if wake is None:
+        wake = load_wake_fields()
+    mean_u = wake["u"]
+    mean_v = wake["v"]
+    mean_w = wake["w"]
     y_R = np.round(np.asarray(mean_u.columns.values, dtype=float), decimals=4)
     z_H = np.asarray(mean_u.index.values, dtype=float)
-    plt.figure(figsize=(7.5, 4.8))
-    # Add contours of mean velocity
-    cs = plt.contourf(y_R, z_H, mean_u,
-                      np.arange(0.15, 1.25, 0.05), cmap=plt.cm.coolwarm)
-    if cb_orientation == "horizontal":
-        cb = plt.colorbar(cs, shrink=1, extend="both",
-                          orientation="horizontal", pad=0.14)
-    elif cb_orientation == "vertical":
-        cb = plt.colorbar(cs, shrink=1, extend="both",
-                          orientation="vertical", pad=0.02)
-    cb.set_label(r"$U/U_{\infty}$")
-    plt.hold(True)
-    # Make quiver plot of v and w velocities
-    Q = plt.quiver(y_R, z_H, mean_v, mean_w, width=0.0022,
-                   edgecolor="none", scale=3.0)
-    plt.xlabel(r"$y/R$")
-    plt.ylabel(r"$z/H$")
-    # plt.ylim(-0.2, 0.78)
-    # plt.xlim(-3.2, 3.2)
-    if cb_orientation == "horizontal":
-        plt.quiverkey(Q, 0.65, 0.26, 0.1, r"$0.1 U_\infty$",
-                      labelpos="E",
-                      coordinates="figure",
-                      fontproperties={"size": "small"})
-    elif cb_orientation == "vertical":
-        plt.quiverkey(Q, 0.65, 0.055, 0.1, r"$0.1 U_\infty$",
-                      labelpos="E",
-                      coordinates="figure",
-                      fontproperties={"size": "small"})
-    plot_turb_lines()
-    plot_exp_lines()
-    ax = plt.axes()
-    ax.set_aspect(2.0)
-    plt.yticks(np.around(np.arange(-1.125, 1.126, 0.125), decimals=2))
-    plt.tight_layout()
-    if show:
-        plt.show()
-    if save:
-        plt.savefig("figures/meancontquiv"+savetype)
-
-def plot_kcont(cb_orientation="vertical", newfig=True):
-    """Plot contours of TKE."""
-    k = load_k_map()
+    with stage("render"):
+        plt.figure(figsize=(7.5, 4.8))
+        # Add contours of mean velocity
+        cs = plt.contourf(y_R, z_H, mean_u,
+                          np.arange(0.15, 1.25, 0.05), cmap=plt.cm.coolwarm)
+        if cb_orientation == "horizontal":
+            cb = plt.colorbar(cs, shrink=1, extend="both",
+                              orientation="horizontal", pad=0.14)
+        elif cb_orientation == "vertical":
+            cb = plt.colorbar(cs, shrink=1, extend="both",
+                              orientation="vertical", pad=0.02)
+        cb.set_label(r"$U/U_{\infty}$")
+        # Make quiver plot of v and w velocities
+        Q = plt.quiver(y_R, z_H, mean_v, mean_w, width=0.0022,
+                       edgecolor="none", scale=3.0)
+        plt.xlabel(r"$y/R$")
+        plt.ylabel(r"$z/H$")
+        # plt.ylim(-0.2, 0.78)
+        # plt.xlim(-3.2, 3.2)
+        if cb_orientation == "horizontal":
+            plt.quiverkey(Q, 0.65, 0.26, 0.1, r"$0.1 U_\infty$",
+                          labelpos="E",
+                          coordinates="figure",
+                          fontproperties={"size": "small"})
+        elif cb_orientation == "vertical":
+            plt.quiverkey(Q, 0.65, 0.055, 0.1, r"$0.1 U_\infty$",
+                          labelpos="E",
+                          coordinates="figure",
+                          fontproperties={"size": "small"})
+        plot_turb_lines()
+        plot_exp_lines()
+        ax = plt.gca()
+        ax.set_aspect(2.0)
+        plt.yticks(np.around(np.arange(-1.125, 1.126, 0.125), decimals=2))
+        plt.tight_layout()
+        if show:
+            plt.show()
+        if save:
+            if not os.path.isdir(savedir):
+                os.makedirs(savedir)
+            plt.savefig(os.path.join(savedir, "meancontquiv" + savetype))
+
+@profiled
+def plot_kcont(cb_orientation="vertical", newfig=True, save=False,
+               savedir="figures", savetype=".pdf", wake=None):
+    """Plot contours of TKE, from `wake` if given (as returned by
+    `load_wake_fields`)."""
+    if wake is None:
+        wake = load_wake_fields()
+    k = wake["k_total"]
     y_R = np.round(np.asarray(k.columns.values, dtype=float), decimals=4)
     z_H = np.asarray(k.index.values, dtype=float)
-    if newfig:
-        plt.figure(figsize=(7.5, 2.0))
-    cs = plt.contourf(y_R, z_H, k, 20, cmap=plt.cm.coolwarm,
-                      levels=np.linspace(0, 0.09, num=19))
-    plt.xlabel(r"$y/R$")
-    plt.ylabel(r"$z/H$")
-    if cb_orientation == "horizontal":
-        cb = plt.colorbar(cs, shrink=1, extend="both",
-                          orientation="horizontal", pad=0.3)
-    elif cb_orientation == "vertical":
-        cb = plt.colorbar(cs, shrink=1, extend="both",
-                          orientation="vertical", pad=0.02)
-    cb.set_label(r"$k/U_\infty^2$")
-    plot_turb_lines(color="black")
-    plt.ylim((0, 0.63))
-    ax = plt.axes()
-    ax.set_aspect(2)
-    plt.yticks([0,0.13,0.25,0.38,0.5,0.63])
-    plt.tight_layout()
+    with stage("render"):
+        if newfig:
+            plt.figure(figsize=(7.5, 2.0))
+        cs = plt.contourf(y_R, z_H, k, 20, cmap=plt.cm.coolwarm,
+                          levels=np.linspace(0, 0.09, num=19))
+        plt.xlabel(r"$y/R$")
+        plt.ylabel(r"$z/H$")
+        if cb_orientation == "horizontal":
+            cb = plt.colorbar(cs, shrink=1, extend="both",
+                              orientation="horizontal", pad=0.3)
+        elif cb_orientation == "vertical":
+            cb = plt.colorbar(cs, shrink=1, extend="both",
+                              orientation="vertical", pad=0.02)
+        cb.set_label(r"$k/U_\infty^2$")
+        plot_turb_lines(color="black")
+        plt.ylim((0, 0.63))
+        ax = plt.gca()
+        ax.set_aspect(2)
+        plt.yticks([0,0.13,0.25,0.38,0.5,0.63])
+        plt.tight_layout()
+        if save:
+            if not os.path.isdir(savedir):
+                os.makedirs(savedir)
+            plt.savefig(os.path.join(savedir, "kcont" + savetype))
 
 
 if __name__ == "__main__":
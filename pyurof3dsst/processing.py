@@ -5,10 +5,11 @@ from __future__ import division, print_function
 import matplotlib.pyplot as plt
 import numpy as np
 import os
-from pxl import fdiff
 import sys
-import foampy
 import pandas as pd
+from .forces import IncrementalPerf, reduce_perf
+from . import sets, metadata, recovery
+from .profiling import profiled, stage
 
 
 # Some constants
@@ -27,60 +28,104 @@ ylabels = {"meanu" : r"$U/U_\infty$",
            "meanw" : r"$W/U_\infty$",
            "meanuv" : r"$\overline{u'v'}/U_\infty^2$"}
 
+@profiled
 def calc_perf(theta_0=360, plot=False, verbose=True, inertial=False,
-              export_csv=True):
-    t, torque, drag = foampy.load_all_torque_drag()
-    _t, theta, omega = foampy.load_theta_omega(t_interp=t)
-    reached_theta_0 = True
-    if theta.max() < theta_0:
-        theta_0 = 1
-        reached_theta_0 = False
-    # Compute tip speed ratio
-    tsr = omega*R/U_infty
-    # Compute mean TSR
-    meantsr = np.mean(tsr[theta >= theta_0])
-    if inertial:
-        inertia = 3 # guess from SolidWorks model
-        inertial_torque = inertia*fdiff.second_order_diff(omega, t)
-        torque -= inertial_torque
-    # Compute power coefficient
-    power = torque*omega
-    cp = power/(0.5*rho*area*U_infty**3)
-    meancp = np.mean(cp[theta >= theta_0])
-    # Compute drag coefficient
-    cd = drag/(0.5*rho*area*U_infty**2)
-    meancd = np.mean(cd[theta >= theta_0])
-    if export_csv:
-        df = pd.DataFrame()
-        df["theta_deg"] = theta
-        df["tsr"] = tsr
-        df["cp"] = cp
-        df["cd"] = cd
-        df.to_csv("processed/perf.csv", index=False)
+              export_csv=True, incremental=False, casedir="./"):
+    """Calculate mean turbine performance after `theta_0` degrees.
+
+    The `forces` output is streamed in chunks and reduced in a single pass,
+    so memory use does not grow with run length (unless `plot` is `True`).
+    If `incremental` is `True`, only rows appended to the `forces` output
+    since the last incremental call are parsed, and running sums and
+    `processed/perf.csv` are updated in place. All paths are relative to
+    `casedir`.
+    """
+    if incremental:
+        return calc_perf_incremental(theta_0=theta_0, plot=plot,
+                                     verbose=verbose, inertial=inertial,
+                                     casedir=casedir)
+    processed_dir = os.path.join(casedir, "processed")
+    if export_csv and not os.path.isdir(processed_dir):
+        os.mkdir(processed_dir)
+    csv_file = os.path.join(processed_dir, "perf.csv") if export_csv \
+               else None
+    reducer, rows = reduce_perf(R=R, U_infty=U_infty, rho=rho, area=area,
+                                casedir=casedir, theta_0=theta_0,
+                                inertial=inertial, csv_file=csv_file,
+                                keep=plot)
+    means = reducer.means()
+    if verbose:
+        print("Performance from {:.1f}--{:.1f} degrees:".format(
+                reducer.theta_start, reducer.theta_max))
+        print("Mean TSR = {:.3f}".format(means["TSR"]))
+        print("Mean C_P = {:.3f}".format(means["C_P"]))
+        print("Mean C_D = {:.3f}".format(means["C_D"]))
+    if plot:
+        with stage("render"):
+            theta, tsr, cp, cd = rows
+            plt.close('all')
+            plt.plot(theta[5:], cp[5:])
+            plt.title(r"$\lambda = %1.1f$" %means["TSR"])
+            plt.xlabel(r"$\theta$ (degrees)")
+            plt.ylabel(r"$C_P$")
+            #plt.ylim((0, 1.0))
+            plt.tight_layout()
+            plt.show()
+    if reducer.reached_theta_0:
+        return means
+    else:
+        return {"C_P" : "nan",
+                "C_D" : "nan",
+                "TSR" : "nan"}
+
+@profiled
+def calc_perf_stats(theta_0=360, inertial=False, casedir="./"):
+    """Calculate mean, standard deviation, min and max of TSR, C_P and C_D
+    after `theta_0` degrees in a single pass over the `forces` output.
+    Returns a dict of dicts, e.g., `stats["cp"]["std"]`."""
+    reducer, _ = reduce_perf(R=R, U_infty=U_infty, rho=rho, area=area,
+                             casedir=casedir, theta_0=theta_0,
+                             inertial=inertial)
+    return reducer.results()
+
+@profiled
+def calc_perf_incremental(theta_0=360, plot=False, verbose=True,
+                          inertial=False, casedir="./"):
+    """Update performance from rows appended to the `forces` output since the
+    previous call. The state is kept in `processed/perf_state.json`."""
+    processed_dir = os.path.join(casedir, "processed")
+    if not os.path.isdir(processed_dir):
+        os.mkdir(processed_dir)
+    perf = IncrementalPerf(casedir=casedir, theta_0=theta_0,
+                           inertial=inertial)
+    with stage("update"):
+        perf.update(R=R, U_infty=U_infty, rho=rho, area=area)
+    means, reached_theta_0, theta_start = perf.means()
     if verbose:
-        print("Performance from {:.1f}--{:.1f} degrees:".format(theta_0,
-                                                                theta.max()))
-        print("Mean TSR = {:.3f}".format(meantsr))
-        print("Mean C_P = {:.3f}".format(meancp))
-        print("Mean C_D = {:.3f}".format(meancd))
+        print("Performance from {:.1f}--{:.1f} degrees:".format(
+                theta_start, perf.theta_max))
+        print("Mean TSR = {:.3f}".format(means["TSR"]))
+        print("Mean C_P = {:.3f}".format(means["C_P"]))
+        print("Mean C_D = {:.3f}".format(means["C_D"]))
     if plot:
-        plt.close('all')
-        plt.plot(theta[5:], cp[5:])
-        plt.title(r"$\lambda = %1.1f$" %meantsr)
-        plt.xlabel(r"$\theta$ (degrees)")
-        plt.ylabel(r"$C_P$")
-        #plt.ylim((0, 1.0))
-        plt.tight_layout()
-        plt.show()
+        with stage("parse"):
+            df = pd.read_csv(perf.csv_path)
+        with stage("render"):
+            plt.close('all')
+            plt.plot(df.theta_deg[5:], df.cp[5:])
+            plt.title(r"$\lambda = %1.1f$" %means["TSR"])
+            plt.xlabel(r"$\theta$ (degrees)")
+            plt.ylabel(r"$C_P$")
+            plt.tight_layout()
+            plt.show()
     if reached_theta_0:
-        return {"C_P" : meancp,
-                "C_D" : meancd,
-                "TSR" : meantsr}
+        return means
     else:
         return {"C_P" : "nan",
                 "C_D" : "nan",
                 "TSR" : "nan"}
 
+@profiled
 def loadwake(time):
     """Loads wake data and returns y/R and statistics."""
     # Figure out if time is an int or float
@@ -91,30 +136,28 @@ def loadwake(time):
             folder = str(time)
     else:
         folder = time
-    flist = os.listdir("postProcessing/sets/"+folder)
+    arrays = sets.load_time_dir(folder)
     data = {}
-    for fname in flist:
-        fpath = "postProcessing/sets/"+folder+"/"+fname
+    for fname, array in arrays.items():
         z_H = float(fname.split("_")[1])
-        data[z_H] = np.loadtxt(fpath, unpack=True)
+        data[z_H] = array
     return data
 
+@profiled
 def load_u_profile(z_H=0.0):
     """
     Loads data from the sampled mean velocity and returns it as a pandas
     `DataFrame`.
     """
     z_H = float(z_H)
-    timedirs = os.listdir("postProcessing/sets")
-    latest_time = max(timedirs)
     fname = "profile_{}_UMean.xy".format(z_H)
-    data = np.loadtxt(os.path.join("postProcessing", "sets", latest_time,
-                      fname), unpack=True)
+    data = sets.load_set(fname)
     df = pd.DataFrame()
     df["y_R"] = data[0]/R
     df["u"] = data[1]
     return df
 
+@profiled
 def load_k_profile(z_H=0.0):
     """
     Loads data from the sampled `UPrime2Mean` and `kMean` (if available) and
@@ -122,17 +165,13 @@ def load_k_profile(z_H=0.0):
     """
     z_H = float(z_H)
     df = pd.DataFrame()
-    timedirs = os.listdir("postProcessing/sets")
-    latest_time = max(timedirs)
     fname_u = "profile_{}_UPrime2Mean.xy".format(z_H)
     fname_k = "profile_{}_kMean.xy".format(z_H)
-    data = np.loadtxt(os.path.join("postProcessing", "sets", latest_time,
-                      fname_u), unpack=True)
+    data = sets.load_set(fname_u)
     df["y_R"] = data[0]/R
     df["k_resolved"] = 0.5*(data[1] + data[4] + data[6])
     try:
-        data = np.loadtxt(os.path.join("postProcessing", "sets", latest_time,
-                          fname_k), unpack=True)
+        data = sets.load_set(fname_k)
         df["k_modeled"] = data[1]
         df["k_total"] = df.k_modeled + df.k_resolved
     except FileNotFoundError:
@@ -140,117 +179,141 @@ def load_k_profile(z_H=0.0):
         df["k_total"] = df.k_resolved
     return df
 
+class WakeFields(object):
+    """Wake maps of several fields stacked in one array indexed by
+    `(field, z_H, y_R)`. Indexing by field name returns a `DataFrame` with
+    `z_H` as the index and `y_R` as columns."""
+    def __init__(self, data, fields, z_H, y_R):
+        self.data = data
+        self.fields = list(fields)
+        self.z_H = z_H
+        self.y_R = y_R
+
+    def __getitem__(self, field):
+        return pd.DataFrame(self.data[self.fields.index(field)],
+                            index=self.z_H, columns=self.y_R)
+
+    def __contains__(self, field):
+        return field in self.fields
+
+@profiled
+def load_wake_fields(time=None, casedir="./"):
+    """
+    Loads mean velocity components and TKE for all sampled profiles in one
+    pass. Returns a `WakeFields` object with fields `u`, `v`, `w`,
+    `k_resolved`, `k_modeled` and `k_total`, and `z_H` in descending order.
+    """
+    fields = ["u", "v", "w", "k_resolved", "k_modeled", "k_total"]
+    arrays = sets.load_time_dir(time, casedir=casedir)
+    with stage("numerics"):
+        z_H = sets.list_z_H("UMean", arrays=arrays)
+        z_H.reverse()
+        y_R = arrays["profile_{}_UMean.xy".format(z_H[0])][0]/R
+        data = np.full((len(fields), len(z_H), len(y_R)), np.nan)
+        for i, zi in enumerate(z_H):
+            umean = arrays["profile_{}_UMean.xy".format(zi)]
+            data[0:3, i] = umean[1:4]
+            uprime2mean = arrays.get("profile_{}_UPrime2Mean.xy".format(zi))
+            if uprime2mean is not None:
+                data[3, i] = 0.5*(uprime2mean[1] + uprime2mean[4]
+                                  + uprime2mean[6])
+            kmean = arrays.get("profile_{}_kMean.xy".format(zi))
+            if kmean is not None:
+                data[4, i] = kmean[1]
+        # Total TKE is the resolved part alone if `kMean` was not sampled
+        data[5] = np.where(np.isnan(data[4]), data[3], data[3] + data[4])
+    return WakeFields(data, fields, z_H, y_R)
+
+@profiled
 def load_vel_map(component="u"):
     """
     Loads all mean streamwise velocity profiles. Returns a `DataFrame` with
     `z_H` as the index and `y_R` as columns.
     """
-    # Define columns in set raw data file
-    columns = dict(u=1, v=2, w=3)
-    sets_dir = os.path.join("postProcessing", "sets")
-    latest_time = max(os.listdir(sets_dir))
-    data_dir = os.path.join(sets_dir, latest_time)
-    flist = os.listdir(data_dir)
-    z_H = []
-    for fname in flist:
-        if "UMean" in fname:
-            z_H.append(float(fname.split("_")[1]))
-    z_H.sort()
-    z_H.reverse()
-    vel = []
-    for zi in z_H:
-        fname = "profile_{}_UMean.xy".format(zi)
-        rawdata = np.loadtxt(os.path.join(data_dir, fname), unpack=True)
-        vel.append(rawdata[columns[component]])
-    y_R = rawdata[0]/R
-    vel = np.array(vel).reshape((len(z_H), len(y_R)))
-    df = pd.DataFrame(vel, index=z_H, columns=y_R)
-    return df
+    return load_wake_fields()[component]
 
+@profiled
 def load_k_map(amount="total"):
     """
     Loads all TKE profiles. Returns a `DataFrame` with `z_H` as the index and
     `y_R` as columns.
     """
-    sets_dir = os.path.join("postProcessing", "sets")
-    latest_time = max(os.listdir(sets_dir))
-    data_dir = os.path.join(sets_dir, latest_time)
-    flist = os.listdir(data_dir)
-    z_H = []
-    for fname in flist:
-        if "UPrime2Mean" in fname:
-            z_H.append(float(fname.split("_")[1]))
-    z_H.sort()
-    z_H.reverse()
-    k = []
-    for z_H_i in z_H:
-        dfi = load_k_profile(z_H_i)
-        k.append(dfi["k_" + amount].values)
-    y_R = dfi.y_R.values
-    k = np.array(k).reshape((len(z_H), len(y_R)))
-    df = pd.DataFrame(k, index=z_H, columns=y_R)
-    return df
+    return load_wake_fields()["k_" + amount]
 
-def get_ncells(logname="log.checkMesh", keyword="cells"):
+@profiled
+def get_ncells(logname="log.checkMesh", keyword="cells", casedir="./"):
     if keyword == "cells":
         keyword = "cells:"
-    with open(logname) as f:
-        for line in f.readlines():
+    with open(os.path.join(casedir, logname)) as f:
+        for line in f:
             ls = line.split()
             if ls and ls[0] == keyword:
                 value = ls[1]
                 return int(value)
 
-def get_yplus(logname="log.yPlus"):
-    with open(logname) as f:
-        lines = f.readlines()
-        for n in range(len(lines)):
-            ls = lines[n].split()
-            if ls and ls[-1] == "blades":
-                nstart = n
-                break
-    line = lines[n+3]
-    line = line.split()
-    return {"min" : float(line[3]),
-            "max" : float(line[5]),
-            "mean" : float(line[7])}
+@profiled
+def get_yplus(logname="log.yPlus", casedir="./"):
+    values = metadata.scan_file(os.path.join(casedir, logname),
+                                metadata.keyword_table["log.yPlus"])
+    return {"min" : values["yplus_min"],
+            "max" : values["yplus_max"],
+            "mean" : values["yplus_mean"]}
 
-def get_nx_nz():
-    blocks = foampy.dictionaries.read_text("constant/polyMesh/blockMeshDict",
-                                           "blocks")
-    nx = int(blocks[3].replace("(", "").split()[0])
-    nz = int(blocks[3].replace(")", "").split()[2])
-    return nx, nz
+@profiled
+def get_nx_nz(casedir="./"):
+    md = metadata.read_case_metadata(casedir,
+            files=["constant/polyMesh/blockMeshDict"])
+    return md.nx, md.nz
 
-def get_nlayers_expratio():
-    nlayers = foampy.dictionaries.read_single_line_value("snappyHexMeshDict",
-            "nSurfaceLayers", valtype=int)
-    expratio = foampy.dictionaries.read_single_line_value("snappyHexMeshDict",
-            "expansionRatio")
-    return nlayers, expratio
+@profiled
+def get_nlayers_expratio(casedir="./"):
+    md = metadata.read_case_metadata(casedir,
+            files=["system/snappyHexMeshDict"])
+    return md.nlayers, md.expratio
 
-def get_ddt_scheme():
-    block = foampy.dictionaries.read_text("system/fvSchemes", "ddtSchemes")
-    val = block[2].replace(";", "").split()[1]
-    return val
+@profiled
+def get_ddt_scheme(casedir="./"):
+    md = metadata.read_case_metadata(casedir, files=["system/fvSchemes"])
+    return md.ddt_scheme
 
-def get_max_courant_no():
-    if foampy.dictionaries.read_single_line_value("controlDict",
-            "adjustTimeStep", valtype=str) == "yes":
-        return foampy.dictionaries.read_single_line_value("controlDict",
-                                                          "maxCo")
-    else:
-        return "nan"
+@profiled
+def get_max_courant_no(casedir="./"):
+    md = metadata.read_case_metadata(casedir, files=["system/controlDict"])
+    return md.maxco
 
-def get_deltat():
-    if foampy.dictionaries.read_single_line_value("controlDict",
-                                                  "adjustTimeStep",
-                                                  valtype=str) == "no":
-        return foampy.dictionaries.read_single_line_value("controlDict",
-                                                          "deltaT")
-    else:
-        return "nan"
+@profiled
+def get_deltat(casedir="./"):
+    md = metadata.read_case_metadata(casedir, files=["system/controlDict"])
+    return md.dt
+
+# Columns of `processed/all_perf.csv`
+perf_log_columns = ["dt", "maxco", "nx", "nz", "ncells", "nlayers",
+                    "expratio", "tsr", "cp", "cd", "yplus_min", "yplus_max",
+                    "yplus_mean", "ddt_scheme"]
 
+@profiled
+def get_perf_log_row(casedir="./", verbose=False):
+    """Collect mean performance and case parameters for a case directory as a
+    dict with keys `perf_log_columns`. Each log and dictionary is read once
+    by `metadata.read_case_metadata`."""
+    data = calc_perf(verbose=verbose, casedir=casedir)
+    md = metadata.read_case_metadata(casedir)
+    return {"dt": md.dt,
+            "maxco": md.maxco,
+            "nx": md.nx,
+            "nz": md.nz,
+            "ncells": md.ncells,
+            "nlayers": md.nlayers,
+            "expratio": md.expratio,
+            "tsr": data["TSR"],
+            "cp": data["C_P"],
+            "cd": data["C_D"],
+            "yplus_min": md.yplus_min,
+            "yplus_max": md.yplus_max,
+            "yplus_mean": md.yplus_mean,
+            "ddt_scheme": md.ddt_scheme}
+
+@profiled
 def log_perf(logname="all_perf.csv", mode="a", verbose=True):
     """Logs mean performance calculations to CSV file. If file exists, data
     is appended."""
@@ -258,68 +321,30 @@ def log_perf(logname="all_perf.csv", mode="a", verbose=True):
         os.mkdir("processed")
     with open("processed/" + logname, mode) as f:
         if os.stat("processed/" + logname).st_size == 0:
-            f.write("dt,maxco,nx,nz,ncells,nlayers,expratio,tsr,cp,cd,"\
-                    + "yplus_min,yplus_max,yplus_mean,ddt_scheme\n")
-        data = calc_perf(verbose=verbose)
-        ncells = get_ncells()
-        yplus = get_yplus()
-        nx, nz = get_nx_nz()
-        nlayers, expratio = get_nlayers_expratio()
-        maxco = get_max_courant_no()
-        dt = get_deltat()
-        ddt_scheme = get_ddt_scheme()
-        val_string = "{dt},{maxco},{nx},{nz},{ncells},{nlayers},{expratio},{tsr},"\
-                + "{cp},{cd},{ypmin},{ypmax},{ypmean},{ddt_scheme}\n"
-        f.write(val_string.format(dt=dt,
-                                  maxco=maxco,
-                                  nx=nx,
-                                  nz=nz,
-                                  ncells=ncells,
-                                  nlayers=nlayers,
-                                  expratio=expratio,
-                                  tsr=data["TSR"],
-                                  cp=data["C_P"],
-                                  cd=data["C_D"],
-                                  ypmin=yplus["min"],
-                                  ypmax=yplus["max"],
-                                  ypmean=yplus["mean"],
-                                  ddt_scheme=ddt_scheme))
+            f.write(",".join(perf_log_columns) + "\n")
+        row = get_perf_log_row(verbose=verbose)
+        f.write(",".join(str(row[c]) for c in perf_log_columns) + "\n")
+
+@profiled
+def read_funky_log(casedir="./"):
+    """Parse `funkyDoCalc` logs for recovery term averages. If there are no
+    logs, the averages saved by `scripts/recovery.py` are returned."""
+    md = metadata.read_case_metadata(casedir, files=["log.funkyDoCalc.0",
+                                                     "log.funkyDoCalc.1",
+                                                     "log.funkyDoCalc.2"])
+    if all(v is None for v in md.funky.values()):
+        saved = recovery.load_recovery_terms(os.path.join(
+                casedir, "processed", "recovery_terms.json"))
+        if saved is not None:
+            return saved
+    return md.funky
 
-def read_funky_log():
-    """Parse `funkyDoCalc` logs for recovery term averages."""
-    with open("log.funkyDoCalc.0") as f:
-        for line in f.readlines():
-            try:
-                line = line.replace("=", " ")
-                line = line.split()
-                if line[0] == "planeAverageAdvectionY":
-                    y_adv = float(line[-1])
-                elif line[0] == "weightedAverage":
-                    z_adv = float(line[-1])
-            except IndexError:
-                pass
-    with open("log.funkyDoCalc.1") as f:
-        for line in f.readlines():
-            try:
-                line = line.replace("=", " ")
-                line = line.split()
-                if line[0] == "weightedAverage":
-                    turb_trans = float(line[-1])
-                elif line[0] == "planeAverageViscTrans":
-                    visc_trans = float(line[-1])
-            except IndexError:
-                pass
-    with open("log.funkyDoCalc.2") as f:
-        for line in f.readlines():
-            try:
-                line = line.replace("=", " ")
-                line = line.split()
-                if line[0] == "weightedAverage":
-                    pressure_trans = float(line[-1])
-            except IndexError:
-                pass
-    return {"y_adv" : y_adv, "z_adv" : z_adv, "turb_trans" : turb_trans,
-            "visc_trans" : visc_trans, "pressure_trans" : pressure_trans}
+@profiled
+def calc_recovery_terms(time=None, x=1.0, casedir="./", **kwargs):
+    """Compute plane averaged recovery terms at `x` from the mean fields, in
+    the form returned by `read_funky_log`. See
+    `recovery.calc_recovery_terms` for keyword arguments."""
+    return recovery.calc_recovery_terms(casedir, time=time, x=x, **kwargs)
 
 if __name__ == "__main__":
     pass
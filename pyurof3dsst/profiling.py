@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+"""Opt-in timing instrumentation for the post-processing API.
+
+Public functions of `processing` and `plotting` are wrapped with `profiled`,
+and split into stages (e.g. `"read"`, `"numerics"`, `"render"`) with
+`stage`. When enabled, every call records its wall time, the time in each
+stage, the bytes read by the process (from `/proc/self/io`, where
+available) and its peak traced memory above the memory in use at the
+start. When disabled, a wrapped call costs one global check.
+
+Enable with `enable()` or by setting the environment variable
+`PYUROF3DSST_PROFILE` to `1`, which prints a summary at exit, or to a path,
+which writes the JSON trace there at exit::
+
+    from pyurof3dsst import profiling
+    profiling.enable()
+    processing.calc_perf()
+    profiling.print_summary()
+"""
+
+from __future__ import division, print_function
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+_enabled = False
+_records = []
+_local = threading.local()
+
+
+def _read_bytes():
+    """Return the bytes read by this process so far, or `None` if unknown.
+    Reads from memory-mapped files are not counted."""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def enable(trace_memory=True):
+    """Start recording calls. Memory tracing with `tracemalloc` slows
+    allocation-heavy code, so it can be turned off."""
+    global _enabled
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Discard all recorded calls."""
+    del _records[:]
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+class _Stage(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        stack = _stack()
+        if stack:
+            stages = stack[-1]["stages"]
+            stages[self.name] = stages.get(self.name, 0.0) \
+                              + time.perf_counter() - self.t0
+        return False
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_null_stage = _NullStage()
+
+
+def stage(name):
+    """Context manager timing a stage of the innermost profiled call."""
+    if not _enabled:
+        return _null_stage
+    return _Stage(name)
+
+
+def profiled(func):
+    """Decorator recording each call of `func` while profiling is
+    enabled."""
+    name = "{}.{}".format(func.__module__.rsplit(".", 1)[-1], func.__name__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        stack = _stack()
+        tracing = tracemalloc.is_tracing()
+        record = {"name": name, "depth": len(stack),
+                  "parent": stack[-1]["name"] if stack else None,
+                  "stages": {}, "child_peak": 0}
+        if tracing:
+            mem_start, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]["child_peak"] = max(stack[-1]["child_peak"], peak)
+            tracemalloc.reset_peak()
+        bytes_start = _read_bytes()
+        stack.append(record)
+        t0 = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record["start"] = t0
+            record["wall"] = time.perf_counter() - t0
+            bytes_end = _read_bytes()
+            record["bytes_read"] = None if bytes_start is None \
+                                   else bytes_end - bytes_start
+            if tracing and tracemalloc.is_tracing():
+                peak = max(tracemalloc.get_traced_memory()[1],
+                           record["child_peak"])
+                record["peak_memory"] = peak - mem_start
+                # The caller's peak includes this call's
+                if len(stack) > 1:
+                    stack[-2]["child_peak"] = max(stack[-2]["child_peak"],
+                                                  peak)
+            else:
+                record["peak_memory"] = None
+            del record["child_peak"]
+            stack.pop()
+            _records.append(record)
+    return wrapper
+
+
+def trace():
+    """Return the recorded calls, in order of completion, as a list of
+    dicts with `name`, `parent`, `depth`, `start`, `wall` and `stages` in
+    seconds, `bytes_read` and `peak_memory` in bytes."""
+    return list(_records)
+
+
+def write_trace(fpath="processed/profile.json"):
+    """Write the recorded calls as JSON."""
+    dirname = os.path.dirname(fpath)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(fpath, "w") as f:
+        json.dump(trace(), f, indent=4)
+
+
+def summary():
+    """Return a `DataFrame` with the number of calls, total and mean wall
+    time, total time in each stage, total bytes read and maximum peak
+    memory for each profiled function, slowest first."""
+    import pandas as pd
+    rows = {}
+    for r in _records:
+        row = rows.setdefault(r["name"], {"calls": 0, "wall": 0.0,
+                                          "bytes_read": 0, "peak_memory": 0})
+        row["calls"] += 1
+        row["wall"] += r["wall"]
+        row["bytes_read"] += r["bytes_read"] or 0
+        row["peak_memory"] = max(row["peak_memory"], r["peak_memory"] or 0)
+        for s, t in r["stages"].items():
+            row["stage_" + s] = row.get("stage_" + s, 0.0) + t
+    df = pd.DataFrame.from_dict(rows, orient="index")
+    if len(df):
+        df.insert(2, "mean_wall", df.wall/df.calls)
+        df = df.sort_values("wall", ascending=False).fillna(0.0)
+    return df
+
+
+def print_summary():
+    df = summary()
+    if not len(df):
+        print("No profiled calls recorded")
+        return
+    df = df.copy()
+    df["bytes_read"] = (df.bytes_read/1e6).round(2)
+    df["peak_memory"] = (df.peak_memory/1e6).round(2)
+    df = df.rename(columns={"bytes_read": "read_MB",
+                            "peak_memory": "peak_MB"})
+    print(df.to_string(float_format=lambda x: "{:.4g}".format(x)))
+
+
+def _at_exit(target):
+    if not _records:
+        return
+    if target == "1":
+        print_summary()
+    else:
+        write_trace(target)
+
+
+_env = os.environ.get("PYUROF3DSST_PROFILE")
+if _env and _env != "0":
+    enable()
+    atexit.register(_at_exit, _env)
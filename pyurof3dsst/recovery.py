@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""Mean streamwise momentum recovery terms on a cross-stream plane.
+
+This computes the plane averages that `system/controlDict.recovery` and the
+three `funkyDoCalc` runs produce, without writing gradient fields for the
+whole volume. The mean fields are interpolated onto a structured grid of
+three planes about the plane of interest with `sampling.Sampler`, gradients
+and Laplacians are taken with finite differences, and each term is averaged
+over the middle plane with area (trapezoidal) weights, like swak4Foam's
+`weightedAverage`. The terms, each divided by the mean streamwise velocity
+`U`, are
+
+    y_adv           -V dU/dy
+    z_adv           -W dU/dz
+    turb_trans      nu_t lap(U)
+    visc_trans      nu lap(U)
+    pressure_trans  -dp/dx
+
+as in the `funkyDoCalc` output. With `resolved` set, the transport by the
+resolved Reynolds stresses in `UPrime2Mean`, -(d(u'v')/dy + d(u'w')/dz), is
+added as `turb_trans_resolved`.
+"""
+
+from __future__ import division, print_function
+import numpy as np
+import json
+import os
+from . import fields as foamfields
+from .sampling import Sampler, grid_points
+
+term_names = ["y_adv", "z_adv", "turb_trans", "visc_trans",
+              "pressure_trans"]
+
+# Term added when the resolved Reynolds stresses are included
+resolved_term_name = "turb_trans_resolved"
+
+
+def read_nu(casedir="./"):
+    """Read the kinematic viscosity from `constant/transportProperties`."""
+    entry = foamfields.read_entry(os.path.join(casedir, "constant",
+                                               "transportProperties"), "nu")
+    return float(entry.decode().rstrip(";").split()[-1])
+
+
+def trapz_weights(x):
+    """Return the weights of the trapezoidal rule on points `x`."""
+    x = np.asarray(x, dtype=float)
+    w = np.zeros(len(x))
+    dx = np.diff(x)
+    w[:-1] += dx/2
+    w[1:] += dx/2
+    return w
+
+
+def _second_derivative(f, h, axis):
+    """Central second difference of `f` along `axis` with spacing `h`, with
+    end points taking their neighbours' values."""
+    f = np.moveaxis(f, axis, 0)
+    d = np.empty_like(f)
+    d[1:-1] = (f[2:] - 2*f[1:-1] + f[:-2])/h**2
+    d[0] = d[1]
+    d[-1] = d[-2]
+    return np.moveaxis(d, 0, axis)
+
+
+def budget_terms(x, y, z, u, p, nut, stresses=None, nu=1e-6):
+    """Return the recovery terms on the middle of three evenly spaced x
+    planes of a structured grid with evenly spaced `y` and `z`.
+
+    `u` is the mean velocity with shape `(3, ny, nz, 3)`, `p` and `nut` the
+    mean kinematic pressure and eddy viscosity with shape `(3, ny, nz)`, and
+    `stresses` the optional resolved Reynolds stresses (`UPrime2Mean`, in
+    the order xx, xy, xz, yy, yz, zz) with shape `(3, ny, nz, 6)`, whose
+    transport is returned as `turb_trans_resolved`. Returns a dict of arrays
+    of shape `(ny, nz)`.
+    """
+    h = [x[1] - x[0], y[1] - y[0], z[1] - z[0]]
+    ux = u[..., 0]
+    lap = sum(_second_derivative(ux, h[i], i) for i in range(3))[1]
+    dudy = np.gradient(ux[1], h[1], axis=0)
+    dudz = np.gradient(ux[1], h[2], axis=1)
+    dpdx = np.gradient(p, h[0], axis=0)[1]
+    mid = u[1]
+    terms = {"y_adv": -mid[..., 1]*dudy, "z_adv": -mid[..., 2]*dudz,
+             "turb_trans": nut[1]*lap, "visc_trans": nu*lap,
+             "pressure_trans": -dpdx}
+    if stresses is not None:
+        terms[resolved_term_name] = \
+                -np.gradient(stresses[1, ..., 1], h[1], axis=0) \
+                - np.gradient(stresses[1, ..., 2], h[2], axis=1)
+    return {name: term/mid[..., 0] for name, term in terms.items()}
+
+
+def plane_average(values, y, z):
+    """Area weighted average of `values`, shaped `(ny, nz)`, over the plane
+    spanned by `y` and `z`."""
+    w = trapz_weights(y)[:, None]*trapz_weights(z)[None, :]
+    return float((values*w).sum()/w.sum())
+
+
+def calc_recovery_terms(casedir="./", time=None, x=1.0, y=None, z=None,
+                        spacing=None, resolved=False, sampler=None):
+    """Compute plane averaged recovery terms at `x`, in the form returned by
+    `processing.read_funky_log`, plus `turb_trans_resolved` if `resolved`
+    is set.
+
+    `y` and `z` are `(min, max, n)` of the grid, by default spanning the
+    cell centres with `spacing`, which defaults to the mean cell size and is
+    also the distance between the x planes. A `Sampler` for `time` (by
+    default the latest) may be passed to reuse its cell index and fields.
+    """
+    if sampler is None:
+        sampler = Sampler(casedir, time)
+    centres = sampler.centres
+    lower = np.asarray(centres.min(axis=0))
+    upper = np.asarray(centres.max(axis=0))
+    if spacing is None:
+        spacing = ((upper - lower).prod()/len(centres))**(1/3)
+    grid = []
+    for i, given in [(1, y), (2, z)]:
+        if given is None:
+            n = int(round((upper[i] - lower[i])/spacing)) + 1
+            given = (lower[i], upper[i], max(n, 3))
+        grid.append(np.linspace(*given))
+    y, z = grid
+    x = x + spacing*np.array([-1.0, 0.0, 1.0])
+    names = ["UMean", "pMean", "nutMean"]
+    if resolved:
+        names.append("UPrime2Mean")
+    values = sampler.sample(names, grid_points(x, y, z))
+    terms = budget_terms(x, y, z, values["UMean"], values["pMean"],
+                         values["nutMean"], values.get("UPrime2Mean"),
+                         nu=read_nu(sampler.casedir))
+    return {name: plane_average(term, y, z) for name, term in terms.items()}
+
+
+def save_recovery_terms(terms, fpath="processed/recovery_terms.json"):
+    """Save recovery term averages as JSON."""
+    d = os.path.dirname(fpath)
+    if d and not os.path.isdir(d):
+        os.makedirs(d)
+    with open(fpath + ".tmp", "w") as f:
+        json.dump(terms, f, indent=2)
+    os.replace(fpath + ".tmp", fpath)
+
+
+def load_recovery_terms(fpath="processed/recovery_terms.json"):
+    """Load recovery term averages saved by `save_recovery_terms`, or return
+    `None` if there are none."""
+    if not os.path.isfile(fpath):
+        return None
+    with open(fpath) as f:
+        return json.load(f)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""Sampling fields at arbitrary points without running `sample`.
+
+Cell centres and nearest cell queries come from the saved `CellIndex` of
+the mesh, which is built on first use. Field
+values are read with `fields.read_field`, so only the cells used by the
+probes are read from a binary field. Values at probe points are weighted
+sums over the `k` nearest cell centres, computed for all points at once.
+The weights of the default `"linear"` scheme come from an inverse-distance
+weighted least-squares linear fit, so linear fields are reproduced exactly,
+like `cellPoint` interpolation; `"idw"` and `"cell"` (nearest cell) are
+also available.
+
+Usage::
+
+    sampler = Sampler(time="9.98")
+    arrays = sampler.sample_profiles(x=2.0)   # a wake plane at x/D = 2
+"""
+
+from __future__ import division, print_function
+import numpy as np
+import os
+from . import fields as foamfields
+from .mesh import cell_centres
+from .meshindex import CellIndex
+from .timedirs import latest_time
+
+# Profiles sampled by default, as in `scripts/gensampledict.py`
+profile_fields = ["UMean", "UPrime2Mean", "kMean"]
+profile_x = 1.0
+profile_y = (-1.5, 1.5, 121)
+profile_z = (-1.125, 1.125, 19)
+
+
+def line_points(start, end, n):
+    """Return `n` evenly spaced points from `start` to `end`."""
+    s = np.linspace(0, 1, n)[:, None]
+    return (1 - s)*np.asarray(start, dtype=float) \
+         + s*np.asarray(end, dtype=float)
+
+
+def grid_points(x, y, z):
+    """Return the points of a structured grid, with `x`, `y` and `z` scalars
+    or 1-D arrays, as an array of shape `(len(x), len(y), len(z), 3)`."""
+    xx, yy, zz = np.meshgrid(np.atleast_1d(x), np.atleast_1d(y),
+                             np.atleast_1d(z), indexing="ij")
+    return np.stack([xx, yy, zz], axis=-1)
+
+
+class Sampler(object):
+    """Interpolate cell values of a case at arbitrary points.
+
+    The `CellIndex` of the mesh at `time` is used, or given as `index`. A
+    case that has not been reconstructed has none, so its cell centres are
+    computed and put in a KD-tree on construction; one sampler should then
+    be reused for many probes. `centres` can also be given directly. `time`
+    defaults to the latest time, whose points are used for a moving mesh.
+    """
+    def __init__(self, casedir="./", time=None, k=8, centres=None,
+                 index=None):
+        self.casedir = casedir
+        if time is None:
+            time = latest_time(casedir)
+        self.time = time
+        self.k = k
+        if centres is None and index is None:
+            try:
+                index = CellIndex(casedir, time)
+            except IOError:
+                centres = cell_centres(casedir, time)
+        self.index = index
+        self.tree = None
+        if centres is None:
+            centres = index.centres
+        else:
+            from scipy.spatial import cKDTree
+            self.tree = cKDTree(centres)
+        self.centres = centres
+        self._values = {}
+
+    def query(self, points, k):
+        """Return distances to and indices of the `k` nearest cell centres,
+        as arrays of shape `(npoints, k)`."""
+        if self.tree is None:
+            return self.index.query(points, k=k)
+        dist, index = self.tree.query(points, k=k)
+        return dist.reshape((-1, k)), index.reshape((-1, k))
+
+    def weights(self, points, scheme="linear"):
+        """Return cell indices and weights, each of shape `(npoints, k)`, for
+        interpolating at `points` with `scheme` `"linear"`, `"idw"` or
+        `"cell"`."""
+        points = np.asarray(points, dtype=float).reshape((-1, 3))
+        k = 1 if scheme == "cell" else self.k
+        dist, index = self.query(points, k)
+        if k == 1:
+            return index, np.ones((len(points), 1))
+        # A point on a cell centre takes that cell's value
+        exact = dist[:, 0] < 1e-12
+        w = 1.0/np.maximum(dist, 1e-12)**2
+        if scheme == "linear":
+            # Fit a + b.(x - point) by weighted least squares; the weights
+            # are the first row of the fit's pseudo-inverse
+            a = np.concatenate([np.ones(index.shape + (1,)),
+                                self.centres[index] - points[:, None]],
+                               axis=2)
+            aw = a*w[..., None]
+            m = np.einsum("pki,pkj->pij", aw, a)
+            g = np.linalg.pinv(m)[:, :, 0]
+            w = np.einsum("pki,pi->pk", aw, g)
+        w[exact] = 0.0
+        w[exact, 0] = 1.0
+        return index, w/w.sum(axis=1)[:, None]
+
+    def field(self, name):
+        """Return the cell values of field `name`, memory mapped if
+        binary."""
+        if name not in self._values:
+            self._values[name] = foamfields.read_field(name, self.time,
+                                                       casedir=self.casedir)
+        return self._values[name]
+
+    def sample(self, names, points, scheme="linear"):
+        """Interpolate fields `names` at `points` (any array with last
+        dimension 3). Returns a dict of arrays shaped like `points` without
+        its last dimension, plus one for the components of non-scalar
+        fields."""
+        if isinstance(names, str):
+            names = [names]
+        points = np.asarray(points, dtype=float)
+        shape = points.shape[:-1]
+        index, w = self.weights(points, scheme=scheme)
+        # Read each needed cell once
+        cells, inverse = np.unique(index, return_inverse=True)
+        inverse = inverse.reshape(index.shape)
+        results = {}
+        for name in names:
+            values = np.asarray(self.field(name)[cells], dtype=float)
+            if values.ndim == 1:
+                result = (values[inverse]*w).sum(axis=1)
+            else:
+                result = (values[inverse]*w[..., None]).sum(axis=1)
+            results[name] = result.reshape(shape + values.shape[1:])
+        return results
+
+    def sample_profiles(self, x=profile_x, y=profile_y, z=profile_z,
+                        names=profile_fields, scheme="linear"):
+        """Sample cross-stream profiles at `x`, with `y` and `z` given as
+        `(min, max, n)`, in the layout of `sets.load_time_dir`: a dict
+        keyed by `profile_<z>_<field>.xy` of arrays whose first row is `y`
+        and remaining rows the field components."""
+        y = np.linspace(*y)
+        z_array = np.linspace(*z)
+        points = grid_points(x, y, z_array)[0].transpose((1, 0, 2))
+        sampled = self.sample(names, points, scheme=scheme)
+        arrays = {}
+        for i, zi in enumerate(z_array):
+            for name in names:
+                values = sampled[name][i]
+                rows = values.T if values.ndim == 2 else values[None]
+                arrays["profile_{}_{}.xy".format(zi, name)] = \
+                        np.vstack([y, rows])
+        return arrays
+
+
+def write_sets(arrays, time, casedir="./"):
+    """Write sampled profiles from `Sampler.sample_profiles` as raw `.xy`
+    files in `postProcessing/sets/<time>`, where `sample` writes them."""
+    set_dir = os.path.join(casedir, "postProcessing", "sets", str(time))
+    if not os.path.isdir(set_dir):
+        os.makedirs(set_dir)
+    for fname, array in arrays.items():
+        np.savetxt(os.path.join(set_dir, fname), array.T, fmt="%.10g",
+                   delimiter="\t")
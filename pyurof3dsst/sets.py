@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""Binary cache for sampled sets in `postProcessing/sets`.
+
+Each time directory of raw `.xy` set files is converted once to a single
+uncompressed `.npz` file in `postProcessing/cache/sets`, which also stores
+the modification time and size of every source file so stale entries are
+detected and re-parsed.
+"""
+
+from __future__ import division, print_function
+import numpy as np
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from .timedirs import latest_time
+from .profiling import stage
+
+
+_manifest_key = "__manifest__"
+
+# Arrays already loaded in this process, keyed by cache path
+_memo = {}
+
+
+def get_sets_dir(casedir="./"):
+    return os.path.join(casedir, "postProcessing", "sets")
+
+
+def get_cache_dir(casedir="./"):
+    return os.path.join(casedir, "postProcessing", "cache", "sets")
+
+
+def get_latest_time(casedir="./"):
+    """Return the name of the latest time directory of sampled sets."""
+    return latest_time(get_sets_dir(casedir))
+
+
+def _scan(data_dir):
+    """Return a dict of `[mtime, size]` for each set file in `data_dir`."""
+    manifest = {}
+    for fname in os.listdir(data_dir):
+        st = os.stat(os.path.join(data_dir, fname))
+        manifest[fname] = [st.st_mtime, st.st_size]
+    return manifest
+
+
+def _read_cache(cache_path):
+    """Return the manifest and arrays stored in a cache file, or `None` if it
+    does not exist or cannot be read."""
+    try:
+        with np.load(cache_path) as npz:
+            manifest = json.loads(str(npz[_manifest_key]))
+            arrays = {k: npz[k] for k in npz.files if k != _manifest_key}
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+    return manifest, arrays
+
+
+def _write_cache(cache_path, manifest, arrays):
+    """Write a cache file atomically so concurrent readers never see a
+    partial file."""
+    cache_dir = os.path.dirname(cache_path)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    tmp_path = cache_path + ".tmp{}".format(os.getpid())
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **dict(arrays, **{_manifest_key:
+                                      np.array(json.dumps(manifest))}))
+    os.replace(tmp_path, cache_path)
+
+
+def read_set_file(fpath):
+    """Parse a raw `.xy` set file, returning the same array as
+    `np.loadtxt(fpath, unpack=True)`."""
+    with open(fpath) as f:
+        first = f.readline()
+        text = first + f.read()
+    ncols = len(first.split())
+    return np.fromstring(text, sep=" ").reshape((-1, ncols)).T.copy()
+
+
+def load_time_dir(time=None, casedir="./", nthreads=8):
+    """Load all sets for a time directory as a dict of arrays keyed by file
+    name, shaped like `np.loadtxt(fpath, unpack=True)`.
+
+    Only files whose modification time or size changed since the cache was
+    written are re-parsed from ASCII, reading up to `nthreads` files
+    concurrently. If `time` is `None` the latest time is used.
+    """
+    with stage("discovery"):
+        if time is None:
+            time = get_latest_time(casedir)
+        data_dir = os.path.join(get_sets_dir(casedir), time)
+        cache_path = os.path.join(get_cache_dir(casedir), time + ".npz")
+        manifest = _scan(data_dir)
+    memo = _memo.get(cache_path)
+    if memo is not None and memo[0] == manifest:
+        return memo[1]
+    with stage("read_cache"):
+        cached = _read_cache(cache_path)
+    if cached is not None and cached[0] == manifest:
+        arrays = cached[1]
+    else:
+        old_manifest, arrays = cached if cached is not None else ({}, {})
+        arrays = {k: v for k, v in arrays.items()
+                  if k in manifest and old_manifest.get(k) == manifest[k]}
+        stale = [fname for fname in manifest if fname not in arrays]
+        with stage("parse"), \
+                ThreadPoolExecutor(max_workers=nthreads) as pool:
+            parsed = pool.map(read_set_file, [os.path.join(data_dir, fname)
+                                              for fname in stale])
+            arrays.update(zip(stale, parsed))
+        with stage("write_cache"):
+            _write_cache(cache_path, manifest, arrays)
+    _memo[cache_path] = (manifest, arrays)
+    return arrays
+
+
+def load_set(fname, time=None, casedir="./"):
+    """Load a single set file through the cache. Raises `FileNotFoundError`
+    if it was not sampled."""
+    arrays = load_time_dir(time, casedir=casedir)
+    try:
+        return arrays[fname]
+    except KeyError:
+        raise FileNotFoundError("No sampled set named {}".format(fname))
+
+
+def list_z_H(field, time=None, casedir="./", arrays=None):
+    """Return a sorted list of z/H values sampled for `field`, optionally
+    from a dict of already loaded `arrays`."""
+    if arrays is None:
+        arrays = load_time_dir(time, casedir=casedir)
+    z_H = []
+    for fname in arrays:
+        if fname.endswith("_{}.xy".format(field)):
+            z_H.append(float(fname.split("_")[1]))
+    return sorted(z_H)
+
+
+def clear_memo():
+    """Forget arrays loaded in this process, so the next load reads the
+    cache files."""
+    _memo.clear()
+
+
+def clear_cache(casedir="./"):
+    """Delete all cached set files."""
+    _memo.clear()
+    cache_dir = get_cache_dir(casedir)
+    if os.path.isdir(cache_dir):
+        for fname in os.listdir(cache_dir):
+            os.remove(os.path.join(cache_dir, fname))
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+"""Streaming parser for the `pimpleDyMFoam` solver log.
+
+Per-time step Courant numbers, PIMPLE iteration counts, linear solver
+residuals and iterations per field, mesh update time and
+ExecutionTime/ClockTime are extracted into one append-only binary file per
+column in `postProcessing/cache/<logname>`. The byte offset of the last
+complete time step is saved with them, so each update only parses what the
+solver has written since.
+"""
+
+from __future__ import division, print_function
+import numpy as np
+import pandas as pd
+import json
+import os
+
+
+# Columns written for every time step, in addition to per-field columns
+step_columns = ["time", "delta_t", "courant_mean", "courant_max",
+                "pimple_iters", "mesh_update_time", "execution_time",
+                "clock_time"]
+
+# Per-field linear solver columns, named `<field>_<suffix>`
+field_suffixes = ["initial", "final", "iters", "solves"]
+
+
+def get_cache_dir(logname="log.pimpleDyMFoam", casedir="./"):
+    return os.path.join(casedir, "postProcessing", "cache", logname)
+
+
+def _new_step():
+    step = dict.fromkeys(step_columns, np.nan)
+    step["pimple_iters"] = 0
+    step["fields"] = {}
+    return step
+
+
+def _parse_solve(line, step):
+    """Add a `Solving for ...` line to the current step."""
+    parts = line.split(b",")
+    try:
+        field = parts[0].split()[-1].decode()
+        initial = float(parts[1].split()[-1])
+        final = float(parts[2].split()[-1])
+        iters = int(parts[3].split()[-1])
+    except (IndexError, ValueError):
+        return
+    f = step["fields"].get(field)
+    if f is None:
+        step["fields"][field] = {"initial": initial, "final": final,
+                                 "iters": iters, "solves": 1}
+    else:
+        f["final"] = final
+        f["iters"] += iters
+        f["solves"] += 1
+
+
+def iter_log_steps(f, offset=0):
+    """Parse complete time steps from an open binary log file positioned at
+    `offset`, yielding each step dict with the offset just after it (i.e.,
+    after its `ExecutionTime` line). A last line without a newline is still
+    being written, so parsing stops before it."""
+    step = _new_step()
+    # Values printed before `Time = ` belong to the upcoming step
+    pre = {}
+    for line in f:
+        if not line.endswith(b"\n"):
+            break
+        offset += len(line)
+        line = line.strip()
+        if line.startswith(b"Time = "):
+            step = _new_step()
+            step.update(pre)
+            pre = {}
+            try:
+                step["time"] = float(line[7:])
+            except ValueError:
+                pass
+        elif line.startswith(b"Courant Number mean:"):
+            ls = line.split()
+            try:
+                pre["courant_mean"] = float(ls[3])
+                pre["courant_max"] = float(ls[5])
+            except (IndexError, ValueError):
+                pass
+        elif line.startswith(b"deltaT = "):
+            try:
+                pre["delta_t"] = float(line[9:])
+            except ValueError:
+                pass
+        elif line.startswith(b"PIMPLE: iteration"):
+            step["pimple_iters"] += 1
+        elif b"Solving for " in line:
+            _parse_solve(line, step)
+        elif line.startswith(b"Execution time for mesh.update()"):
+            try:
+                step["mesh_update_time"] = float(line.split()[-2])
+            except (IndexError, ValueError):
+                pass
+        elif line.startswith(b"ExecutionTime = "):
+            ls = line.split()
+            try:
+                step["execution_time"] = float(ls[2])
+                step["clock_time"] = float(ls[6])
+            except (IndexError, ValueError):
+                pass
+            if not np.isnan(step["time"]):
+                yield step, offset
+            step = _new_step()
+
+
+def parse_log_lines(f, offset=0):
+    """Parse complete time steps from an open binary log file positioned at
+    `offset`. Returns a list of step dicts and the offset just after the last
+    complete step."""
+    steps = []
+    for step, offset in iter_log_steps(f, offset):
+        steps.append(step)
+    return steps, offset
+
+
+class SolverLog(object):
+    """Parsed solver log time series, updated incrementally.
+
+    Usage::
+
+        log = SolverLog()
+        log.update()
+        df = log.load()
+    """
+    def __init__(self, logname="log.pimpleDyMFoam", casedir="./"):
+        self.log_path = os.path.join(casedir, logname)
+        self.cache_dir = get_cache_dir(logname, casedir)
+        self.state_path = os.path.join(self.cache_dir, "state.json")
+        self.load_state()
+
+    def reset(self):
+        self.offset = 0
+        self.nsteps = 0
+        self.fields = []
+        if os.path.isdir(self.cache_dir):
+            for fname in os.listdir(self.cache_dir):
+                os.remove(os.path.join(self.cache_dir, fname))
+
+    def load_state(self):
+        """Load the saved parse state, resetting if the log was truncated or
+        replaced."""
+        state = None
+        if os.path.isfile(self.state_path):
+            with open(self.state_path) as f:
+                state = json.load(f)
+        if state is None or not os.path.isfile(self.log_path) \
+                or os.path.getsize(self.log_path) < state["offset"]:
+            self.reset()
+            return
+        self.offset = state["offset"]
+        self.nsteps = state["nsteps"]
+        self.fields = state["fields"]
+
+    def save_state(self):
+        with open(self.state_path, "w") as f:
+            json.dump({"offset": self.offset, "nsteps": self.nsteps,
+                       "fields": self.fields}, f, indent=4)
+
+    @property
+    def columns(self):
+        return step_columns + ["{}_{}".format(field, s)
+                               for field in self.fields
+                               for s in field_suffixes]
+
+    def _column_path(self, column):
+        return os.path.join(self.cache_dir, column + ".f8")
+
+    def _write_chunk(self, chunk, offset):
+        """Append parsed steps to the sidecar files and save the state with
+        `offset`, the log offset after the last of them."""
+        # Fields first solved after earlier steps were written are backfilled
+        for step in chunk:
+            for field in step["fields"]:
+                if field not in self.fields:
+                    self.fields.append(field)
+                    for s in field_suffixes:
+                        column = "{}_{}".format(field, s)
+                        np.full(self.nsteps, np.nan).tofile(
+                                self._column_path(column))
+        data = {c: np.array([step[c] for step in chunk], dtype=float)
+                for c in step_columns}
+        for field in self.fields:
+            for s in field_suffixes:
+                data["{}_{}".format(field, s)] = np.array(
+                        [step["fields"][field][s]
+                         if field in step["fields"] else np.nan
+                         for step in chunk], dtype=float)
+        for column, values in data.items():
+            with open(self._column_path(column), "ab") as fout:
+                values.tofile(fout)
+        self.nsteps += len(chunk)
+        self.offset = offset
+        self.save_state()
+
+    def update(self, chunk_steps=10000):
+        """Parse time steps written since the last update and append them to
+        the sidecar files, `chunk_steps` at a time so memory use does not
+        depend on log size. Returns the number of new steps."""
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        nsteps = self.nsteps
+        chunk = []
+        with open(self.log_path, "rb") as f:
+            f.seek(self.offset)
+            for step, offset in iter_log_steps(f, self.offset):
+                chunk.append(step)
+                if len(chunk) == chunk_steps:
+                    self._write_chunk(chunk, offset)
+                    chunk = []
+        if chunk:
+            self._write_chunk(chunk, offset)
+        return self.nsteps - nsteps
+
+    def load(self, columns=None, mmap=True):
+        """Return parsed time series as a `DataFrame`, one row per time step.
+        Columns are memory-mapped unless `mmap` is `False`."""
+        if columns is None:
+            columns = self.columns
+        df = pd.DataFrame(index=np.arange(self.nsteps))
+        for column in columns:
+            fpath = self._column_path(column)
+            if self.nsteps == 0:
+                df[column] = np.zeros(0)
+            elif mmap:
+                df[column] = np.memmap(fpath, dtype=float, mode="r",
+                                       shape=(self.nsteps,))
+            else:
+                df[column] = np.fromfile(fpath, dtype=float,
+                                         count=self.nsteps)
+        return df
+
+
+def step_clock_times(clock_time):
+    """Return the wall-clock seconds spent in each step from cumulative
+    `ClockTime` values. The first step, which includes start-up, and the
+    first step after each restart, where `ClockTime` starts again from zero,
+    are NaN."""
+    clock_time = np.asarray(clock_time, dtype=float)
+    if len(clock_time) == 0:
+        return clock_time
+    dt = np.empty(len(clock_time))
+    dt[0] = np.nan
+    dt[1:] = np.diff(clock_time)
+    dt[1:][clock_time[1:] < clock_time[:-1]] = np.nan
+    return dt
+
+
+def load_solver_log(logname="log.pimpleDyMFoam", casedir="./", update=True):
+    """Load the solver log time series as a `DataFrame`, first parsing any
+    newly written time steps. A `step_clock_time` column with the wall-clock
+    seconds spent in each step is added (see `step_clock_times`). OpenFOAM
+    prints `ClockTime` in whole seconds, so only its means are meaningful
+    for short steps."""
+    log = SolverLog(logname, casedir)
+    if update:
+        log.update()
+    df = log.load(mmap=False)
+    df["step_clock_time"] = step_clock_times(df.clock_time.values)
+    return df
+
+
+def timing_summary(df):
+    """Summarize where wall-clock time goes from a `load_solver_log`
+    `DataFrame`. Returns a `Series` with the mean seconds per step, the
+    fraction of that spent in `mesh.update()`, the mean PIMPLE iterations
+    per step and the mean linear solver iterations per step of each field.
+    """
+    summary = pd.Series(dtype=float)
+    summary["steps"] = len(df)
+    # Steps without a clock time (start-up and restarts) are left out
+    timed = df[df.step_clock_time.notnull()]
+    summary["step_clock_time"] = timed.step_clock_time.mean()
+    summary["mesh_update_fraction"] = timed.mesh_update_time.mean() \
+                                    / timed.step_clock_time.mean()
+    summary["pimple_iters"] = df.pimple_iters.mean()
+    for column in df.columns:
+        if column.endswith("_iters") and column != "pimple_iters":
+            summary[column] = df[column].mean()
+    return summary
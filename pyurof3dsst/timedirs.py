@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""Index of the time directories of a case.
+
+Time names are parsed as numbers once, so `9.98` sorts before `10`. The
+files in each time directory, with their sizes and modification times, are
+kept in `postProcessing/cache/times.json`. A directory's mtime changes when
+entries are added to or removed from it, so on update only the case root
+and the (sub)directories of each time are statted, and only times whose
+directories changed are listed again.
+"""
+
+from __future__ import division, print_function
+import json
+import os
+
+
+def parse_time(name):
+    """Return the time value of a directory name, or `None` if it is not a
+    time name."""
+    try:
+        value = float(name)
+    except ValueError:
+        return None
+    # Exclude names like `nan`, `inf` or `1_000`
+    if not name[0].isdigit() or "_" in name or value != value:
+        return None
+    return value
+
+
+def list_times(directory="./", zero=False):
+    """Return the names of the time directories in `directory`, in
+    numerical order. Time `0` is only included if `zero` is `True`."""
+    times = []
+    for name in os.listdir(directory):
+        value = parse_time(name)
+        if value is None or (value == 0 and not zero):
+            continue
+        if os.path.isdir(os.path.join(directory, name)):
+            times.append((value, name))
+    return [name for value, name in sorted(times)]
+
+
+def latest_time(directory="./"):
+    """Return the name of the latest time directory in `directory`, or
+    `None` if there are none."""
+    times = list_times(directory, zero=True)
+    return times[-1] if times else None
+
+
+def _scan_time(time_dir):
+    """Return the mtimes of a time directory and its subdirectories, keyed
+    by relative path, and `[size, mtime]` of every file in them."""
+    dirs = {}
+    files = {}
+    for root, dirnames, fnames in os.walk(time_dir):
+        rel = os.path.relpath(root, time_dir)
+        dirs[rel] = os.stat(root).st_mtime
+        for fname in fnames:
+            st = os.stat(os.path.join(root, fname))
+            files[os.path.normpath(os.path.join(rel, fname))] = \
+                    [st.st_size, st.st_mtime]
+    return dirs, files
+
+
+class TimeIndex(object):
+    """Persistent index of the time directories of `casedir`.
+
+    Usage:
+        index = TimeIndex()
+        index.times()
+        index.has_file("U", index.latest())
+    """
+    def __init__(self, casedir="./",
+                 index_path="postProcessing/cache/times.json", update=True):
+        self.casedir = casedir
+        self.index_path = os.path.join(casedir, index_path)
+        self.load()
+        if update:
+            self.update()
+
+    def load(self):
+        self.case_mtime = None
+        self.entries = {}
+        if os.path.isfile(self.index_path):
+            try:
+                with open(self.index_path) as f:
+                    index = json.load(f)
+                self.case_mtime = index["case_mtime"]
+                self.entries = index["times"]
+            except (ValueError, KeyError):
+                self.case_mtime = None
+                self.entries = {}
+
+    def save(self):
+        index_dir = os.path.dirname(self.index_path)
+        if not os.path.isdir(index_dir):
+            os.makedirs(index_dir)
+        tmp_path = self.index_path + ".tmp{}".format(os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump({"case_mtime": self.case_mtime, "times": self.entries},
+                      f)
+        os.replace(tmp_path, self.index_path)
+
+    def update(self, save=True):
+        """Bring the index up to date with the case. Returns the list of
+        times added or changed since the last update."""
+        case_mtime = os.stat(self.casedir).st_mtime
+        if case_mtime != self.case_mtime:
+            names = list_times(self.casedir, zero=True)
+            self.entries = {name: self.entries.get(name) for name in names}
+            self.case_mtime = case_mtime
+        changed = []
+        for name, entry in self.entries.items():
+            time_dir = os.path.join(self.casedir, name)
+            if entry is not None:
+                try:
+                    if all(os.stat(os.path.join(time_dir, rel)).st_mtime
+                           == mtime for rel, mtime in entry["dirs"].items()):
+                        continue
+                except OSError:
+                    pass
+            self.rescan(name)
+            changed.append(name)
+        if save and (changed or not os.path.isfile(self.index_path)):
+            self.save()
+        return sorted(changed, key=float)
+
+    def rescan(self, time):
+        """List and stat a time directory again, e.g. after rewriting a file
+        in place, which does not change any directory mtime."""
+        name = str(time)
+        dirs, files = _scan_time(os.path.join(self.casedir, name))
+        self.entries[name] = {"value": parse_time(name), "dirs": dirs,
+                              "files": files}
+
+    def times(self, zero=False):
+        """Return the indexed time names in numerical order."""
+        return sorted((name for name, entry in self.entries.items()
+                       if zero or entry["value"] != 0),
+                      key=lambda name: self.entries[name]["value"])
+
+    def latest(self):
+        times = self.times(zero=True)
+        return times[-1] if times else None
+
+    def files(self, time):
+        """Return a dict of `[size, mtime]` keyed by path relative to the
+        time directory, e.g. `"U"` or `"uniform/time"`."""
+        return self.entries[str(time)]["files"]
+
+    def fields(self, time):
+        """Return the names of the files directly in a time directory."""
+        return sorted(f for f in self.files(time) if os.sep not in f)
+
+    def has_file(self, fname, time):
+        return fname in self.entries.get(str(time), {}).get("files", {})
+
+    def has_dir(self, dirname, time):
+        """Return whether a time directory has the subdirectory `dirname`,
+        e.g. `"polyMesh"`."""
+        return dirname in self.entries.get(str(time), {}).get("dirs", {})
+
+    def existing(self, names, time):
+        """Return those of `names`, files or subdirectories, that exist in a
+        time directory."""
+        return [n for n in names
+                if self.has_file(n, time) or self.has_dir(n, time)]
+
+    def times_with(self, fname):
+        """Return the times that contain `fname`, in numerical order."""
+        return [t for t in self.times(zero=True) if self.has_file(fname, t)]
+
+    def size(self, time=None):
+        """Return the total size in bytes of a time directory, or of all of
+        them."""
+        times = self.times(zero=True) if time is None else [str(time)]
+        return sum(size for t in times
+                   for size, mtime in self.files(t).values())
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""Finding and repairing empty or missing `uniform/time` files.
+
+Time directories of the case and of every `processor*` directory are taken
+from their `TimeIndex`es, updated in a thread pool since each stat is a round
+trip on a networked filesystem. Files the index records as empty or missing
+are checked again, and non-empty ones read in the pool. The indexes are
+refreshed for the times that were repaired. The `index`, `deltaT`
+and `deltaT0` of a broken file are taken from the same time in another
+directory if possible, otherwise counted from the solver log between the
+nearest valid times, otherwise extrapolated from the nearest valid time's
+`deltaT`, falling back to `deltaT` in `system/controlDict`.
+"""
+
+from __future__ import division, print_function
+import numpy as np
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from .fields import list_processor_dirs
+from .metadata import read_case_metadata
+from .solverlog import SolverLog
+from .timedirs import TimeIndex
+
+
+template = r"""/*--------------------------------*- C++ -*----------------------------------*\
+| =========                 |                                                 |
+| \\      /  F ield         | OpenFOAM: The Open Source CFD Toolbox           |
+|  \\    /   O peration     | Version:  2.3.x                                 |
+|   \\  /    A nd           | Web:      www.OpenFOAM.org                      |
+|    \\/     M anipulation  |                                                 |
+\*---------------------------------------------------------------------------*/
+FoamFile
+{{
+    version     2.0;
+    format      binary;
+    class       dictionary;
+    location    "{name}/uniform";
+    object      time;
+}}
+// * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * //
+
+value           {value};
+
+name            "{name}";
+
+index           {index};
+
+deltaT          {deltaT};
+
+deltaT0         {deltaT0};
+
+
+// ************************************************************************* //
+"""
+
+_time_entry_re = re.compile(r"^\s*(value|index|deltaT|deltaT0)\s+([^;]+);",
+                            re.M)
+
+
+def read_time_file(fpath):
+    """Return a dict of `value`, `index`, `deltaT` and `deltaT0` from a
+    `uniform/time` file, or `None` if it is missing, empty or incomplete."""
+    try:
+        with open(fpath) as f:
+            text = f.read()
+    except (IOError, OSError):
+        return None
+    entries = {}
+    for key, value in _time_entry_re.findall(text):
+        try:
+            entries[key] = int(value) if key == "index" else float(value)
+        except ValueError:
+            return None
+    if len(entries) < 4:
+        return None
+    return entries
+
+
+_time_file = os.path.join("uniform", "time")
+
+
+def time_indexes(casedir="./", processors=True, nthreads=16):
+    """Return up to date `TimeIndex`es of the case and, if `processors` is
+    `True`, of its `processor*` directories."""
+    roots = [casedir] + (list_processor_dirs(casedir) if processors else [])
+    with ThreadPoolExecutor(nthreads) as pool:
+        return list(pool.map(TimeIndex, roots))
+
+
+def _read_indexed_time_file(args):
+    path, size = args
+    if not size:
+        return None
+    return read_time_file(os.path.join(path, _time_file))
+
+
+def scan_time_files(casedir="./", processors=True, nthreads=16,
+                    indexes=None):
+    """Read the `uniform/time` file of every non-zero time directory of the
+    case and, if `processors` is `True`, of its `processor*` directories,
+    listed from `indexes` (by default from `time_indexes`). Returns a list
+    of `(time_dir, name, entries)`, with `entries` `None` for broken files.
+    """
+    if indexes is None:
+        indexes = time_indexes(casedir, processors, nthreads)
+    dirs = []
+    for index in indexes:
+        for name in index.times():
+            size = index.files(name).get(_time_file, [0])[0]
+            if not size:
+                # Files rewritten in place do not change directory mtimes
+                index.rescan(name)
+                size = index.files(name).get(_time_file, [0])[0]
+            dirs.append((name, os.path.join(index.casedir, name), size))
+    with ThreadPoolExecutor(nthreads) as pool:
+        entries = pool.map(_read_indexed_time_file,
+                           [(path, size) for name, path, size in dirs])
+        return [(path, name, e) for (name, path, size), e in zip(dirs,
+                                                                 entries)]
+
+
+def _log_steps(casedir, logname="log.pimpleDyMFoam"):
+    """Return the step end times and time steps from the solver log, or
+    empty arrays if there is no log."""
+    if not os.path.isfile(os.path.join(casedir, logname)):
+        return np.zeros(0), np.zeros(0)
+    log = SolverLog(logname, casedir)
+    log.update()
+    df = log.load(columns=["time", "delta_t"], mmap=False)
+    return df.time.values, df.delta_t.values
+
+
+def _log_steps_at(log_times, values):
+    """Return the index of the log step ending at each of `values`, or -1
+    where there is none."""
+    values = np.asarray(values, dtype=float)
+    tol = 1e-9*np.maximum(np.abs(values), 1)
+    steps = np.searchsorted(log_times, values - tol)
+    found = steps < len(log_times)
+    found[found] = np.abs(log_times[steps[found]] - values[found]) \
+                   <= tol[found]
+    return np.where(found, steps, -1)
+
+
+def plan_repairs(scan, casedir="./", logname="log.pimpleDyMFoam"):
+    """Return a list of repairs for the broken files in `scan` (from
+    `scan_time_files`), each a dict of `path`, `name`, the inferred `value`,
+    `index`, `deltaT` and `deltaT0` and their `source`."""
+    known = {name: e for path, name, e in scan if e is not None}
+    broken = [(path, name) for path, name, e in scan if e is None]
+    if not broken:
+        return []
+    names = sorted(known, key=float)
+    kvalues = np.array([known[n]["value"] for n in names])
+    kindex = np.array([known[n]["index"] for n in names], dtype=int)
+    kdt = np.array([known[n]["deltaT"] for n in names])
+    values = np.array([float(name) for path, name in broken])
+    # Nearest valid times before and after each broken one
+    after = np.searchsorted(kvalues, values)
+    before = after - 1
+    log_times, log_dt = _log_steps(casedir, logname)
+    steps = _log_steps_at(log_times, values)
+    # Steps can be counted from valid times in the log, or from the time the
+    # log starts at
+    kcovered = _log_steps_at(log_times, kvalues) >= 0
+    if len(log_times):
+        kcovered |= np.isclose(kvalues, log_times[0] - log_dt[0], rtol=1e-9)
+    kfirst = np.searchsorted(log_times,
+                             kvalues + 1e-9*np.maximum(np.abs(kvalues), 1))
+    controldict_dt = None
+    repairs = []
+    for i, (path, name) in enumerate(broken):
+        v, b, a, step = values[i], before[i], after[i], steps[i]
+        r = {"path": path, "name": name, "value": v}
+        if name in known:
+            e = known[name]
+            r.update(index=e["index"], deltaT=e["deltaT"],
+                     deltaT0=e["deltaT0"], source="same time")
+        elif step >= 0 and b >= 0 and kcovered[b]:
+            # Count the steps in the log since the valid time
+            r.update(index=int(kindex[b] + step - kfirst[b] + 1),
+                     deltaT=log_dt[step],
+                     deltaT0=log_dt[step - 1] if step else log_dt[step],
+                     source="log")
+        elif b >= 0 or a < len(names):
+            # Assume a constant time step from the nearest valid time
+            n = b if b >= 0 else a
+            dt = kdt[n]
+            r.update(index=int(kindex[n] + round((v - kvalues[n])/dt)),
+                     deltaT=dt, deltaT0=dt,
+                     source="neighbour {}".format(names[n]))
+        else:
+            if controldict_dt is None:
+                controldict_dt = read_case_metadata(
+                        casedir, files=["system/controlDict"]).delta_t
+            dt = controldict_dt
+            r.update(index=int(round(v/dt)), deltaT=dt, deltaT0=dt,
+                     source="controlDict")
+        repairs.append(r)
+    return repairs
+
+
+def _write_repair(r):
+    uniform_dir = os.path.join(r["path"], "uniform")
+    if not os.path.isdir(uniform_dir):
+        os.makedirs(uniform_dir)
+    fpath = os.path.join(uniform_dir, "time")
+    with open(fpath + ".tmp", "w") as f:
+        f.write(template.format(name=r["name"], value=r["name"],
+                                index=r["index"],
+                                deltaT="{:.10g}".format(r["deltaT"]),
+                                deltaT0="{:.10g}".format(r["deltaT0"])))
+    os.replace(fpath + ".tmp", fpath)
+    return fpath
+
+
+def fix_times(casedir="./", dry_run=False, processors=True, nthreads=16,
+              verbose=True):
+    """Find broken `uniform/time` files, print the plan and, unless
+    `dry_run`, write the repairs. Returns the list of repairs."""
+    indexes = time_indexes(casedir, processors, nthreads)
+    scan = scan_time_files(casedir, processors=processors, nthreads=nthreads,
+                           indexes=indexes)
+    repairs = plan_repairs(scan, casedir=casedir)
+    if verbose:
+        print("Scanned {} time directories, {} to fix".format(len(scan),
+                                                             len(repairs)))
+        for r in repairs:
+            print("{}: index {}, deltaT {:.10g}, deltaT0 {:.10g} ({})".format(
+                    os.path.join(r["path"], "uniform", "time"), r["index"],
+                    r["deltaT"], r["deltaT0"], r["source"]))
+    if repairs and not dry_run:
+        with ThreadPoolExecutor(nthreads) as pool:
+            list(pool.map(_write_repair, repairs))
+        by_path = {os.path.join(index.casedir, name): index
+                   for index in indexes for name in index.times()}
+        for r in repairs:
+            by_path[r["path"]].rescan(r["name"])
+    for index in indexes:
+        index.save()
+    return repairs
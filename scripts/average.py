@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+"""Time average the written fields after t = 5 s.
+
+Usage: python scripts/average.py [time_start]
+
+Means of `U`, `p`, `nut` and `k` and `UPrime2Mean` are written to the latest
+time directory only. Accumulators are kept in `postProcessing/cache/average`,
+so running this again only reads the times written since.
+"""
+
+import sys
+sys.path.append(".")
+import os
+from pyurof3dsst.averaging import average_fields
+
+if __name__ == "__main__":
+    if os.path.split(os.getcwd())[-1] == "scripts":
+        print("Changing working directory to case root directory")
+        os.chdir("../")
+    time_start = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    average_fields(time_start=time_start)
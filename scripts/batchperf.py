@@ -0,0 +1,14 @@
+#!/usr/bin/env python
+"""Log performance of many case directories to one table.
+
+Usage: python scripts/batchperf.py "path/to/cases/*" [more cases...]
+
+Cases whose inputs have not changed since the last batch are skipped.
+"""
+
+import sys
+sys.path.append(".")
+from pyurof3dsst.batch import batch_log_perf
+
+if __name__ == "__main__":
+    batch_log_perf(sys.argv[1:])
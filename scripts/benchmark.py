@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+"""Benchmark the post-processing functions on a synthetic case.
+
+Usage: python scripts/benchmark.py [small|medium|large] [--repeat=N]
+                                   [--threshold=X] [--no-save]
+
+Results are appended to `processed/benchmarks.json` and compared with the
+previous run at the same scale. Benchmarks more than `threshold` (default
+1.2) times slower are reported as regressions, and the exit status is 1.
+"""
+
+import sys
+sys.path.append(".")
+import os
+from pyurof3dsst import benchmark
+
+if __name__ == "__main__":
+    if os.path.split(os.getcwd())[-1] == "scripts":
+        print("Changing working directory to case root directory")
+        os.chdir("../")
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    opts = dict(a[2:].split("=", 1) for a in sys.argv[1:]
+                if a.startswith("--") and "=" in a)
+    scale = args[0] if args else "small"
+    run = benchmark.run_benchmarks(scale, repeat=int(opts.get("repeat", 3)))
+    previous = benchmark.last_run(benchmark.load_results(), scale)
+    if "--no-save" not in sys.argv:
+        benchmark.save_results(run)
+    if previous is not None:
+        print("\nCompared with run of {}:".format(previous["date"]))
+        regressions = benchmark.compare_runs(
+                run, previous, threshold=float(opts.get("threshold", 1.2)))
+        if regressions:
+            sys.exit(1)
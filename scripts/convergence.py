@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+"""Check statistical convergence of per-revolution C_P and C_D.
+
+Usage: python scripts/convergence.py [tolerance] [--stop]
+
+The tolerance is relative to the mean (default 0.01). With `--stop`, a
+converged run is stopped at its next write time by editing `endTime` in
+`system/controlDict`. Performance is updated incrementally first.
+"""
+
+import sys
+sys.path.append(".")
+from pyurof3dsst.processing import calc_perf
+from pyurof3dsst.convergence import stop_if_converged
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    tol = float(args[0]) if args else 0.01
+    calc_perf(verbose=False, incremental=True)
+    stop_if_converged(tol=tol, stop="--stop" in sys.argv)
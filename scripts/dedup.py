@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""Archive time directories into a deduplicating chunk store.
+
+Usage:
+    python scripts/dedup.py add [times...]
+    python scripts/dedup.py extract time [files...]
+    python scripts/dedup.py list
+
+The store is kept in `archive` in the case directory. `add` stores the
+fields uploaded by `upload-figshare.py` for the given times, or for every
+time not yet stored. `extract` restores a time, or only some of its files,
+into the case directory.
+"""
+
+import sys
+sys.path.append(".")
+import os
+from pyurof3dsst.chunkstore import ChunkStore
+from pyurof3dsst.timedirs import TimeIndex
+
+store_dir = "archive"
+fields = ["U", "p", "k", "nut", "uniform", "polyMesh"]
+
+
+if __name__ == "__main__":
+    if os.path.split(os.getcwd())[-1] == "scripts":
+        print("Changing working directory to case root directory")
+        os.chdir("../")
+    cmd, args = sys.argv[1], sys.argv[2:]
+    store = ChunkStore(store_dir)
+    if cmd == "add":
+        stored = set(store.names())
+        index = TimeIndex()
+        times = args or [t for t in index.times() if t not in stored]
+        for t in times:
+            files = index.existing(fields, t)
+            s = store.add_dir(t, files=files)
+            print("{}: {:.1f} MB, {:.1f} MB new".format(t, s["size"]/1e6,
+                                                        s["new_bytes"]/1e6))
+    elif cmd == "extract":
+        store.extract(args[0], files=args[1:] or None, verbose=True)
+    elif cmd == "list":
+        for name in store.names():
+            print(name)
+        s = store.stats()
+        print("{:.1f} MB stored for {:.1f} MB of files ({:.1f}x)".format(
+                s["stored"]/1e6, s["size"]/1e6, s["ratio"]))
+    else:
+        print(__doc__)
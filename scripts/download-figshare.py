@@ -1,29 +1,27 @@
 #!/usr/bin/env python
 """Download case results from Figshare.
 
-The `wget` Python module can be installed via
-
-    pip install wget
+The file list is fetched once and cached in `constant/files.json` (and
+`constant/urls.json`). Files are downloaded concurrently, resuming any
+partial downloads, verified by size and MD5, and archives are extracted as
+soon as they arrive. Pass `--refresh` to fetch the file list again.
 """
 
 from __future__ import division, print_function
-import requests
-import tarfile
-import json
-import os
-import re
-import wget
 import sys
+sys.path.append(".")
+import os
+from pyurof3dsst import figshare
 
 
 article = "2885308"
-BASE_URL = "https://api.figshare.com/v2/{endpoint}"
+BASE_URL = figshare.BASE_URL
 
 
 def get_article_details():
     endpoint = "articles/{}".format(article)
-    resp = requests.get(BASE_URL.format(endpoint=endpoint))
-    return json.loads(resp.content.decode())
+    resp = figshare.requests.get(BASE_URL.format(endpoint=endpoint))
+    return resp.json()
 
 
 def get_uploaded_files():
@@ -32,27 +30,22 @@ def get_uploaded_files():
 
 
 def get_uploaded_filenames():
-    flist = get_uploaded_files()
-    return [f["name"] for f in flist]
+    return sorted(figshare.load_manifest(article))
 
 
 def get_remote_url(filename):
     """Return remote URL for downloading file."""
-    files = get_uploaded_files()
-    base = "https://ndownloader.figshare.com/files/{id}"
-    remote_urls = {f["name"]: base.format(id=f["id"]) for f in files}
-    return remote_urls[filename]
+    return figshare.load_manifest(article)[filename]["url"]
 
 
 def download_file(filename):
-    """Download remote file using the `wget` Python module."""
-    url = get_remote_url(filename)
-    wget.download(url, out=filename)
+    """Download and verify a remote file."""
+    m = figshare.load_manifest(article)[filename]
+    figshare.download_file(m["url"], filename, size=m["size"], md5=m["md5"])
 
 
 def uncompress_file(filename):
-    with tarfile.open(filename, "r:gz") as tf:
-        tf.extractall()
+    figshare.extract_archive(filename, remove=False)
 
 
 def test_download_file(fname="0.02.gz"):
@@ -66,27 +59,10 @@ if __name__ == "__main__":
         print("Changing working directory to case root directory")
         os.chdir("../")
 
-    # Create list of local files and directories
-    local_items = os.listdir("./")
-
-    # Create list of files on Figshare
-    remote_files = get_uploaded_filenames()
-
-    # If filename(s) are passed to script, download those
-    if len(sys.argv) > 1:
-        flist = sys.argv[1:]
-    else:
-        flist == remote_files
-
-    for f in flist:
-        # File name could end with ".gz"
-        if not f in local_items and not f[:-3] in local_items:
-            print("Downloading {}".format(f))
-            download_file(f)
-            if f.endswith(".gz"):
-                print("Uncompressing {}".format(f))
-                uncompress_file(f)
-                print("Deleting local copy of {}".format(f))
-                os.remove(f)
-        else:
-            print("{} already exists".format(f))
+    args = [a for a in sys.argv[1:] if a != "--refresh"]
+
+    # If filename(s) are passed to script, download those, otherwise all
+    flist = args if args else None
+
+    figshare.download_all(article, names=flist,
+                          refresh="--refresh" in sys.argv)
@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+"""Make the figures of one or more cases.
+
+Usage: python scripts/figures.py [--force] [--png] [cases...]
+
+Cases default to the current directory. Figures are saved to
+`<case>/figures`, and figures whose data and parameters have not changed
+since the last run are skipped unless `--force` is given.
+"""
+
+import sys
+sys.path.append(".")
+from pyurof3dsst.figures import make_all_figures
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    make_all_figures(args or "./", force="--force" in sys.argv,
+                     savetype=".png" if "--png" in sys.argv else ".pdf")
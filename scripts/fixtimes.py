@@ -1,73 +1,27 @@
 #!/usr/bin/env python
 """
-This script looks through the time directories for empty files and creates
-time files if necessary.
+This script looks through the time directories, including those in
+`processor*`, for empty or missing `uniform/time` files and recreates them,
+inferring `index` and `deltaT` from valid neighbouring times or the solver
+log.
+
+Usage: python scripts/fixtimes.py [--dry-run] [--no-processors]
+
+The planned repairs are printed before anything is written. With `--dry-run`
+nothing is written.
 """
 
 from __future__ import division, print_function
+import sys
+sys.path.append(".")
 import os
+from pyurof3dsst.timefiles import fix_times
 
 
-def is_time_dir(d):
-    """Detect if a directory name is a non-zero time directory."""
-    try:
-        float(d)
-    except ValueError:
-        return False
-    return d != "0"
-
-def get_dirs():
-    """Gets all local subdirectories."""
-    return [name for name in os.listdir("./") if os.path.isdir(name)]
-    
-def is_empty(fname):
-    """Tests if a file is empty or doesn't existy."""
-    try:
-        size = os.stat(fname).st_size
-    except FileNotFoundError:
-        return True
-    return size == 0
-    
-    
-text = r"""/*--------------------------------*- C++ -*----------------------------------*\
-| =========                 |                                                 |
-| \\      /  F ield         | OpenFOAM: The Open Source CFD Toolbox           |
-|  \\    /   O peration     | Version:  2.3.x                                 |
-|   \\  /    A nd           | Web:      www.OpenFOAM.org                      |
-|    \\/     M anipulation  |                                                 |
-\*---------------------------------------------------------------------------*/
-FoamFile
-{{
-    version     2.0;
-    format      binary;
-    class       dictionary;
-    location    "{value}/uniform";
-    object      time;
-}}
-// * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * //
-
-value           {value};
-
-name            "{value}";
-
-index           {index};
-
-deltaT          {dt};
-
-deltaT0         {dt};
-
-
-// ************************************************************************* //
-"""
-
 if __name__ == "__main__":
-    dirs = get_dirs()
-    dirs = [d for d in dirs if is_time_dir(d)]
-    for d in dirs:
-        fname = os.path.join(d, "uniform", "time")
-        if is_empty(fname):
-            print("Fixing {}".format(fname))
-            with open(fname, "w") as f:
-                i = int(float(d)/0.002)
-                f.write(text.format(value=d, dt=0.002, index=i))
+    if os.path.split(os.getcwd())[-1] == "scripts":
+        print("Changing working directory to case root directory")
+        os.chdir("../")
+    fix_times(dry_run="--dry-run" in sys.argv,
+              processors="--no-processors" not in sys.argv)
     print("End")
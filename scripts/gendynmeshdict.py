@@ -1,14 +1,44 @@
 #!/usr/bin/env python
 """Generate the dynamic mesh dictionary with periodic `omega`
 
-`omega` fluctuates with 3 periods per rotation, and a phase shift to put
-the first peak at 80 degrees, to match experiments
+Usage: python scripts/gendynmeshdict.py [meantsr] [--fit=tsr.csv] [--tol=1e-3]
+
+By default `omega` fluctuates with 3 periods per rotation, and a phase shift
+to put the first peak at 80 degrees, to match experiments. With `--fit`, the
+mean and 6 harmonics are instead fitted to the `time` and `tsr` columns of a
+CSV file of a measured TSR time series. The table runs to `endTime`, with
+linear interpolation error below `tol` rad/s.
 """
 
-import foampy
+from __future__ import division, print_function
+import sys
+sys.path.append(".")
+import os
+import numpy as np
+import pandas as pd
+from pyurof3dsst.motion import OmegaSpectrum, write_motion
 
 U = 1.0
 R = 0.5
 meantsr = 1.9
+rpm_fluc = 3.7
 
-foampy.gen_dynmeshdict(U, R, meantsr, cellzone="AMIsurface", npoints=400)
+if __name__ == "__main__":
+    if os.path.split(os.getcwd())[-1] == "scripts":
+        print("Changing working directory to case root directory")
+        os.chdir("../")
+    opts = dict(a[2:].split("=", 1) for a in sys.argv[1:]
+                if a.startswith("--"))
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if "fit" in opts:
+        df = pd.read_csv(opts["fit"])
+        spectrum = OmegaSpectrum.fit(df.time, df.tsr, U_infty=U, R=R)
+    else:
+        if args:
+            meantsr = float(args[0])
+        spectrum = OmegaSpectrum.from_tsr(
+                meantsr, U, R, harmonics={3: (rpm_fluc*2*np.pi/60,
+                                              -np.pi/1.2)})
+    npoints = write_motion(spectrum, tol=float(opts.get("tol", 1e-3)))
+    print("Wrote omega table with {} points for mean TSR {:.4f}".format(
+          npoints, spectrum.omega_mean*R/U))
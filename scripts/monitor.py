@@ -0,0 +1,14 @@
+#!/usr/bin/env python
+"""Monitor a running simulation, printing per-revolution performance and
+solver speed every `interval` seconds (default 30).
+
+Usage: python scripts/monitor.py [interval]
+"""
+
+import sys
+sys.path.append(".")
+from pyurof3dsst.monitor import monitor
+
+if __name__ == "__main__":
+    interval = float(sys.argv[1]) if len(sys.argv) > 1 else 30.0
+    monitor(interval=interval)
@@ -1,8 +1,14 @@
 #!/usr/bin/env python
-"""Calculate turbine performance and print to the terminal."""
+"""Calculate turbine performance and print to the terminal.
+
+Pass `--incremental` to only parse forces output written since the last
+incremental call, e.g., when polling a running simulation.
+"""
 
 import sys
 sys.path.append(".")
 from pyurof3dsst.processing import calc_perf
 
-calc_perf(plot=False, export_csv=True)
+incremental = "--incremental" in sys.argv[1:]
+
+calc_perf(plot=False, export_csv=True, incremental=incremental)
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+"""Compute mean momentum recovery terms at x = 1.0 m from the mean fields.
+
+Usage: python scripts/recovery.py [x] [--resolved]
+
+Plane averages are printed and saved to `processed/recovery_terms.json`,
+where `read_funky_log` finds them when there are no `funkyDoCalc` logs. With
+`--resolved`, transport by the resolved Reynolds stresses is added as
+`turb_trans_resolved`.
+"""
+
+from __future__ import division, print_function
+import sys
+sys.path.append(".")
+import os
+from pyurof3dsst.recovery import calc_recovery_terms, save_recovery_terms, \
+                                 term_names, resolved_term_name
+
+if __name__ == "__main__":
+    if os.path.split(os.getcwd())[-1] == "scripts":
+        print("Changing working directory to case root directory")
+        os.chdir("../")
+    args = [a for a in sys.argv[1:] if a != "--resolved"]
+    x = float(args[0]) if args else 1.0
+    terms = calc_recovery_terms(x=x, resolved="--resolved" in sys.argv)
+    for name in term_names + [resolved_term_name]:
+        if name in terms:
+            print("{} = {}".format(name, terms[name]))
+    save_recovery_terms(terms)
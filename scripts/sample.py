@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+"""Sample cross-stream profiles of the mean fields at the latest time.
+
+Usage: python scripts/sample.py [x]
+
+Writes the same `postProcessing/sets/<time>/profile_<z>_<field>.xy` files as
+`scripts/gensampledict.py` followed by `sample`, without OpenFOAM. Profiles
+are sampled at x = 1.0 m unless `x` is given.
+"""
+
+from __future__ import division, print_function
+import sys
+sys.path.append(".")
+import os
+from pyurof3dsst.sampling import Sampler, write_sets
+
+if __name__ == "__main__":
+    if os.path.split(os.getcwd())[-1] == "scripts":
+        print("Changing working directory to case root directory")
+        os.chdir("../")
+    x = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    sampler = Sampler()
+    write_sets(sampler.sample_profiles(x=x), sampler.time)
+    print("Sampled profiles at x = {} m for t = {}".format(x, sampler.time))
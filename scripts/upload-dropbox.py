@@ -1,17 +1,21 @@
 #!/usr/bin/env python
 """Upload case results to Dropbox
 
-Needs an access token to do so.
+Needs an access token to do so. Directories are tarred and gzipped on all
+cores and streamed to Dropbox in chunks, so no archive is written to disk.
 """
 
 from __future__ import division, print_function
+import sys
+sys.path.append(".")
 from dropbox.client import DropboxClient
 from dropbox.rest import ErrorResponse
 import subprocess
-import tarfile
 import json
 import os
-import re
+import io
+from pyurof3dsst.archive import ChunkedUploadStream, stream_archive
+from pyurof3dsst.timedirs import TimeIndex
 
 
 def upload_file(client, filename, dbdir):
@@ -32,17 +36,17 @@ def get_token():
     return token
 
 
-def get_local_dir_list():
+def get_local_dir_list(index=None):
     """Create list of local directories to compress and upload."""
-    local_items = os.listdir("./")
-    local_dir_list = []
-    for f in local_items:
-        if re.match("^\d+$", f) or re.match("^\d+\.\d+$", f) or \
-                f in ["constant", "postProcessing", "log.pimpleDyMFoam"]:
-            if os.path.isdir(f) or f == "log.pimpleDyMFoam":
-                local_dir_list.append(f)
-    local_dir_list.remove("0")
-    return sorted(local_dir_list)
+    if index is None:
+        index = TimeIndex()
+    local_dir_list = index.times()
+    for f in ["constant", "postProcessing"]:
+        if os.path.isdir(f):
+            local_dir_list.append(f)
+    if os.path.isfile("log.pimpleDyMFoam"):
+        local_dir_list.append("log.pimpleDyMFoam")
+    return local_dir_list
 
 
 def get_dropbox_contents(client, dbdir):
@@ -63,13 +67,30 @@ def get_dropbox_filelist(client, dbdir):
     return dbfilelist
 
 
+def upload_dir(client, directory, dbdir, files="all", chunksize=2**23):
+    """Compress a directory and upload it as `<directory>.gz` in chunks as
+    the archive is produced, without writing it to disk."""
+    upload = {"id": None}
+
+    def upload_chunk(index, offset, data):
+        # Chunks arrive in order since the stream has one uploader thread
+        while True:
+            try:
+                new_offset, upload["id"] = client.upload_chunk(
+                        io.BytesIO(data), len(data), offset, upload["id"])
+                break
+            except ErrorResponse as e:
+                print(e)
+
+    with ChunkedUploadStream(upload_chunk, chunksize=chunksize) as stream:
+        stream_archive(directory, stream, files=files)
+    client.commit_chunked_upload(os.path.join(dbdir, directory + ".gz"),
+                                 upload["id"])
+
+
 def compress_dir(directory, files="all"):
-    with tarfile.open(directory+".gz", "w:gz") as tf:
-        if files == "all":
-            files = os.listdir(directory)
-        for f in files:
-            print("Adding {} to {}".format(f, directory + ".gz"))
-            tf.add(os.path.join(directory, f))
+    with open(directory+".gz", "wb") as f:
+        stream_archive(directory, f, files=files)
 
 
 if __name__ == "__main__":
@@ -83,7 +104,8 @@ if __name__ == "__main__":
     client = DropboxClient(token)
 
     # Create list of local directories
-    local_dirs = get_local_dir_list()
+    index = TimeIndex()
+    local_dirs = get_local_dir_list(index)
     local_files = [d + ".gz" for d in local_dirs]
 
     # Create list of files on Dropbox
@@ -95,17 +117,13 @@ if __name__ == "__main__":
         else:
             f = d
         if not f in db_files:
-            print("Compressing {}".format(d))
+            print("Uploading {}".format(f))
             if f != "constant.gz" and f != "postProcessing.gz" and f != "log.pimpleDyMFoam":
-                compress_dir(d, files=["U", "p", "k", "nut", "uniform", "polyMesh"])
+                upload_dir(client, d, dbdir, files=index.existing(
+                        ["U", "p", "k", "nut", "uniform", "polyMesh"], d))
             elif f == "log.pimpleDyMFoam":
-                pass
+                upload_file(client, f, dbdir)
             else:
-                compress_dir(d)
-            print("Uploading {}".format(f))
-            upload_file(client, f, dbdir)
-            if f != "log.pimpleDyMFoam":
-                print("Deleting local copy of {}".format(f))
-                os.remove(f)
+                upload_dir(client, d, dbdir)
         else:
             print("{} already uploaded".format(f))
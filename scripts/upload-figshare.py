@@ -4,20 +4,31 @@
 It should be run with a `.figsharerc` file in the user's home directory.
 `article` must be an existing article on Figshare created for this dataset.
 
-Note that no error checking is done, so if a file upload is incomplete, the
-only way to know is to inspect the article on the Figshare web interface.
+Parts of each file are uploaded concurrently and verified by checksum (see
+`pyurof3dsst.figshare`). Progress is journaled in `.upload-journal`, so if
+the job is killed, running the script again resumes unfinished uploads.
+Directories are tarred and gzipped on all cores while they are uploaded, so
+no archive is written to disk.
 """
 
 from __future__ import division, print_function
-import requests
+import sys
+sys.path.append(".")
 import os
 import json
-import tarfile
-import re
+from pyurof3dsst.figshare import FigshareClient
+from pyurof3dsst.archive import stream_archive
+from pyurof3dsst.timedirs import TimeIndex
 
 
 article = "2885308"
 
+# Publish after this many bytes have been uploaded to stay within the
+# private storage limit
+publish_bytes = 10*2**30
+
+_client = None
+
 
 def load_credentials():
     with open(os.path.join(os.path.expanduser("~"), ".figsharerc")) as f:
@@ -25,13 +36,17 @@ def load_credentials():
     return cred
 
 
+def get_client():
+    """Return a client shared by all uploads, reading the token once."""
+    global _client
+    if _client is None:
+        token = load_credentials()["personal_token"]
+        _client = FigshareClient(article, token=token)
+    return _client
+
+
 def get_article_details():
-    BASE_URL = "https://api.figshare.com/v2/{endpoint}"
-    TOKEN = load_credentials()["personal_token"]
-    HEADERS = {"Authorization": "token " + TOKEN}
-    endpoint = "account/articles/{}".format(article)
-    resp = requests.get(BASE_URL.format(endpoint=endpoint), headers=HEADERS)
-    return json.loads(resp.content.decode())
+    return get_client().get_article_details()
 
 
 def get_uploaded_files():
@@ -44,17 +59,17 @@ def get_uploaded_filenames():
     return [f["name"] for f in flist]
 
 
-def make_local_items_list():
+def make_local_items_list(index=None):
     """Create list of local items to compress and upload."""
-    local_items = os.listdir("./")
-    local_items_list = []
-    for f in local_items:
-        if re.match("^\d+$", f) or re.match("^\d+\.\d+$", f) or \
-                f in ["constant", "postProcessing", "log.pimpleDyMFoam"]:
-            if os.path.isdir(f) or f == "log.pimpleDyMFoam":
-                local_items_list.append(f)
-    local_items_list.remove("0")
-    return sorted(local_items_list)
+    if index is None:
+        index = TimeIndex()
+    local_items_list = index.times()
+    for f in ["constant", "postProcessing"]:
+        if os.path.isdir(f):
+            local_items_list.append(f)
+    if os.path.isfile("log.pimpleDyMFoam"):
+        local_items_list.append("log.pimpleDyMFoam")
+    return local_items_list
 
 
 def get_remote_urls(write=True):
@@ -70,80 +85,61 @@ def get_remote_urls(write=True):
 def upload_file(fpath_local, fpath_remote=None, client=None, oauth=None,
                 verbose=True):
     """Upload a file using the Figshare v2 API."""
-    if fpath_remote is None:
-        fpath_remote = fpath_local
-
-    # Below from Figshare API v2 documentation example
-    BASE_URL = "https://api.figshare.com/v2/{endpoint}"
-    TOKEN = load_credentials()["personal_token"]
-    HEADERS = {"Authorization": "token " + TOKEN}
-    article_id = str(article)
-
-    # Get file info
-    with open(fpath_local, "rb") as fin:
-        fin.seek(0, 2)  # Go to end of file
-        size = fin.tell()
-    data = json.dumps({"name": fpath_remote, "size": size})
+    if client is None:
+        client = get_client()
+    return client.upload_file(fpath_local, fpath_remote)
 
-    # Initiate upload
-    endpoint = "account/articles/{}/files".format(article_id)
-    resp = requests.post(BASE_URL.format(endpoint=endpoint),
-                         headers=HEADERS, data=data)
 
-    file_id = json.loads(resp.content.decode())["location"].rsplit("/", 1)[1]
-
-    # Get upload/parts info
-    endpoint = "account/articles/{}/files/{}".format(article_id, file_id)
-    resp = requests.get(BASE_URL.format(endpoint=endpoint), headers=HEADERS)
-
-    url = "{upload_url}".format(**json.loads(resp.content.decode()))
-    parts = json.loads(requests.get(url).content.decode())["parts"]
-
-    # Upload parts
-    with open(fpath_local, "rb") as fin:
-        for part in parts:
-            size = part["endOffset"] - part["startOffset"] + 1
-            address = "{}/{}".format(url, part["partNo"])
-            requests.put(address, data=fin.read(size))
-
-    # Mark file upload as completed
-    requests.post(BASE_URL.format(endpoint=endpoint), headers=HEADERS)
+def upload_dir(directory, files="all", client=None):
+    """Compress a directory and upload it as `<directory>.gz` without
+    writing the archive to disk. Returns the Figshare file ID."""
+    if client is None:
+        client = get_client()
+    write_to = lambda f: stream_archive(directory, f, files=files)
+    return client.upload_stream(write_to, directory + ".gz")
 
 
 def upload_all(overwrite=False):
     """Upload all files to Figshare."""
     # Create list of local items
-    local_items = make_local_items_list()
+    index = TimeIndex()
+    local_items = make_local_items_list(index)
     local_files = [d + ".gz" for d in local_items]
 
     # Create list of files on Figshare
     uploaded_files = get_uploaded_filenames()
 
-    # Iterate through local items, compress directories if necessary, and
-    # upload if not already present
+    # Iterate through local items and upload if not already present,
+    # compressing directories on the fly
+    unpublished_bytes = 0
     for d in local_items:
         if d != "log.pimpleDyMFoam":
             f = d + ".gz"
         else:
             f = d
         if not f in uploaded_files:
-            print("Compressing {}".format(d))
-            if f != "constant.gz" and f != "postProcessing.gz" and f != \
-                    "log.pimpleDyMFoam":
-                compress_dir(d, files=["U", "p", "k", "nut", "uniform",
-                                       "polyMesh"])
-            elif f == "log.pimpleDyMFoam":
-                pass
-            else:
-                compress_dir(d)
             print("Uploading {}".format(f))
-            upload_file(f)
-            make_article_public()
-            if f != "log.pimpleDyMFoam":
-                print("Deleting local copy of {}".format(f))
-                os.remove(f)
+            if os.path.isfile(f):
+                # The log, or an archive left by an older version of this
+                # script
+                file_id = upload_file(f)
+                if f != "log.pimpleDyMFoam":
+                    print("Deleting local copy of {}".format(f))
+                    os.remove(f)
+            elif f != "constant.gz" and f != "postProcessing.gz":
+                file_id = upload_dir(d, files=index.existing(
+                        ["U", "p", "k", "nut", "uniform", "polyMesh"], d))
+            else:
+                file_id = upload_dir(d)
+            unpublished_bytes += get_client().get_file_details(
+                    file_id)["size"]
+            if unpublished_bytes >= publish_bytes:
+                make_article_public()
+                unpublished_bytes = 0
         else:
             print("{} already uploaded".format(f))
+    if unpublished_bytes:
+        make_article_public()
 
 
 def test_upload_file():
@@ -169,24 +165,16 @@ def make_article_public():
     """Make the article public on Figshare. Must be done to avoid storage
     limits, and plus, this is the point.
     """
-    # Below from Figshare API v2 documentation example
-    BASE_URL = "https://api.figshare.com/v2/{endpoint}"
-    TOKEN = load_credentials()["personal_token"]
-    HEADERS = {"Authorization": "token " + TOKEN}
-    article_id = str(article)
-    # Publish
-    endpoint = "account/articles/{}/publish".format(article_id)
-    resp = requests.post(BASE_URL.format(endpoint=endpoint), headers=HEADERS)
+    get_client().make_article_public()
 
 
 def compress_dir(directory, files="all"):
-    """Compress a directory to a tarfile."""
-    with tarfile.open(directory+".gz", "w:gz") as tf:
-        if files == "all":
-            files = os.listdir(directory)
-        for f in files:
-            print("Adding {} to {}".format(f, directory + ".gz"))
-            tf.add(os.path.join(directory, f))
+    """Compress a directory to a tarfile on disk. The archive is written
+    under a temporary name first, so a complete `.gz` is never confused with
+    one from an interrupted job."""
+    with open(directory+".gz.tmp", "wb") as f:
+        stream_archive(directory, f, files=files)
+    os.replace(directory+".gz.tmp", directory+".gz")
 
 
 if __name__ == "__main__":